@@ -9,6 +9,8 @@ from discord.ext import commands
 from helpers.misc import maximize_size
 from config_handler import ConfigHandler
 from database_handler import DatabaseHandler
+from helpers.sharding import ShardPartition
+from helpers.action_scheduler import ActionScheduler, PRIORITY_NOTIFICATION, channel_messages_route
 from helpers import logger_handlers, embed_handler
 from helpers.licence_helper import get_current_time
 
@@ -32,11 +34,43 @@ startup_extensions = [
     # "top_gg_api",
 ]
 
+# Member cache modes, set with "member_cache_mode" in config.
+# Full caches every member of every guild (discord.py default).
+# Licensed caches only members that have a licensed role, others are looked up when needed.
+MEMBER_CACHE_FULL = "full"
+MEMBER_CACHE_LICENSED = "licensed"
 
-class Bot(commands.Bot):
+
+class Bot(commands.AutoShardedBot):
     def __init__(self, **kwargs):
         self.config = ConfigHandler("config")
-        self.main_db = asyncio.get_event_loop().run_until_complete(DatabaseHandler.create_instance())
+        # If shard count is not set Discord decides it and this process runs all of the shards.
+        # Shard ids are set when shards are split between multiple processes.
+        shard_count = kwargs.pop("shard_count", self.config.get("shard_count"))
+        shard_ids = kwargs.pop("shard_ids", self.config.get("shard_ids"))
+        self.shard_partition = ShardPartition(shard_count, shard_ids)
+        self.main_db = asyncio.get_event_loop().run_until_complete(
+            DatabaseHandler.create_instance(
+                connection_profile=self.config.get("database", {}),
+                reader_pool_size=self.config.get("database_reader_pool_size", 2),
+                shard_partition=self.shard_partition,
+                license_hash_secret=self.config.get("license_hash_secret")
+            )
+        )
+        # Connection to the cluster coordinator if ran by cluster.py, None otherwise
+        self.cluster = kwargs.pop("cluster", None)
+        if self.cluster is not None:
+            asyncio.get_event_loop().run_until_complete(self.cluster.connect())
+        self.action_scheduler = ActionScheduler(route_limits=self.config.get("action_route_limits", {}))
+        self.member_cache_mode = self.config.get("member_cache_mode", MEMBER_CACHE_FULL)
+        if self.member_cache_mode == MEMBER_CACHE_LICENSED:
+            # Members intent is still needed for member update events, members are just not cached
+            # (nor requested at startup) so the events are only dispatched for the licensed members we cache.
+            kwargs.setdefault("member_cache_flags", discord.MemberCacheFlags.none())
+            kwargs.setdefault("chunk_guilds_at_startup", False)
+        elif self.member_cache_mode != MEMBER_CACHE_FULL:
+            raise ValueError(f"Invalid member cache mode {self.member_cache_mode}, "
+                             f"has to be '{MEMBER_CACHE_FULL}' or '{MEMBER_CACHE_LICENSED}'.")
         self.up_time_start_time = get_current_time()
         super(Bot, self).__init__(
             command_prefix=self.prefix_callable,
@@ -44,12 +78,17 @@ class Bot(commands.Bot):
             description=self.config["bot_description"],
             case_insensitive=True,
             intents=discord.Intents(guilds=True, members=True, messages=True, reactions=True),
+            shard_count=shard_count,
+            shard_ids=shard_ids,
             **kwargs
         )
 
+    @property
+    def caches_all_members(self) -> bool:
+        return self.member_cache_mode == MEMBER_CACHE_FULL
+
     async def prefix_callable(self, bot_client, message):
         try:
-            # TODO: Store this in list or something so we don't waste calls to db for each message
             return await bot_client.main_db.get_guild_prefix(message.guild.id)
         except Exception as err:
             """
@@ -75,6 +114,10 @@ class Bot(commands.Bot):
     async def on_connect():
         root_logger.info("Connection to Discord established")
 
+    @staticmethod
+    async def on_shard_ready(shard_id):
+        root_logger.info(f"Shard {shard_id} ready")
+
     @staticmethod
     async def on_guild_remove(guild):
         root_logger.info(f"Left guild {guild.name}")
@@ -112,11 +155,12 @@ class Bot(commands.Bot):
                 footer = f"Guild: {guild_id}    Author: {ctx.author}    Channel: {ctx.channel.id}"
                 embed.set_footer(text=footer)
             if log_channel is not None:
-                await log_channel.send(embed=embed)
+                # Errors tend to come in bursts so these are paced like other outbound messages
+                await self.action_scheduler.run(channel_messages_route(log_channel.id), PRIORITY_NOTIFICATION,
+                                                lambda: log_channel.send(embed=embed))
 
 
-if __name__ == "__main__":
-    bot = Bot()
+def load_extensions(bot: Bot):
     root_logger.info("Loaded extensions:")
     for extension in startup_extensions:
         cog_path = f"cogs.{extension}"
@@ -129,4 +173,8 @@ if __name__ == "__main__":
             traceback_msg = traceback.format_exception(etype=type(e), value=e, tb=e.__traceback__)
             root_logger.warning(traceback_msg)
 
+
+if __name__ == "__main__":
+    bot = Bot()
+    load_extensions(bot)
     bot.run(bot.config["token"])
@@ -0,0 +1,196 @@
+"""
+Cluster launcher, runs bot shards split between multiple processes so all CPU cores can be used.
+
+    $ python3 cluster.py [number of processes]
+
+Number of processes defaults to the number of CPU cores (but not more than there are shards).
+
+Each worker process runs a range of shards with it's own event loop, database connections and
+expiration scheduler. Data is partitioned by shard so every process only handles it's own guilds
+(license expirations, prefixes, guild checks). SQLite in WAL mode serializes writes from multiple
+processes and readers never block on them.
+
+This process is the coordinator: it creates/migrates the database once, starts the workers and
+restarts them if they crash. Worker that exits normally (for example with disconnect command)
+is not restarted. Workers are connected to it over a local socket (see helpers/cluster_ipc.py)
+and it routes requests between them:
+    - DM redemptions, DMs are only received by the worker running shard 0 so redemption of a license
+      of a guild on other shards is forwarded to the worker owning the guild.
+    - bot wide statistics, gathered from all workers.
+
+Cache coherence:
+Every worker keeps in memory data only of it's own guilds (prefix cache, table row counters, license
+filter, expiration scheduler). These stay correct only because every write of guild data is done by
+the worker owning the guild: guild commands are received on the shard of the guild and DM redemptions
+are forwarded to it. Writes done any other way (another bot.py using the same database, manual edits,
+restoring a backup) are not seen by the owning worker: row counters and license filter catch up on the
+hourly reconcile (until then valid licenses can be rejected by the filter), prefix cache and expiration
+scheduler only after a restart of the worker. tests/test_cluster_coherence.py checks these limits.
+"""
+import sys
+import time
+import asyncio
+import secrets
+import multiprocessing
+from typing import List
+
+import discord
+
+from bot import Bot, load_extensions, root_logger
+from config_handler import ConfigHandler
+from database_handler import DatabaseHandler
+from helpers.cluster_ipc import ClusterCoordinator, ClusterClient
+
+
+# Seconds between starting workers for each shard of the previous worker, Discord allows one identify per 5 seconds
+_IDENTIFY_DELAY = 5
+# Seconds to wait before restarting a crashed worker, doubled for each consecutive crash
+_RESTART_DELAY = 5
+_MAX_RESTART_DELAY = 300
+# Worker that has been running this long is considered stable and it's restart delay is reset
+_STABLE_RUN_SECONDS = 600
+_COORDINATOR_HOST = "127.0.0.1"
+
+
+def run_worker(shard_ids: List[int], shard_count: int, coordinator_port: int, secret: str):
+    """Entry point of a worker process."""
+    asyncio.set_event_loop(asyncio.new_event_loop())
+    cluster = ClusterClient(_COORDINATOR_HOST, coordinator_port, secret, shard_ids)
+    bot = Bot(shard_count=shard_count, shard_ids=shard_ids, cluster=cluster)
+    load_extensions(bot)
+    bot.run(bot.config["token"])
+
+
+def split_shards(shard_count: int, processes: int) -> List[List[int]]:
+    """
+    :return: list of consecutive shard id ranges, one for each process
+    """
+    processes = max(min(processes, shard_count), 1)
+    size, remainder = divmod(shard_count, processes)
+    shard_ranges = []
+    start = 0
+    for i in range(processes):
+        end = start + size + (1 if i < remainder else 0)
+        shard_ranges.append(list(range(start, end)))
+        start = end
+    return shard_ranges
+
+
+async def get_shard_count(config: ConfigHandler) -> int:
+    """
+    :return: shard count from config or if it's not set the number of shards Discord recommends
+    """
+    shard_count = config.get("shard_count")
+    if shard_count:
+        return shard_count
+
+    http = discord.http.HTTPClient()
+    try:
+        await http.static_login(config["token"], bot=True)
+        shard_count, _gateway_url = await http.get_bot_gateway()
+    finally:
+        await http.close()
+    return shard_count
+
+
+async def prepare_database(config: ConfigHandler):
+    """
+    Creates and migrates the database before workers start, so they don't all do it at the same time.
+    Same for converting plaintext licenses if licenses are stored hashed.
+    """
+    database = await DatabaseHandler.create_instance(connection_profile=config.get("database", {}),
+                                                     reader_pool_size=0,
+                                                     license_hash_secret=config.get("license_hash_secret"))
+    await database.close()
+
+
+class _Worker:
+    def __init__(self, shard_ids: List[int], shard_count: int, coordinator: ClusterCoordinator, secret: str):
+        self.shard_ids = shard_ids
+        self.shard_count = shard_count
+        self.coordinator = coordinator
+        self.secret = secret
+        self.process = None
+        self.started_at = 0.0
+        self.restart_delay = _RESTART_DELAY
+        # Monotonic time when the crashed worker should be restarted, None if it's not waiting for restart
+        self.restart_at = None
+
+    def __str__(self):
+        return f"Worker shards {self.shard_ids[0]}-{self.shard_ids[-1]}"
+
+    def start(self, context):
+        self.process = context.Process(target=run_worker,
+                                       args=(self.shard_ids, self.shard_count, self.coordinator.port, self.secret),
+                                       name=str(self))
+        self.process.start()
+        self.started_at = time.monotonic()
+        self.restart_at = None
+        root_logger.info(f"{self} started, pid {self.process.pid}")
+
+
+async def supervise(workers: List[_Worker], context):
+    """Starts the workers and restarts them if they crash, returns once all of them have exited."""
+    for worker in workers:
+        worker.start(context)
+        await asyncio.sleep(_IDENTIFY_DELAY * len(worker.shard_ids))
+
+    while workers:
+        await asyncio.sleep(1)
+        for worker in list(workers):
+            if worker.process.is_alive():
+                continue
+
+            if worker.restart_at is None:
+                if worker.process.exitcode == 0:
+                    root_logger.info(f"{worker} has exited, not restarting it.")
+                    workers.remove(worker)
+                    continue
+                if time.monotonic() - worker.started_at > _STABLE_RUN_SECONDS:
+                    worker.restart_delay = _RESTART_DELAY
+                root_logger.critical(f"{worker} has crashed with exit code {worker.process.exitcode}, "
+                                     f"restarting in {worker.restart_delay}s.")
+                worker.restart_at = time.monotonic() + worker.restart_delay
+                worker.restart_delay = min(worker.restart_delay * 2, _MAX_RESTART_DELAY)
+            elif time.monotonic() >= worker.restart_at:
+                worker.start(context)
+
+
+def main():
+    config = ConfigHandler("config")
+    processes = int(sys.argv[1]) if len(sys.argv) > 1 else multiprocessing.cpu_count()
+
+    loop = asyncio.get_event_loop()
+    shard_count = loop.run_until_complete(get_shard_count(config))
+    loop.run_until_complete(prepare_database(config))
+
+    # Workers get the secret as process argument, it's only used so other local processes can't connect
+    secret = secrets.token_hex(16)
+    coordinator = ClusterCoordinator(shard_count, secret)
+    loop.run_until_complete(coordinator.start(_COORDINATOR_HOST))
+
+    # Spawn instead of fork so workers don't inherit anything from this process (event loop, threads)
+    context = multiprocessing.get_context("spawn")
+    workers = [_Worker(shard_ids, shard_count, coordinator, secret)
+               for shard_ids in split_shards(shard_count, processes)]
+    root_logger.info(f"Starting {len(workers)} workers for {shard_count} shards, "
+                     f"coordinator listening on port {coordinator.port}.")
+
+    try:
+        loop.run_until_complete(supervise(workers, context))
+    except KeyboardInterrupt:
+        root_logger.info("Stopping workers..")
+    finally:
+        for worker in workers:
+            if worker.process is not None and worker.process.is_alive():
+                worker.process.terminate()
+        for worker in workers:
+            if worker.process is not None:
+                worker.process.join()
+        loop.run_until_complete(coordinator.close())
+        loop.close()
+    root_logger.info("All workers stopped.")
+
+
+if __name__ == "__main__":
+    main()
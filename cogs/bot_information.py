@@ -2,11 +2,13 @@ import os
 import time
 import psutil
 import logging
+from typing import Tuple
 
 import discord
 from discord.ext import commands, tasks
 
 from helpers.licence_helper import get_current_time
+from helpers.cluster_ipc import ClusterRequestError
 from helpers.embed_handler import info, success, failure
 from helpers.misc import construct_load_bar_string, construct_embed, time_ago, embed_space
 
@@ -25,6 +27,8 @@ class BotInformation(commands.Cog):
         self.activity_loop.start()
         self.github_source = "https://github.com/albertopoljak/Licensy"
         self.top_gg_vote_link = "https://discordbots.org/bot/604057722878689324"
+        if self.bot.cluster is not None:
+            self.bot.cluster.register("license_totals", self.get_local_license_totals)
 
     @tasks.loop(seconds=300.0)
     async def activity_loop(self):
@@ -129,15 +133,50 @@ class BotInformation(commands.Cog):
         """Link to source code on Github."""
         await ctx.send(embed=info(self.github_source, ctx.me, title="Source code"))
 
+    async def get_local_license_totals(self) -> Tuple[int, int]:
+        """
+        :return: tuple(int active licenses, int stored licenses) of guilds on shards of this process
+        """
+        active_licenses = await self.bot.main_db.get_licensed_roles_total_count()
+        stored_licenses = await self.bot.main_db.get_stored_license_total_count()
+        return active_licenses, stored_licenses
+
+    async def get_license_totals(self) -> Tuple[int, int]:
+        """
+        Each cluster worker only counts licenses of it's own guilds so in cluster mode they are summed from all workers.
+        :return: tuple(int active licenses, int stored licenses)
+        """
+        if self.bot.cluster is None:
+            return await self.get_local_license_totals()
+        try:
+            worker_totals = await self.bot.cluster.gather("license_totals", {})
+        except ClusterRequestError as e:
+            logger.warning(f"Can't get license totals from cluster workers, showing only ours: {e}")
+            return await self.get_local_license_totals()
+        active_licenses = sum(totals[0] for totals in worker_totals)
+        stored_licenses = sum(totals[1] for totals in worker_totals)
+        return active_licenses, stored_licenses
+
     @commands.command(aliases=["stats", "status", "server"])
     @commands.cooldown(1, 10, commands.BucketType.guild)
     async def about(self, ctx):
         """Show bot information (stats/links/etc)."""
-        avg_members = round(len(self.bot.users) / len(self.bot.guilds))
+        # Total member count is known even for members that are not cached
+        total_members = sum(guild.member_count or 0 for guild in self.bot.guilds)
+        cached_members = sum(len(guild.members) for guild in self.bot.guilds)
+        avg_members = round(total_members / len(self.bot.guilds))
         avg_members_string = f"{avg_members} users/server"
+        cached_members_string = f"{cached_members}/{total_members} ({self.bot.member_cache_mode} mode)"
+        if not self.bot.caches_all_members:
+            bytes_per_member = self.bot.get_cog("LicenseHandler").member_cache.get_bytes_per_member()
+            if bytes_per_member is None:
+                cached_members_string += "\nMemory saved: not measured yet"
+            else:
+                # Measured RSS per cached licensed member times the number of members that are not cached
+                saved_memory = bytes_per_member * max(total_members - cached_members, 0) / 1024 ** 2
+                cached_members_string += f"\nMemory saved: ~{saved_memory:.0f} MB (estimate)"
 
-        active_licenses = await self.bot.main_db.get_licensed_roles_total_count()
-        stored_licenses = await self.bot.main_db.get_stored_license_total_count()
+        active_licenses, stored_licenses = await self.get_license_totals()
 
         bot_ram_usage = self.process.memory_full_info().rss / 1024 ** 2
         bot_ram_usage = f"{bot_ram_usage:.2f} MB"
@@ -187,7 +226,8 @@ class BotInformation(commands.Cog):
             "Library": "discord.py",
             "Servers": len(self.bot.guilds),
             "Average users:": avg_members_string,
-            "Total users": len(self.bot.users),
+            "Total users": total_members,
+            "Cached members": cached_members_string,
             "Commands": len(self.bot.commands),
             "Active licenses:": active_licenses,
             "Stored licenses:": stored_licenses,
@@ -43,9 +43,10 @@ class BotOwnerCommands(commands.Cog):
         """Closes database connection and disconnects the bot.
         Used for gracefully shutting it down in need of update.
         """
-        await self.bot.main_db.connection.commit()
-        await self.bot.main_db.connection.close()
+        await self.bot.main_db.close()
         logger.info("Database closed.")
+        if self.bot.cluster is not None:
+            await self.bot.cluster.close()
         await self.bot.logout()
         logger.info("Disconnected.")
 
@@ -199,6 +200,69 @@ class BotOwnerCommands(commands.Cog):
 
         await ctx.send(embed=success(f"{db_msg}\n\n{loaded_msg}", ctx.me))
 
+    @commands.command(hidden=True)
+    @commands.is_owner()
+    async def database_diagnostic(self, ctx):
+        """Shows database connection settings and cache statistics."""
+        cached_prefixes, prefix_hits, prefix_misses = self.bot.main_db.get_prefix_cache_stats()
+        pragmas = await self.bot.main_db.get_connection_profile_values()
+        pragmas_msg = "\n".join(
+            f"{pragma}: **{value}** (configured: {self.bot.main_db.connection_profile[pragma]})"
+            for pragma, value in pragmas.items()
+        )
+        queue_depths_msg = "\n".join(
+            f"{connection}: **{depth}**" for connection, depth in self.bot.main_db.get_queue_depths().items()
+        )
+        message = (
+            f"Connection:\n{pragmas_msg}\n\n"
+            f"Queue depth:\n{queue_depths_msg}\n\n"
+            "Prefix cache:\n"
+            f"Cached guilds: **{cached_prefixes}**\n"
+            f"Hits: **{prefix_hits}**\n"
+            f"Misses: **{prefix_misses}**\n\n"
+            "Expiration scheduler:\n"
+            f"Scheduled licenses: **{len(self.bot.main_db.expiration_scheduler)}**\n"
+            f"Next expiration: **{self.bot.main_db.expiration_scheduler.next_expiration_date()}**\n\n"
+            "License filter:\n" +
+            "\n".join(f"{stat}: **{value:,}**" for stat, value in self.bot.main_db.get_license_filter_stats().items())
+        )
+        await ctx.send(embed=success(message, ctx.me))
+
+    @commands.command(hidden=True)
+    @commands.is_owner()
+    async def expiration_diagnostic(self, ctx):
+        """Shows license expiration and notification queue statistics."""
+        license_cog = self.bot.get_cog("LicenseHandler")
+        sections = []
+        for queue in (license_cog.expiration_queue, license_cog.notification_queue):
+            stats_msg = "\n".join(f"{stat}: **{value:g}**" for stat, value in queue.get_stats().items())
+            sections.append(f"{queue.name} ({queue.workers} workers):\n{stats_msg}")
+        cached_members, member_hits, member_misses = license_cog.member_cache.get_stats()
+        sections.append(f"Member lookup cache:\n"
+                        f"Cached members: **{cached_members}**\n"
+                        f"Hits: **{member_hits}**\n"
+                        f"Misses: **{member_misses}**")
+        await ctx.send(embed=success("\n\n".join(sections), ctx.me))
+
+    @commands.command(hidden=True)
+    @commands.is_owner()
+    async def action_diagnostic(self, ctx):
+        """Shows outbound Discord action queue and wait time statistics per priority."""
+        scheduler = self.bot.action_scheduler
+        sections = [
+            f"Active routes: **{scheduler.get_active_routes_count()}**\n"
+            f"Rate limited: **{scheduler.rate_limited}**"
+        ]
+        for priority_name, stats in scheduler.get_stats().items():
+            sections.append(
+                f"{priority_name}:\n"
+                f"Queued: **{stats['queued']}**\n"
+                f"Executed: **{stats['executed']}**\n"
+                f"Average wait: **{stats['average wait']:.2f}s**\n"
+                f"Max wait: **{stats['max wait']:.2f}s**"
+            )
+        await ctx.send(embed=success("\n\n".join(sections), ctx.me))
+
     @commands.command(hidden=True)
     @commands.is_owner()
     async def force_remove_all_guild_data(self, ctx, guild_id: int, guild_too: int = 0):
@@ -1,7 +1,8 @@
 import logging
+import asyncio
 
 import discord
-from discord.ext import commands
+from discord.ext import commands, tasks
 from aiosqlite import IntegrityError
 
 from helpers.converters import license_duration
@@ -9,29 +10,95 @@ from helpers.embed_handler import success, failure
 
 
 logger = logging.getLogger(__name__)
+# Number of guilds checked for deleted roles at once
+_ROLE_CHECK_BATCH_SIZE = 100
 
 
 class Guild(commands.Cog):
     def __init__(self, bot):
         self.bot = bot
-        self.bot.loop.create_task(self.startup_guild_database_check())
+        self.deleted_roles_check_task = None
+        self.counter_reconciliation.start()
 
-    async def startup_guild_database_check(self):
-        db_guilds_ids = await self.bot.main_db.get_all_guild_ids()
-        logger.info("Starting database guild checkup..")
+    @tasks.loop(hours=1.0)
+    async def counter_reconciliation(self):
+        """
+        Fixes eventual drift of cached license counters used for guild statistics.
+        Also rebuilds the license filter if too many licenses were added or deleted since it was built.
+        """
+        try:
+            await self.bot.main_db.reconcile_counters()
+        except Exception as e:
+            logger.critical(f"Failed to reconcile license counters: {e}")
+        try:
+            await self.bot.main_db.maybe_rebuild_license_filter()
+        except Exception as e:
+            logger.critical(f"Failed to rebuild license filter: {e}")
+
+    @counter_reconciliation.before_loop
+    async def before_counter_reconciliation(self):
         await self.bot.wait_until_ready()
-        # Checks for new guilds
-        for guild in self.bot.guilds:
-            if guild.id not in db_guilds_ids:
-                logger.info(f"Guild {guild.id} {guild} found but not registered. "
-                            f"Adding entry to database.")
-                await self.bot.main_db.setup_new_guild(guild.id, self.bot.config["default_prefix"])
+
+    @commands.Cog.listener()
+    async def on_ready(self):
+        # Called on startup but also after reconnecting when the session couldn't be resumed
+        await self.guild_database_check()
+        if self.deleted_roles_check_task is None or self.deleted_roles_check_task.done():
+            self.deleted_roles_check_task = self.bot.loop.create_task(self.deleted_roles_check())
+
+    @commands.Cog.listener()
+    async def on_resumed(self):
+        await self.guild_database_check()
+
+    async def guild_database_check(self):
+        """
+        Adds guilds that the bot is in but are not registered in the database, for example
+        guilds that were joined while the bot was offline or disconnected.
+        """
+        logger.info("Starting database guild checkup..")
+        db_guilds_ids = await self.bot.main_db.get_all_guild_ids()
+        missing_guild_ids = {guild.id for guild in self.bot.guilds} - db_guilds_ids
+        if missing_guild_ids:
+            logger.info(f"Found {len(missing_guild_ids)} guilds that are not registered. Adding entries to database.")
+            await self.bot.main_db.setup_new_guilds(missing_guild_ids, self.bot.config["default_prefix"])
 
         # Do not code the other way around
         # aka deleting database data if the guild in database doesn't exist in bot guilds
         # Discord downtimes can cause bot to not see the guilds and they will reappear after downtime
         logger.info("Database guild checkup done!")
 
+    async def deleted_roles_check(self):
+        """
+        Removes database data of roles that were deleted while the bot was offline, since
+        on_guild_role_delete didn't fire for them: licensed members and licenses of those roles
+        are deleted and if the role was set as default guild role it's unset.
+
+        Guilds are checked in batches with bulk queries, yielding to other tasks between batches.
+        Unavailable guilds are skipped because their roles are not loaded.
+        """
+        logger.info("Starting deleted roles check..")
+        guilds = [guild for guild in self.bot.guilds if not guild.unavailable]
+        deleted_roles_count = deleted_members = deleted_licenses = unset_default_roles = 0
+        try:
+            for i in range(0, len(guilds), _ROLE_CHECK_BATCH_SIZE):
+                batch = {guild.id: guild for guild in guilds[i:i + _ROLE_CHECK_BATCH_SIZE]}
+                guild_roles = await self.bot.main_db.get_guilds_role_ids(list(batch))
+                deleted_roles = [(guild_id, role_id) for guild_id, role_id in guild_roles
+                                 if batch[guild_id].get_role(role_id) is None]
+                if deleted_roles:
+                    members, licenses, default_roles = await self.bot.main_db.remove_all_guild_roles_data(deleted_roles)
+                    deleted_roles_count += len(deleted_roles)
+                    deleted_members += members
+                    deleted_licenses += licenses
+                    unset_default_roles += default_roles
+                await asyncio.sleep(0)
+        except Exception as e:
+            logger.critical(f"Deleted roles check failed: {e}")
+
+        logger.info(f"Deleted roles check done! Found {deleted_roles_count} deleted roles in {len(guilds)} guilds, "
+                    f"removed {deleted_members} licensed members, {deleted_licenses} licenses "
+                    f"and unset {unset_default_roles} default guild roles.")
+
     @commands.command()
     @commands.cooldown(1, 30, commands.BucketType.guild)
     @commands.has_permissions(administrator=True)
@@ -81,10 +148,11 @@ class Guild(commands.Cog):
         Newly created licenses will expire after this much time.
 
         License duration is either a number representing hours or a string consisting of words in format:
-        each word has to contain [integer][type format], entries are separated by space.
+        each word has to contain [integer][type format], entries are separated by space or written together.
+        ISO-8601 durations (P1M2D, PT36H...) also work.
 
         Formats are:
-        years y months m weeks w days d hours h
+        years y months m mo weeks w days d hours h minutes min
 
         License duration examples:
         20
@@ -94,6 +162,9 @@ class Guild(commands.Cog):
         1w 2m 1w
         1week 1week
         12hours 5d
+        1y2m
+        90min
+        P1MT12H
 
         """
         await self.bot.main_db.change_default_license_expiration(ctx.guild.id, expiration)
@@ -109,12 +180,10 @@ class Guild(commands.Cog):
 
         # If the bot just joined the guild it can happen that the default license role is not set.
         if role_id is not None:
-            default_license_role = discord.utils.get(ctx.guild.roles, id=int(role_id))
+            default_license_role = discord.utils.get(ctx.guild.roles, id=role_id)
             # In case it is set in db but was deleted from the guild.
-            # This is needed in case the bot was offline and role was deleted
-            # because on_guild_role_delete will not fire (we delete it from db in that event if that deleted role
-            # is set as default guild role).
-            # TODO: ABOVE EVENT
+            # Deleted default role is unset in on_guild_role_delete and by the deleted roles check
+            # after startup, so this can only happen before that check is done.
             if default_license_role is None:
                 default_license_role = role_id
                 log = f"Can't find default license role {role_id} from guild {ctx.guild.name},{ctx.guild.id}"
@@ -1,34 +1,128 @@
+import io
 import logging
-from datetime import datetime
+import asyncio
+import tempfile
+from collections import defaultdict
 
+import psutil
 import texttable
 import discord.utils
-from dateutil import parser
-from aiosqlite import IntegrityError
-from discord.errors import Forbidden
+from discord.errors import Forbidden, HTTPException
 from discord.ext import commands, tasks
 
-from helpers import misc
+from helpers import misc, license_export
 from helpers.paginator import Paginator
+from helpers.action_scheduler import (
+    PRIORITY_REDEEM, PRIORITY_EXPIRY, PRIORITY_NOTIFICATION, DM_ROUTE, member_roles_route
+)
+from helpers.work_queue import WorkQueue
+from helpers.cluster_ipc import ClusterRequestError
+from helpers.member_cache import MemberLookupCache
 from helpers.converters import positive_integer, license_duration
 from helpers.errors import RoleNotFound, DatabaseMissingData, GuildNotFound
 from helpers.embed_handler import success, warning, failure, info, simple_embed
-from helpers.licence_helper import construct_expiration_date, get_remaining_time, get_current_time
+from helpers.licence_helper import (
+    construct_expiration_date, get_remaining_time, get_current_time, get_current_timestamp, timestamp_to_datetime
+)
 
 logger = logging.getLogger(__name__)
+# If role removal still fails after all retries the expiration is retried after this many seconds
+_EXPIRATION_RETRY_SECONDS = 60
+# Expiration queue settings, can be overridden with "expiration_queue" dict in config
+_DEFAULT_EXPIRATION_QUEUE_CONFIG = {
+    # Number of roles removed at the same time
+    "workers": 10,
+    # Number of roles removed at the same time in a single guild, role removal rate limit is per guild
+    "guild_concurrency": 2,
+    "max_retries": 3,
+    # Seconds before the first retry, doubled for each next retry
+    "retry_delay": 5,
+    # Expiration DMs are less important than role removals so they get fewer workers
+    "notification_workers": 2,
+    # Maximum number of DMs waiting to be sent, new ones are dropped when it's reached
+    "notification_queue_size": 10000
+}
+# Number of expired licenses fetched from the database at once
+_EXPIRATION_BATCH_SIZE = 500
+# Number of guilds whose members are prefetched at the same time
+_PREFETCH_GUILD_CONCURRENCY = 4
+# Maximum size in bytes of the text file with licenses that can be attached to add_licenses
+_BULK_ATTACHMENT_MAX_SIZE = 1024 * 1024
+# Maximum number of licenses generate command generates at once, bot owners have a higher limit
+_MAX_GENERATE_AT_ONCE = 25
+_OWNER_MAX_GENERATE_AT_ONCE = 100_000
+# Discord attachment size limit without boosts, used for exported and imported license files
+_LICENSE_FILE_MAX_SIZE = 8 * 1024 * 1024
+# Number of invalid licenses a user can enter in a period of seconds before having to wait,
+# so licenses can't be brute forced and users spamming them can't keep the database busy.
+_INVALID_LICENSE_ATTEMPTS = 5
+_INVALID_LICENSE_ATTEMPTS_PERIOD = 60
+
+
+class _ForwardedContext:
+    """
+    Stands in for the command context when redeeming a license that was sent in DMs to another cluster worker.
+    Messages are collected and sent back to that worker which then sends them to the member.
+    """
+    guild = None
+
+    def __init__(self, bot, member_id: int):
+        self.author = discord.Object(id=member_id)
+        self.me = bot.user
+        # Embeds as dicts so they can be sent over the cluster connection
+        self.embeds = []
+        self.invalid_license = False
+
+    async def send(self, *, embed: discord.Embed):
+        self.embeds.append(embed.to_dict())
 
 
 class LicenseHandler(commands.Cog):
     def __init__(self, bot):
         self.bot = bot
+        self.member_cache = MemberLookupCache()
+        self.invalid_license_attempts = commands.CooldownMapping.from_cooldown(
+            _INVALID_LICENSE_ATTEMPTS, _INVALID_LICENSE_ATTEMPTS_PERIOD, commands.BucketType.user
+        )
+        queue_config = {**_DEFAULT_EXPIRATION_QUEUE_CONFIG, **self.bot.config.get("expiration_queue", {})}
+        self.expiration_queue = WorkQueue(
+            "License expiration",
+            lambda job: self.expire_license(*job),
+            workers=queue_config["workers"],
+            group_key=lambda job: job[1],
+            group_concurrency=queue_config["guild_concurrency"],
+            max_retries=queue_config["max_retries"],
+            retry_delay=queue_config["retry_delay"],
+            on_failure=self.expiration_failed
+        )
+        self.notification_queue = WorkQueue(
+            "Expiration notification",
+            lambda job: self.send_expiration_notification(*job),
+            workers=queue_config["notification_workers"],
+            max_retries=0,
+            max_size=queue_config["notification_queue_size"]
+        )
+        self.expiration_queue.start()
+        self.notification_queue.start()
         self.license_check.start()
+        if self.bot.cluster is not None:
+            self.bot.cluster.register("redeem", self.redeem_forwarded)
 
-    @tasks.loop(seconds=60.0)
+    def cog_unload(self):
+        self.license_check.cancel()
+        self.expiration_queue.stop()
+        self.notification_queue.stop()
+
+    @tasks.loop(seconds=0)
     async def license_check(self):
+        # Sleeps until the earliest license expires, no need to poll the database
+        await self.bot.main_db.expiration_scheduler.wait_until_due()
         try:
             await self.check_all_active_licenses()
         except Exception as e:
             logger.critical(e)
+            # Due licenses are still scheduled so don't retry right away
+            await asyncio.sleep(_EXPIRATION_RETRY_SECONDS)
 
     @license_check.before_loop
     async def before_printer(self):
@@ -38,54 +132,104 @@ class LicenseHandler(commands.Cog):
 
     async def check_all_active_licenses(self):
         """
-        Checks all active member licenses in database and if license is expired then remove
-        the role from member and send some message.
-
-        TODO: Move query to database handler
-        """
-        async with self.bot.main_db.connection.execute("SELECT * FROM LICENSED_MEMBERS") as cursor:
-            async for row in cursor:
-                member_id = int(row[0])
-                member_guild_id = int(row[1])
-                expiration_date = parser.parse(row[2])
-                licensed_role_id = int(row[3])
-                if await LicenseHandler.has_license_expired(expiration_date):
-                    logger.info(f"Expired license for member:{member_id} role:{licensed_role_id} guild:{member_guild_id}")
-                    try:
-                        await self.remove_role(member_id, member_guild_id, licensed_role_id)
-                    except RoleNotFound as e1:
-                        logger.warning(e1)
-                        logger.warning(f"Role expired but can't be removed from member because he doesn't have it! "
-                                       f"Someone must have manually removed it before it expired.\t"
-                                       f"Member ID:{member_id}, guild ID:{member_guild_id}, role ID:{licensed_role_id}"
-                                       f"Continuing to db entry removal...")
-                    except GuildNotFound as e2:
-                        # If guild is not found log it and continue to guild database deletion
-                        logger.warning(e2)
-                        logger.warning(f"Guild {member_guild_id} saved in database but not found in bot guilds!"
-                                       "Removing all entries of it from database!")
-                        await self.bot.main_db.remove_all_guild_data(member_guild_id, guild_table_too=True)
-                        logger.info(f"Successfully deleted all database data for guild {member_guild_id}")
-                        continue
-                    except Exception as e3:
-                        logger.warning(f"Can't remove role {licensed_role_id } from member {member_id } guild {member_guild_id }, ignoring error: {e3}")
-                        continue
-                    await self.bot.main_db.delete_licensed_member(member_id, licensed_role_id)
-                    logger.info(f"Role {licensed_role_id} successfully removed from member:{member_id}")
-
-    @staticmethod
-    async def has_license_expired(expiration_date: datetime) -> bool:
-        """
-        Check if param expiration date is in past related to the current date.
-        If it is in past then license is considered expired.
-        :param expiration_date: datetime object
-        :return: True if license is expired, False otherwise
-        """
-        if expiration_date < get_current_time():
-            # Expired
-            return True
+        Gets all member licenses that have expired and queues them for expiration.
+
+        Expiration scheduler only decides when to wake up, database is the source of truth for which
+        licenses are due. They are fetched in batches with a range query so only expired rows are read.
+        Role removals are done by the expiration queue workers so the sweep itself doesn't wait for them,
+        licenses that are still being processed from the previous sweep are not queued again.
+        Members of each batch that are not cached are loaded in background with one request per guild
+        (per 100 members) instead of workers fetching them one by one. It's done after the batch is queued
+        so expirations don't wait for it, workers only wait for members whose request is in progress.
+        """
+        now = get_current_timestamp()
+        after = None
+        while True:
+            expired = await self.bot.main_db.get_expired_licenses(now, _EXPIRATION_BATCH_SIZE, after)
+            for _rowid, member_id, member_guild_id, _expiration_date, licensed_role_id in expired:
+                self.expiration_queue.put((member_id, member_guild_id, licensed_role_id))
+            self.bot.loop.create_task(self.prefetch_members(
+                [(member_guild_id, member_id) for _rowid, member_id, member_guild_id, _, _ in expired]
+            ))
+
+            if len(expired) < _EXPIRATION_BATCH_SIZE:
+                break
+            last_row = expired[-1]
+            after = (last_row[3], last_row[0])
+
+        # Only after everything was queued, so if this errors out the licenses stay scheduled.
+        # Licenses whose expiration fails are rescheduled for a later time so they are not affected.
+        self.bot.main_db.expiration_scheduler.pop_due(now)
+
+    async def prefetch_members(self, guild_members):
+        """
+        :param guild_members: iterable of tuples (guild_id, member_id)
+        """
+        member_ids_per_guild = defaultdict(list)
+        for guild_id, member_id in guild_members:
+            member_ids_per_guild[guild_id].append(member_id)
+        # Requests go through the gateway which is rate limited, so only a few guilds are loaded at the same time
+        semaphore = asyncio.Semaphore(_PREFETCH_GUILD_CONCURRENCY)
+
+        async def prefetch_guild(guild_id, member_ids):
+            guild = self.bot.get_guild(guild_id)
+            # Missing guild is handled when the license is expired
+            if guild is None:
+                return
+            async with semaphore:
+                try:
+                    await self.member_cache.prefetch(guild, member_ids)
+                except Exception as e:
+                    # Workers fetch the members one by one instead
+                    logger.warning(f"Can't prefetch {len(member_ids)} members of guild {guild_id}: {e}")
+
+        await asyncio.gather(*(prefetch_guild(guild_id, member_ids)
+                               for guild_id, member_ids in member_ids_per_guild.items()))
+
+    async def expire_license(self, member_id: int, member_guild_id: int, licensed_role_id: int):
+        """
+        Removes expired licensed role from member and deletes the license database entry.
+        Called by expiration queue workers.
+        :raise: any exception from role removal that isn't handled here, job is retried by the queue
+        """
+        logger.info(f"Expired license for member:{member_id} role:{licensed_role_id} guild:{member_guild_id}")
+        removed = None
+        try:
+            removed = await self.remove_role(member_id, member_guild_id, licensed_role_id)
+        except RoleNotFound as e1:
+            logger.warning(e1)
+            logger.warning(f"Role expired but can't be removed from member because he doesn't have it! "
+                           f"Someone must have manually removed it before it expired.\t"
+                           f"Member ID:{member_id}, guild ID:{member_guild_id}, role ID:{licensed_role_id}"
+                           f"Continuing to db entry removal...")
+        except GuildNotFound as e2:
+            # If guild is not found log it and continue to guild database deletion
+            logger.warning(e2)
+            logger.warning(f"Guild {member_guild_id} saved in database but not found in bot guilds!"
+                           "Removing all entries of it from database!")
+            await self.bot.main_db.remove_all_guild_data(member_guild_id, guild_table_too=True)
+            logger.info(f"Successfully deleted all database data for guild {member_guild_id}")
+            return
         else:
-            return False
+            if removed is not None:
+                logger.info(f"Role {licensed_role_id} successfully removed from member:{member_id}")
+                self.notification_queue.put(removed)
+
+        # Commits are grouped by the database handler so concurrent workers don't commit one by one
+        await self.bot.main_db.delete_licensed_member(member_id, licensed_role_id, member_guild_id)
+        if removed is not None:
+            self.uncache_unlicensed_member(removed[0])
+
+    async def expiration_failed(self, job, exception: Exception):
+        """
+        Called by expiration queue when role removal has failed after all retries.
+        Database entry is still there, scheduler will wake us up to try again later.
+        """
+        member_id, member_guild_id, licensed_role_id = job
+        logger.warning(f"Can't remove role {licensed_role_id} from member {member_id} guild {member_guild_id}, "
+                       f"retrying in {_EXPIRATION_RETRY_SECONDS}s: {exception}")
+        retry_date = get_current_timestamp() + _EXPIRATION_RETRY_SECONDS
+        self.bot.main_db.expiration_scheduler.schedule(member_id, member_guild_id, retry_date, licensed_role_id)
 
     async def remove_role(self, member_id, guild_id, licensed_role_id):
         """
@@ -95,6 +239,7 @@ class LicenseHandler(commands.Cog):
         :param guild_id: guild ID from where the member is from. Needed because member can be in
                          multiple guilds at the same time.
         :param licensed_role_id: ID of a role to remove from member
+        :return: tuple(member, removed role) or None if member has left the guild
         :raise RoleNotFound: if roles to be removed isn't in member roles (case when in db it's saved but someone
                 manually removed their role so when db role expires and needs to be removed there is nothing to be
                 removed)
@@ -104,36 +249,88 @@ class LicenseHandler(commands.Cog):
             raise GuildNotFound(f"Fatal exception. "
                                 f"Guild **{guild_id}** loaded from database cannot be found in bot guilds!")
 
-        member = guild.get_member(member_id)
-        # For some reason this can be NONE, tried to recreate it but failed.
-        # Short explanation is that member is indeed inside of the guild but at the time this is
-        # called member can be NONE for unknown reason. Log logs below line "Can't remove licensed role..because he
-        # has left the guild" , later when I tried to recreate it I couldn't. In test guild it was working and members
-        # in question were all later been confirmed that indeed they are in the guild cache, so dunno
-        # why this sometimes acts as if the member is not in the guild? Thus right now if it's None we will
-        # force a API call
-        if member is None:
-            member = await guild.fetch_member(member_id)
+        # Member can be missing from the gateway cache (for example right after reconnect), in that case
+        # member cache is used which does the API call only if the member wasn't recently looked up.
+        member = await self.member_cache.get_member(guild, member_id)
 
-        # If member is still None in this case then either he indeed has left the guild
-        # or the bug has not been fixed.
+        # If member is None in this case then he has left the guild.
         if member is None:
             logger.warning(f"Can't remove licensed role {licensed_role_id} from member {member_id} "
                            f"because he has left the guild {licensed_role_id} ({guild.name}).")
-            return
+            return None
 
         member_role = discord.utils.get(member.roles, id=licensed_role_id)
         if member_role is None:
             raise RoleNotFound(f"Can't remove licensed role {member_role} for {member.mention}."
                                f"Role not found ")
         else:
-            await member.remove_roles(member_role)
-            try:
-                expired = f"Your license in guild **{guild}** has expired for the following role: **{member_role}** "
-                await member.send(embed=simple_embed(expired, "Notification", discord.Colour.blue()))
-            except Forbidden:
-                # Ignore if user has blocked DM
-                pass
+            await self.remove_member_role(member, member_role, PRIORITY_EXPIRY)
+            return member, member_role
+
+    async def add_member_role(self, member, role, priority: int, reason: str = None):
+        """Adds role to member through the action scheduler so role edits stay under the guild rate limit."""
+        await self.bot.action_scheduler.run(member_roles_route(member.guild.id), priority,
+                                            lambda: member.add_roles(role, reason=reason))
+        if not self.bot.caches_all_members and member.guild.get_member(member.id) is None:
+            # Member is now licensed so start caching it, in background so the redeem doesn't wait for it
+            self.bot.loop.create_task(self.member_cache.cache_members(member.guild, (member.id,)))
+
+    async def remove_member_role(self, member, role, priority: int, reason: str = None):
+        """Removes role from member through the action scheduler so role edits stay under the guild rate limit."""
+        await self.bot.action_scheduler.run(member_roles_route(member.guild.id), priority,
+                                            lambda: member.remove_roles(role, reason=reason))
+
+    async def send_expiration_notification(self, member, role):
+        """
+        Notifies member that their license has expired.
+        Called by notification queue workers, separately from role removal so DMs don't slow down expirations.
+        """
+        try:
+            expired = f"Your license in guild **{role.guild}** has expired for the following role: **{role}** "
+            embed = simple_embed(expired, "Notification", discord.Colour.blue())
+            await self.bot.action_scheduler.run(DM_ROUTE, PRIORITY_NOTIFICATION, lambda: member.send(embed=embed))
+        except Forbidden:
+            # Ignore if user has blocked DM
+            pass
+
+    @commands.Cog.listener()
+    async def on_shard_ready(self, shard_id):
+        """
+        If only licensed members are cached they need to be loaded each time the shard connects
+        since the gateway cache of it's guilds is rebuilt.
+        """
+        if self.bot.caches_all_members:
+            return
+
+        cached_count = 0
+        guild_count = 0
+        # RSS is measured around caching to estimate the memory saved by not caching the other members.
+        # It's for the whole process so it's only an estimate, other shards can allocate in the meantime.
+        process = psutil.Process()
+        rss_before = process.memory_info().rss
+        for guild_id, member_ids in self.bot.main_db.expiration_scheduler.get_guild_members().items():
+            guild = self.bot.get_guild(guild_id)
+            if guild is None or guild.shard_id != shard_id:
+                continue
+            cached_count += await self.member_cache.cache_members(guild, member_ids)
+            guild_count += 1
+        rss_growth = process.memory_info().rss - rss_before
+        self.member_cache.record_memory_usage(cached_count, rss_growth)
+        logger.info(f"Shard {shard_id} cached {cached_count} licensed members from {guild_count} guilds, "
+                    f"RSS grew by {rss_growth / 1024 ** 2:.2f} MB.")
+
+    def uncache_unlicensed_member(self, member):
+        """
+        If only licensed members are cached removes member from the cache once they don't have any licensed role.
+        Has to be called after the license database entry is deleted.
+        """
+        if self.bot.caches_all_members:
+            return
+        scheduler = self.bot.main_db.expiration_scheduler
+        # Pairs that are currently being expired are not in the scheduler, so expired role is not counted
+        # even though it can still be in member roles.
+        if not any((member.id, role.id) in scheduler for role in member.roles):
+            self.member_cache.uncache_member(member.guild, member.id)
 
     @commands.Cog.listener()
     async def on_guild_join(self, guild):
@@ -155,14 +352,27 @@ class LicenseHandler(commands.Cog):
         guild = role.guild
         logger.info(f"Role '{role.name}'' {role.id} was removed from guild '{guild.name}'' {guild.id}. "
                     f"Removing all database entries.")
-        await self.bot.main_db.remove_all_guild_role_data(role.id)
+        await self.bot.main_db.remove_all_guild_role_data(role.id, guild.id)
+
+    @commands.Cog.listener()
+    async def on_member_join(self, member):
+        # Member could have been cached as not found while they were not in the guild
+        self.member_cache.forget(member.guild.id, member.id)
 
     @commands.Cog.listener()
     async def on_member_update(self, before, after):
-        if len(before.roles) > len(after.roles):
-            removed_roles_list = list(set(before.roles) - set(after.roles))
-            for role in removed_roles_list:
-                await self.bot.main_db.delete_licensed_member(before.id, role.id)
+        if before.roles == after.roles:
+            return
+        # Expiration scheduler holds every licensed (member, role) pair so roles that were never
+        # licensed are skipped without touching the database.
+        # Pairs that are currently being expired are not in it but their entry is deleted by the expiration anyway.
+        scheduler = self.bot.main_db.expiration_scheduler
+        removed_role_ids = {role.id for role in before.roles} - {role.id for role in after.roles}
+        removed_licenses = [(before.id, role_id, before.guild.id) for role_id in removed_role_ids
+                            if (before.id, role_id) in scheduler]
+        if removed_licenses:
+            await self.bot.main_db.delete_licensed_members(removed_licenses)
+            self.uncache_unlicensed_member(after)
 
     @commands.command()
     @commands.bot_has_permissions(manage_roles=True)
@@ -183,8 +393,9 @@ class LicenseHandler(commands.Cog):
             return
 
         # First remove the role from member because this can fail in case of changed role hierarchy.
-        await member.remove_roles(role)
-        await self.bot.main_db.delete_licensed_member(member.id, role.id)
+        await self.remove_member_role(member, role, PRIORITY_REDEEM)
+        await self.bot.main_db.delete_licensed_member(member.id, role.id, ctx.guild.id)
+        self.uncache_unlicensed_member(member)
         msg = f"Successfully revoked subscription for {role.mention} from {member.mention}"
         await ctx.send(embed=success(msg, ctx.me))
         logger.info(f"{ctx.author} is revoking subscription for role {role} from member {member} in guild {ctx.guild}")
@@ -204,19 +415,19 @@ class LicenseHandler(commands.Cog):
         count = 0
 
         for tple in member_data:
-            role_id = int(tple[0])
+            role_id = tple[0]
             role = ctx.guild.get_role(role_id)
             if role is None:
                 logger.info(f"'revoke_all' called in guild {ctx.guild} and role that's loaded from database with "
                             f"ID:{role_id} cannot be removed from {member} because it doesn't exist in guild anymore! "
                             f"Continuing to removal from database.")
-                await self.bot.main_db.delete_licensed_member(member.id, role_id)
+                await self.bot.main_db.delete_licensed_member(member.id, role_id, ctx.guild.id)
                 count += 1
             else:
                 try:
                     # First remove the role from member because this can fail in case of changed role hierarchy.
-                    await member.remove_roles(role)
-                    await self.bot.main_db.delete_licensed_member(member.id, role_id)
+                    await self.remove_member_role(member, role, PRIORITY_REDEEM)
+                    await self.bot.main_db.delete_licensed_member(member.id, role_id, ctx.guild.id)
                     count += 1
                 except Forbidden as e:
                     msg = (f"Can't remove {role.mention} from {member.mention}, no permissions to manage that role as "
@@ -227,6 +438,7 @@ class LicenseHandler(commands.Cog):
                     await ctx.send(embed=failure(msg))
 
         if count:
+            self.uncache_unlicensed_member(member)
             msg = f"Successfully revoked {count} subscriptions from {member.mention}!"
             await ctx.send(embed=success(msg, ctx.me))
             logger.info(f"{ctx.author} has revoked all subscription for member {member} in guild {ctx.guild}")
@@ -245,25 +457,189 @@ class LicenseHandler(commands.Cog):
 
         TODO: Better security (right now license is visible in plain sight in guild)
         """
-        license_data = await self.bot.main_db.get_license_data(license)
+        self.check_invalid_license_attempts(ctx)
+        license_data = await self.bot.main_db.get_license_data(license, None if ctx.guild is None else ctx.guild.id)
         if license_data is None:
-            await ctx.send(embed=failure("The license key you entered is invalid/deactivated."))
+            await self.send_invalid_license(ctx)
             return
         license_guild_id, license_role_id = license_data
+        if (ctx.guild is None and self.bot.cluster is not None and
+                not self.bot.shard_partition.owns_guild(license_guild_id)):
+            await self.forward_redeem(ctx, license, license_guild_id, license_role_id)
+            return
         await self.activate_license(ctx, license, license_guild_id, license_role_id, ctx.author)
 
+    async def forward_redeem(self, ctx, license: str, guild_id: int, role_id: int):
+        """
+        In cluster mode DMs are only received by the worker running shard 0, so license of a guild that is on
+        shards of another worker is redeemed by that worker. It has the guild and it's data has to be written
+        by it so it's caches stay in sync.
+        """
+        payload = {"member_id": ctx.author.id, "license": license, "guild_id": guild_id, "role_id": role_id}
+        try:
+            result = await self.bot.cluster.request("redeem", guild_id, payload)
+        except ClusterRequestError as e:
+            logger.warning(f"Can't forward redeem of member {ctx.author.id} to worker of guild {guild_id}: {e}")
+            await ctx.send(embed=failure(f"Can't redeem the license: {e}"))
+            return
+
+        if result["invalid_license"]:
+            self.invalid_license_attempts.update_rate_limit(ctx.message)
+        for embed in result["embeds"]:
+            await ctx.send(embed=discord.Embed.from_dict(embed))
+
+    async def redeem_forwarded(self, member_id: int, license: str, guild_id: int, role_id: int) -> dict:
+        """
+        Redeems license sent in DMs to another cluster worker, called over the cluster connection.
+        :return: dict {"embeds": list of embed dicts to send to the member, "invalid_license": bool}
+        """
+        ctx = _ForwardedContext(self.bot, member_id)
+        await self.activate_license(ctx, license, guild_id, role_id, ctx.author)
+        return {"embeds": ctx.embeds, "invalid_license": ctx.invalid_license}
+
     @commands.command(allieses=["add_license"])
     @commands.has_permissions(manage_roles=True)
     async def add_license(self, ctx, license, member: discord.Member):
         """Manually add license to member."""
-        license_data = await self.bot.main_db.get_license_data(license)
+        self.check_invalid_license_attempts(ctx)
+        license_data = await self.bot.main_db.get_license_data(license, ctx.guild.id)
         if license_data is None:
-            await ctx.send(embed=failure("The license key you entered is invalid/deactivated."))
+            await self.send_invalid_license(ctx)
             return
         license_guild_id, license_role_id = license_data
         await self.activate_license(ctx, license, license_guild_id, license_role_id, member)
         logger.info(f"{ctx.author} is adding license {license} to member {member} in guild {ctx.guild}")
 
+    @commands.command()
+    @commands.bot_has_permissions(manage_roles=True)
+    @commands.has_permissions(manage_roles=True)
+    @commands.guild_only()
+    async def add_licenses(self, ctx, *, licenses_and_members: str = ""):
+        """
+        Manually add multiple licenses to members at once.
+
+        Each line consists of a license and a member separated by space,
+        member can be a mention, ID or name.
+        Lines can also be sent as a text file attached to the command message
+        in case there are too many of them to fit in one message.
+
+        Example usage:
+        add_licenses
+        license1 @member1
+        license2 123456789123456789
+        """
+        text = licenses_and_members
+        if ctx.message.attachments:
+            attachment = ctx.message.attachments[0]
+            if attachment.size > _BULK_ATTACHMENT_MAX_SIZE:
+                await ctx.send(embed=failure(f"Attached file can't be larger than {_BULK_ATTACHMENT_MAX_SIZE} bytes."))
+                return
+            attachment_bytes = await attachment.read()
+            text = f"{text}\n{attachment_bytes.decode('utf-8', errors='replace')}"
+
+        errors = []
+        # license: member, dict since each license can be used only once
+        members = {}
+        member_converter = commands.MemberConverter()
+        for line_number, line in enumerate(text.splitlines(), start=1):
+            line = line.strip().strip("`")
+            if not line:
+                continue
+            arguments = line.split(maxsplit=1)
+            if len(arguments) != 2:
+                errors.append(f"Line {line_number}: expected license and member.")
+                continue
+            license, member_argument = arguments
+            if license in members:
+                errors.append(f"Line {line_number}: license {license} is already used in line above.")
+                continue
+            try:
+                members[license] = await member_converter.convert(ctx, member_argument)
+            except commands.BadArgument:
+                errors.append(f"Line {line_number}: member {member_argument} not found.")
+
+        if not members:
+            errors.insert(0, "No licenses to add!")
+            await ctx.send(embed=failure(misc.maximize_size("\n".join(errors))))
+            return
+
+        # All licenses are validated with one query instead of querying for each one
+        licenses_data = await self.bot.main_db.get_licenses_data(list(members), ctx.guild.id)
+        to_grant = []
+        # (member_id, role_id) pairs, since one member can have only one license per role
+        member_roles = set()
+        for license, member in members.items():
+            if license not in licenses_data:
+                errors.append(f"License {license} is invalid/deactivated.")
+                continue
+            role_id, license_duration = licenses_data[license]
+            role = ctx.guild.get_role(role_id)
+            if role is None:
+                errors.append(f"License {license}: role {role_id} linked to it no longer exists.")
+                continue
+            if role in member.roles:
+                errors.append(f"License {license}: {member} already has an active subscription for '{role.name}'.")
+                continue
+            if (member.id, role.id) in member_roles:
+                errors.append(f"License {license}: {member} is already getting '{role.name}' from another license.")
+                continue
+            member_roles.add((member.id, role.id))
+            to_grant.append((license, member, role, license_duration))
+
+        # Roles are added before the database changes, same as in single license activation.
+        # All are queued at once, action scheduler paces them under the guild role edit rate limit.
+        results = await asyncio.gather(
+            *(self.add_member_role(member, role, PRIORITY_REDEEM, reason="Redeemed license.")
+              for _, member, role, _ in to_grant),
+            return_exceptions=True
+        )
+        granted = []
+        for (license, member, role, license_duration), result in zip(to_grant, results):
+            if isinstance(result, Exception):
+                errors.append(f"License {license}: can't add role '{role.name}' to {member} - {result}")
+            else:
+                granted.append((license, member, role, license_duration))
+
+        redemptions = [(license, member.id, role.id, construct_expiration_date(license_duration))
+                       for license, member, role, license_duration in granted]
+        redeemed = set(await self.bot.main_db.redeem_licenses(ctx.guild.id, redemptions))
+
+        for license, member, role, _ in granted:
+            if license in redeemed:
+                continue
+            # License was redeemed or deleted by someone else in the meantime, so take the role back
+            errors.append(f"License {license} is no longer valid, removing role '{role.name}' from {member}.")
+            try:
+                await self.remove_member_role(member, role, PRIORITY_REDEEM, reason="License is no longer valid.")
+            except HTTPException as e:
+                logger.warning(f"Can't remove role {role.id} from member {member.id} after failed redeem: {e}")
+
+        logger.info(f"{ctx.author} has added {len(redeemed)} licenses in guild {ctx.guild}")
+        msg = f"Successfully added {len(redeemed)} out of {len(members)} licenses."
+        if errors:
+            await ctx.send(embed=warning(misc.maximize_size(f"{msg}\n\n" + "\n".join(errors))))
+        else:
+            await ctx.send(embed=success(msg, ctx.me))
+
+    def check_invalid_license_attempts(self, ctx):
+        """
+        :raise: commands.CommandOnCooldown if user has entered too many invalid licenses recently,
+                in that case the license is not even checked.
+        """
+        bucket = self.invalid_license_attempts.get_bucket(ctx.message)
+        retry_after = bucket.get_retry_after()
+        if retry_after:
+            raise commands.CommandOnCooldown(bucket, retry_after)
+
+    async def send_invalid_license(self, ctx):
+        """Notifies user that license is invalid and counts it towards user's invalid license attempts."""
+        if isinstance(ctx, _ForwardedContext):
+            # Attempts are counted by the worker that has received the DM
+            ctx.invalid_license = True
+        else:
+            self.invalid_license_attempts.update_rate_limit(ctx.message)
+        await ctx.send(embed=failure("The license key you entered is invalid/deactivated."))
+
     async def activate_license(self, ctx, license, guild_id: int, role_id: int, member):
         """
         :param ctx: invoked context
@@ -291,91 +667,84 @@ class LicenseHandler(commands.Cog):
             return
 
         # Passed member can be a user if redeem was activated in dm, so get the member
+        # Member is not necessarily in the gateway cache (if only licensed members are cached)
+        # Member is redeeming so not found result cached before they have (re)joined is not used
         if ctx.guild is None:
-            member = guild.get_member(member.id)
+            member = await self.member_cache.get_member(guild, member.id, use_negative_cache=False)
             if member is None:
                 await ctx.send(embed=failure("You are no longer it the guild you're trying to activate license!"))
                 return
 
-        if await self.bot.main_db.is_valid_license(license, guild.id):
-            # Adding role to the member requires that role object
-            # First we get the role linked to the license
-            role = guild.get_role(role_id)
-            if role is None:
-                log_error_msg = (f"Can't find role {role_id} in guild {guild.id} '{guild.name}' "
-                                 f"from license: '{license}' member to give the role to: {member.id} '{member.name}'"
-                                 "\n\nProceeding to delete this invalid license from database!")
-                logger.critical(log_error_msg)
-
-                msg = ("Well this is awkward...\n\n"
-                       "The role that was supposed to be given out by this license has been deleted from this guild!"
-                       f"\n\nError message:\n\n{log_error_msg}")
+        # Adding role to the member requires that role object
+        # First we get the role linked to the license
+        role = guild.get_role(role_id)
+        if role is None:
+            log_error_msg = (f"Can't find role {role_id} in guild {guild.id} '{guild.name}' "
+                             f"from license: '{license}' member to give the role to: {member.id} '{member.name}'"
+                             "\n\nProceeding to delete this invalid license from database!")
+            logger.critical(log_error_msg)
+
+            msg = ("Well this is awkward...\n\n"
+                   "The role that was supposed to be given out by this license has been deleted from this guild!"
+                   f"\n\nError message:\n\n{log_error_msg}")
+            await ctx.send(embed=failure(msg))
+            await self.bot.main_db.delete_license(license, guild.id)
+            return
+        # Now before doing anything check if member already has the role
+        # Beside for logic (why redeem already existing subscription?) if we don't check this claiming the
+        # license would overwrite the active subscription in table LICENSED_MEMBERS (because in that
+        # table the member id and role id is unique aka can only have uniques roles tied to member id)
+        if role in member.roles:
+            # We notify user that he already has the role, we also show him the expiration date
+            try:
+                expiration_date = await self.bot.main_db.get_member_license_expiration_date(member.id, role_id)
+            except DatabaseMissingData as e:
+                # TODO print role name instead of ID (from e)
+                msg = e.message
+                msg += (f"\nThe bot did not register {member.mention} in the database with that role but somehow they have it."
+                        "\nThis probably means that they were manually assigned this role without using the bot license system."
+                        "\nHave someone remove the role from them and call this command again.")
                 await ctx.send(embed=failure(msg))
-                await self.bot.main_db.delete_license(license)
-                return
-            # Now before doing anything check if member already has the role
-            # Beside for logic (why redeem already existing subscription?) if we don't check this we will get
-            # sqlite3.IntegrityError:
-            #   UNIQUE constraint failed:LICENSED_MEMBERS.MEMBER_ID,LICENSED_MEMBERS.LICENSED_ROLE_ID
-            # when adding new licensed member to table LICENSED_MEMBERS if member already has the role (because in that
-            # table the member id and role id is unique aka can only have uniques roles tied to member id)
-            if role in member.roles:
-                # We notify user that he already has the role, we also show him the expiration date
-                try:
-                    expiration_date = await self.bot.main_db.get_member_license_expiration_date(member.id, role_id)
-                except DatabaseMissingData as e:
-                    # TODO print role name instead of ID (from e)
-                    msg = e.message
-                    msg += (f"\nThe bot did not register {member.mention} in the database with that role but somehow they have it."
-                            "\nThis probably means that they were manually assigned this role without using the bot license system."
-                            "\nHave someone remove the role from them and call this command again.")
-                    await ctx.send(embed=failure(msg))
-                    if ctx.guild is not None:
-                        # delete message but only if in guild, can't delete dm messages
-                        await ctx.message.delete()
-                    return
-
-                remaining_time = get_remaining_time(expiration_date)
-                msg = (f"{member.mention} already has an active subscription for the '{role.name}' role!"
-                       f"\nIt's valid for another {remaining_time}")
-                await ctx.send(embed=warning(msg))
                 if ctx.guild is not None:
                     # delete message but only if in guild, can't delete dm messages
                     await ctx.message.delete()
                 return
-            # We add the role to the member, we do this before adding/removing stuff from db
-            # just in case the bot doesn't have perms and throws exception (we already
-            # checked for bot_has_permissions(manage_roles=True) but it can happen that bot has
-            # that permission and check is passed but it's still forbidden to alter role for the
-            # member because of it's role hierarchy.) -> will raise Forbidden and be caught by cmd error handler
-            await member.add_roles(role, reason="Redeemed license.")
-            # We add entry to db table LICENSED_MEMBERS (which we will checked periodically for expiration)
-            # First we get the license duration so we can calculate expiration date
-            license_duration = await self.bot.main_db.get_license_duration_hours(license)
-            expiration_date = construct_expiration_date(license_duration)
-            # In case where you successfully redeemed the role and it's still in database(not expired)
-            # BUT someone manually removed the role, in that case when you try to redeem a valid license
-            # for the said role you will get IntegrityError because LICENSED_ROLE_ID and MEMBER_ID have to
-            # be unique (and the entry still exists in database).
-            # Even when caught by remove role event leave this
-            try:
-                await self.bot.main_db.add_new_licensed_member(member.id, guild.id, expiration_date, role_id)
-            except IntegrityError:
-                # We remove the database entry because when role was remove the bot was
-                # probably offline and couldn't register the role remove event
-                await self.bot.main_db.delete_licensed_member(member.id, role_id)
-                await self.bot.main_db.add_new_licensed_member(member.id, guild.id, expiration_date, role_id)
-                msg = (f"Someone removed the role manually from {member.mention} but no worries,\n"
-                       "since the license is valid we're just gonna reactivate it :)")
-                await ctx.send(embed=info(msg, ctx.me))
-
-            # Remove guild license from database, so it can't be redeemed again
-            await self.bot.main_db.delete_license(license)
-            # Send message notifying user
-            msg = f"License valid - guild '{guild.name}' adding role '{role.name}' to {member.mention} in duration of {license_duration}h"
-            await ctx.send(embed=success(msg, ctx.me))
-        else:
-            await ctx.send(embed=failure("The license key you entered is invalid/deactivated."))
+
+            remaining_time = get_remaining_time(expiration_date)
+            msg = (f"{member.mention} already has an active subscription for the '{role.name}' role!"
+                   f"\nIt's valid for another {remaining_time}")
+            await ctx.send(embed=warning(msg))
+            if ctx.guild is not None:
+                # delete message but only if in guild, can't delete dm messages
+                await ctx.message.delete()
+            return
+        # License is claimed (deleted from the database together with adding the licensed member entry) before
+        # adding the role, that way the same license can't be redeemed by multiple members at the same time.
+        # In case where you successfully redeemed the role and it's still in database(not expired)
+        # BUT someone manually removed the role while the bot was offline the existing entry gets replaced.
+        claimed = await self.bot.main_db.claim_license(license, guild.id, member.id)
+        if claimed is None:
+            await self.send_invalid_license(ctx)
+            return
+        _, license_duration, reactivated = claimed
+        # We already checked for bot_has_permissions(manage_roles=True) but it can happen that bot has
+        # that permission and check is passed but it's still forbidden to alter role for the
+        # member because of it's role hierarchy. -> will raise Forbidden and be caught by cmd error handler
+        # In that case the license is put back to the database so it can be redeemed again.
+        try:
+            await self.add_member_role(member, role, PRIORITY_REDEEM, reason="Redeemed license.")
+        except Exception:
+            await self.bot.main_db.release_license(license, guild.id, member.id, role_id, license_duration)
+            raise
+
+        if reactivated:
+            msg = (f"Someone removed the role manually from {member.mention} but no worries,\n"
+                   "since the license is valid we're just gonna reactivate it :)")
+            await ctx.send(embed=info(msg, ctx.me))
+
+        # Send message notifying user
+        msg = f"License valid - guild '{guild.name}' adding role '{role.name}' to {member.mention} in duration of {license_duration}h"
+        await ctx.send(embed=success(msg, ctx.me))
 
     @commands.command()
     @commands.cooldown(1, 10, commands.BucketType.guild)
@@ -387,6 +756,8 @@ class LicenseHandler(commands.Cog):
         Generates new guild licenses.
 
         Max licenses to generate at once is 25.
+        Bot owners can generate up to 100 000 at once and are not limited by maximum unused guild licenses,
+        if more than 25 are generated they are sent as a file.
         All Arguments are optional, if not passed default guild values are used.
 
         Arguments are stacked, meaning you can't pass 'license_duration' without the first 2 arguments.
@@ -399,10 +770,11 @@ class LicenseHandler(commands.Cog):
         generate 7 @role 1w
 
         License duration is either a number representing hours or a string consisting of words in format:
-        each word has to contain [integer][format] , entries are separated by space.
+        each word has to contain [integer][format] , entries are separated by space or written together.
+        ISO-8601 durations (P1M2D, PT36H...) also work.
 
         Formats are:
-        years y months m weeks w days d hours h
+        years y months m mo weeks w days d hours h minutes min
 
         License duration examples:
         20
@@ -412,10 +784,15 @@ class LicenseHandler(commands.Cog):
         1w 2m 1w
         1week 1week
         12hours 5d
+        1y2m
+        90min
+        P1MT12H
         ...
         """
-        if num > 25:
-            await ctx.send(embed=failure("Maximum number of licenses to generate at once is 25."))
+        is_owner = await self.bot.is_owner(ctx.author)
+        max_generate = _OWNER_MAX_GENERATE_AT_ONCE if is_owner else _MAX_GENERATE_AT_ONCE
+        if num > max_generate:
+            await ctx.send(embed=failure(f"Maximum number of licenses to generate at once is {max_generate}."))
             return
 
         # Check if the role is manageable by bot
@@ -426,18 +803,19 @@ class LicenseHandler(commands.Cog):
 
         guild_id = ctx.guild.id
 
-        # Maximum number of unused licenses
+        # Maximum number of unused licenses, bot owners are not limited (generating for a storefront)
         max_licenses_per_guild = self.bot.config["maximum_unused_guild_licences"]
-        guild_licences_count = await self.bot.main_db.get_guild_license_total_count(guild_id)
-        if guild_licences_count == max_licenses_per_guild:
-            msg = f"You have reached maximum number of unused licenses per guild: {max_licenses_per_guild}!"
-            await ctx.send(embed=warning(msg))
-            return
-        if guild_licences_count + num > max_licenses_per_guild:
-            msg = (f"I can't generate since you will exceed the limit of {max_licenses_per_guild} licenses!\n"
-                   f"Remaining licenses to generate: {max_licenses_per_guild-guild_licences_count}.")
-            await ctx.send(embed=failure(msg))
-            return
+        if not is_owner:
+            guild_licences_count = await self.bot.main_db.get_guild_license_total_count(guild_id)
+            if guild_licences_count >= max_licenses_per_guild:
+                msg = f"You have reached maximum number of unused licenses per guild: {max_licenses_per_guild}!"
+                await ctx.send(embed=warning(msg))
+                return
+            if guild_licences_count + num > max_licenses_per_guild:
+                msg = (f"I can't generate since you will exceed the limit of {max_licenses_per_guild} licenses!\n"
+                       f"Remaining licenses to generate: {max_licenses_per_guild-guild_licences_count}.")
+                await ctx.send(embed=failure(msg))
+                return
 
         if license_duration is None:
             license_duration = await self.bot.main_db.get_default_guild_license_duration_hours(guild_id)
@@ -459,6 +837,14 @@ class LicenseHandler(commands.Cog):
                    f"Sending generated licenses in DM for quick use.")
         await ctx.send(embed=success(ctx_msg, ctx.me))
 
+        if count_generated > _MAX_GENERATE_AT_ONCE:
+            # Too many to fit in a message
+            licenses_file = discord.File(io.BytesIO("\n".join(generated).encode()), filename="licenses.txt")
+            await ctx.author.send(f"Generated {count_generated} licenses for role '{license_role.name}' in "
+                                  f"guild '{ctx.guild.name}' in duration of {license_duration}h:",
+                                  file=licenses_file)
+            return
+
         table = texttable.Texttable(max_width=45)
         table.set_cols_dtype(["t"])
         table.set_cols_align(["c"])
@@ -551,11 +937,11 @@ class LicenseHandler(commands.Cog):
         table.add_row(header)
 
         for entry in to_show:
-            # Entry is in form ('I0QSZeyPJTy3H8tNsmUihKsn8JH48y', '617484493296631839', 720)
+            # Entry is in form ('I0QSZeyPJTy3H8tNsmUihKsn8JH48y', 617484493296631839, 720)
             try:
-                role = ctx.guild.get_role(int(entry[1]))
+                role = ctx.guild.get_role(entry[1])
                 table.add_row((entry[0], role.name, entry[2]))
-            except (ValueError, AttributeError):
+            except AttributeError:
                 # Just in case if error in case role is None (deleted from guild) just show IDs from database
                 table.add_row(entry)
 
@@ -563,6 +949,141 @@ class LicenseHandler(commands.Cog):
         await ctx.send(embed=success("Sent to DM!", ctx.me), delete_after=5)
         await Paginator.paginate(self.bot, ctx.author, ctx.author, table.draw(), title=title)
 
+    @commands.command(aliases=["export"])
+    @commands.cooldown(1, 60, commands.BucketType.guild)
+    @commands.has_permissions(administrator=True)
+    @commands.guild_only()
+    async def export_licenses(self, ctx, export_format: str = "csv", license_role: discord.Role = None):
+        """
+        Exports stored guild licenses to a file that is sent in DM.
+
+        Formats are csv and jsonl, default is csv.
+        If license_role is passed only licenses for that role are exported, otherwise all guild licenses.
+        Each license has fields: license, role_id, duration_hours
+        Exported file can be imported with import_licenses command.
+
+        Example usages:
+        export_licenses
+        export_licenses jsonl
+        export_licenses csv @role
+        """
+        if self.bot.main_db.license_hasher is not None:
+            await ctx.send(embed=failure("Licenses are stored hashed so they can't be exported, "
+                                         "they are only shown once when generated."))
+            return
+
+        export_format = export_format.lower()
+        if export_format not in license_export.EXPORT_FORMATS:
+            await ctx.send(embed=failure(f"Format has to be one of: {', '.join(license_export.EXPORT_FORMATS)}"))
+            return
+
+        role_id = None if license_role is None else license_role.id
+        exported_count = 0
+        # Written to disk batch by batch as they are read so big exports are not kept in memory
+        with tempfile.TemporaryFile() as export_file:
+            async for licenses in self.bot.main_db.iterate_guild_licenses(ctx.guild.id, role_id):
+                license_export.write_licenses(export_file, export_format, licenses, header=exported_count == 0)
+                exported_count += len(licenses)
+
+            if exported_count == 0:
+                await ctx.send(embed=failure("No licenses to export."))
+                return
+            if export_file.tell() > _LICENSE_FILE_MAX_SIZE:
+                await ctx.send(embed=failure(f"Export is too large to send ({export_file.tell()} bytes), "
+                                             f"export licenses for each role separately."))
+                return
+
+            export_file.seek(0)
+            await ctx.author.send(f"Exported {exported_count} licenses from guild '{ctx.guild.name}'.",
+                                  file=discord.File(export_file, filename=f"licenses.{export_format}"))
+        logger.info(f"{ctx.author} has exported {exported_count} licenses from guild {ctx.guild}")
+        await ctx.send(embed=success("Sent to DM!", ctx.me), delete_after=5)
+
+    @commands.command(aliases=["import"])
+    @commands.cooldown(1, 60, commands.BucketType.guild)
+    @commands.has_permissions(administrator=True)
+    @commands.guild_only()
+    async def import_licenses(self, ctx, license_role: discord.Role = None,
+                              *, license_duration: license_duration = None):
+        """
+        Imports pre-generated licenses from attached file.
+
+        File has to be csv or jsonl, same format as the one from export_licenses command.
+        Fields role_id and duration_hours are optional, licenses without them use passed
+        license_role and license_duration or if those are not passed default guild values.
+        Text file with one license per line also works.
+        Licenses that already exist are skipped.
+
+        Example usages (with attached file):
+        import_licenses
+        import_licenses @role
+        import_licenses @role 1m
+        """
+        if not ctx.message.attachments:
+            await ctx.send(embed=failure("Attach a csv or jsonl file with licenses to import."))
+            return
+        attachment = ctx.message.attachments[0]
+        if attachment.size > _LICENSE_FILE_MAX_SIZE:
+            await ctx.send(embed=failure(f"Attached file can't be larger than {_LICENSE_FILE_MAX_SIZE} bytes."))
+            return
+        import_format = "jsonl" if attachment.filename.lower().endswith((".jsonl", ".json")) else "csv"
+        attachment_bytes = await attachment.read()
+        licenses, errors = license_export.read_licenses(attachment_bytes.decode("utf-8", errors="replace"),
+                                                        import_format)
+        if not licenses:
+            errors.insert(0, "No licenses to import!")
+            await ctx.send(embed=failure(misc.maximize_size("\n".join(errors))))
+            return
+
+        guild_id = ctx.guild.id
+        if not await self.bot.is_owner(ctx.author):
+            max_licenses_per_guild = self.bot.config["maximum_unused_guild_licences"]
+            guild_licences_count = await self.bot.main_db.get_guild_license_total_count(guild_id)
+            if guild_licences_count + len(licenses) > max_licenses_per_guild:
+                msg = (f"I can't import since you will exceed the limit of {max_licenses_per_guild} licenses!\n"
+                       f"Remaining licenses to import: {max(max_licenses_per_guild - guild_licences_count, 0)}.")
+                await ctx.send(embed=failure(msg))
+                return
+
+        if any(role_id is None for _, role_id, _ in licenses) and license_role is None:
+            licensed_role_id = await self.bot.main_db.get_default_guild_license_role_id(guild_id)
+            license_role = ctx.guild.get_role(licensed_role_id)
+            if license_role is None:
+                await self.handle_missing_default_role(ctx, licensed_role_id)
+                return
+        if any(duration is None for _, _, duration in licenses) and license_duration is None:
+            license_duration = await self.bot.main_db.get_default_guild_license_duration_hours(guild_id)
+
+        to_import = []
+        # role_id: error message or None if role can be managed, so each role is only checked once
+        role_errors = {}
+        for license, role_id, duration in licenses:
+            role_id = license_role.id if role_id is None else role_id
+            if role_id not in role_errors:
+                role = ctx.guild.get_role(role_id)
+                if role is None:
+                    role_errors[role_id] = f"role {role_id} not found."
+                elif not ctx.me.top_role > role:
+                    role_errors[role_id] = f"I can only manage roles **below** me in hierarchy ({role.name})."
+                else:
+                    role_errors[role_id] = None
+            if role_errors[role_id] is not None:
+                errors.append(f"License {license}: {role_errors[role_id]}")
+                continue
+            to_import.append((license, role_id, license_duration if duration is None else duration))
+
+        imported_count = await self.bot.main_db.import_guild_licenses(guild_id, to_import)
+        existing_count = len(to_import) - imported_count
+        if existing_count:
+            errors.append(f"{existing_count} licenses already exist and were skipped.")
+
+        logger.info(f"{ctx.author} has imported {imported_count} licenses in guild {ctx.guild}")
+        msg = f"Successfully imported {imported_count} licenses."
+        if errors:
+            await ctx.send(embed=warning(misc.maximize_size(f"{msg}\n\n" + "\n".join(errors))))
+        else:
+            await ctx.send(embed=success(msg, ctx.me))
+
     @commands.command(aliases=["data"])
     @commands.guild_only()
     async def member_data(self, ctx, member: discord.Member = None):
@@ -595,16 +1116,17 @@ class LicenseHandler(commands.Cog):
             return
 
         for entry in all_active:
-            # Entry is in form ("license_id", "expiration_date)
+            # Entry is in form (licensed_role_id, expiration_timestamp)
+            expiration_date = timestamp_to_datetime(entry[1])
             try:
-                role = ctx.guild.get_role(int(entry[0]))
-                table.add_row((role.name, entry[1]))
-            except (ValueError, AttributeError):
+                role = ctx.guild.get_role(entry[0])
+                table.add_row((role.name, expiration_date))
+            except AttributeError:
                 # Just in case if error in case role is None (deleted from guild) just show IDs from database
-                table.add_row(entry)
+                table.add_row((entry[0], expiration_date))
 
-        local_time = get_current_time()
-        title = (f"Server local time: {local_time}\n\n"
+        current_time = get_current_time()
+        title = (f"Current time (UTC): {current_time}\n\n"
                  f"{member.name} active subscriptions in guild '{ctx.guild.name}':\n\n")
 
         await ctx.send(embed=info("Sent in Dms!", ctx.me), delete_after=5)
@@ -616,7 +1138,7 @@ class LicenseHandler(commands.Cog):
     async def delete_license(self, ctx, license):
         """Deletes specified stored license."""
         if await self.bot.main_db.is_valid_license(license, ctx.guild.id):
-            await self.bot.main_db.delete_license(license)
+            await self.bot.main_db.delete_license(license, ctx.guild.id)
             await ctx.send(embed=success("License deleted.", ctx.me))
             logger.info(f"{ctx.author} is deleting license {license} from guild {ctx.guild}")
         else:
@@ -647,7 +1169,8 @@ class LicenseHandler(commands.Cog):
 
         :param missing_role_id: role that is in db but is missing in guild
 
-        TODO: on startup/reconnect check if default role from db is valid
+        Deleted default roles are unset by the deleted roles check after startup,
+        so this is only needed until that check is done.
         """
         msg = (f"Trying to use role with ID {missing_role_id} that was set "
                f"as default role for guild {ctx.guild.name} but cannot find it "
@@ -52,6 +52,13 @@ class ConfigHandler:
     def __getitem__(self, key: str):
         return self._get_key(key)
 
+    def get(self, key: str, default=None):
+        """
+        Same as self[key] but returns param default if key is not found, used for optional keys
+        so older config files keep working.
+        """
+        return self._config.get(key, default)
+
     def _get_key(self, key: str):
         try:
             return self._config[key]
@@ -1,52 +1,211 @@
+import asyncio
 import logging
 import aiosqlite
 from pathlib import Path
+from collections import defaultdict
 from datetime import datetime
-from typing import Tuple, List, Union
+from typing import Tuple, List, Set, Union, Optional, Dict, Any, Iterable, AsyncIterator
 
+import database_migrations
 from helpers import misc
 from helpers import licence_helper
+from helpers.sharding import ShardPartition
+from helpers.bloom_filter import BloomFilter
+from helpers.table_counter import TableCounter
+from helpers.expiration_scheduler import ExpirationScheduler
 from helpers.errors import DefaultGuildRoleNotSet, DatabaseMissingData
 
 
 logger = logging.getLogger(__name__)
 
 
+class _Transaction:
+    """
+    Async context manager returned by DatabaseHandler.transaction()
+    Holds the write lock for the whole transaction so writes from other coroutines can't end up in it.
+    """
+    def __init__(self, database_handler: "DatabaseHandler"):
+        self._db = database_handler
+
+    async def __aenter__(self) -> aiosqlite.core.Connection:
+        await self._db._write_lock.acquire()
+        try:
+            connection = self._db.connection
+            # Writes that are waiting for group commit, commit them now so rollback doesn't affect them
+            if connection.in_transaction:
+                await connection.commit()
+            await connection.execute("BEGIN IMMEDIATE")
+        except Exception:
+            self._db._write_lock.release()
+            raise
+        return connection
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        try:
+            if exc_type is None:
+                await self._db.connection.commit()
+            else:
+                await self._db.connection.rollback()
+        finally:
+            self._db._write_lock.release()
+
+
 class DatabaseHandler:
     DB_PATH = "databases/"
     DB_EXTENSION = ".sqlite3"
+    # Writes that arrive within this many seconds of each other are committed together
+    COMMIT_DELAY = 0.005
+    # Maximum number of values bound in a single IN (...) query, below the SQLite default limit of 999
+    MAX_QUERY_PARAMETERS = 900
+    # Licenses that are stored hashed can't be shown so their prefix is shown instead
+    LICENSE_DISPLAY_COLUMN = "IFNULL(LICENSE_PREFIX || '...', LICENSE)"
+    # License filter is sized for this many times the stored licenses so it doesn't fill up right away
+    LICENSE_FILTER_GROWTH = 2
+    LICENSE_FILTER_MIN_CAPACITY = 10_000
+    LICENSE_FILTER_FALSE_POSITIVE_RATE = 0.001
+    # PRAGMAs applied on every connect, values can be overridden with "database" dict in config.
+    # WAL lets readers proceed while something is writing and with it synchronous NORMAL is still safe
+    # from corruption (only the last commits can be lost on power loss, not on application crash).
+    DEFAULT_CONNECTION_PROFILE = {
+        "journal_mode": "WAL",
+        "synchronous": "NORMAL",
+        # Negative value is in KiB
+        "cache_size": -16000,
+        "mmap_size": 268435456,
+        "temp_store": "MEMORY",
+        "busy_timeout": 5000,
+    }
 
     @classmethod
-    async def create_instance(cls, db_name: str = "main"):
+    async def create_instance(cls, db_name: str = "main", connection_profile: Dict[str, Any] = None,
+                              reader_pool_size: int = 2, shard_partition: ShardPartition = None,
+                              license_hash_secret: Optional[str] = None):
         """"
         Can't use await in __init__ so we create a factory pattern.
         To correctly create this object you need to call :
             await DatabaseHandler.create_instance()
 
+        :param db_name: name of database file without extension
+        :param connection_profile: dict of PRAGMA name -> value, overrides DEFAULT_CONNECTION_PROFILE values
+        :param reader_pool_size: number of read only connections used for SELECT queries. Each connection has it's
+                                 own thread so reads don't queue behind writes. If 0 everything uses the writer.
+        :param shard_partition: shards ran by this process, expiration scheduler, prefix cache and guild checks
+                                only load guilds on these shards. None for all guilds.
+        :param license_hash_secret: if passed licenses are stored as hashes keyed with this secret instead of
+                                    plaintext, existing plaintext licenses are converted at startup.
+                                    Once set it can't be changed or removed, stored licenses would become invalid.
         """
         self = DatabaseHandler()
         self.db_name = db_name
+        self.shard_partition = shard_partition if shard_partition is not None else ShardPartition()
+        self.licensed_members_counter = TableCounter(self.shard_partition.owns_guild)
+        self.stored_licenses_counter = TableCounter(self.shard_partition.owns_guild)
+        if license_hash_secret:
+            self.license_hasher = licence_helper.LicenseHasher(license_hash_secret)
+        self.connection_profile = {**DatabaseHandler.DEFAULT_CONNECTION_PROFILE, **(connection_profile or {})}
         self.connection = await self._get_connection()
-        logger.info("Connection to database established.")
+        self._queue_depth[self.connection] = 0
+        for _ in range(reader_pool_size):
+            reader = await self._get_reader_connection()
+            self._readers.append(reader)
+            self._queue_depth[reader] = 0
+        logger.info(f"Connection to database established, using {len(self._readers)} reader connections.")
+        await self._check_license_storage()
+        await self.rebuild_license_filter()
+        logger.info(f"Loaded {len(self.license_filter)} licenses into license filter.")
+        self.expiration_scheduler.load(await self.get_all_licensed_members())
+        logger.info(f"Loaded {len(self.expiration_scheduler)} licensed members into expiration scheduler.")
+        await self._load_prefix_cache()
+        logger.info(f"Loaded {len(self._prefix_cache)} guild prefixes into cache.")
+        await self.reconcile_counters()
         return self
 
     def __init__(self):
         self.db_name = None
+        self.connection_profile = {}
+        # Writer connection, all writes go trough it
         self.connection = None
+        # Read only connections
+        self._readers = []
+        # connection -> number of queries that were sent to it and are not yet done
+        self._queue_depth = {}
+        self._write_lock = asyncio.Lock()
+        # Future shared by all writes waiting for the next group commit
+        self._pending_commit = None
+        self.shard_partition = ShardPartition()
+        # None if licenses are stored in plaintext
+        self.license_hasher = None
+        self.expiration_scheduler = ExpirationScheduler()
+        # Bloom filter of stored license keys (licenses or their hashes) of guilds on our shards,
+        # licenses that are not in it are rejected without querying the database.
+        self.license_filter = BloomFilter(DatabaseHandler.LICENSE_FILTER_MIN_CAPACITY)
+        # While filter is being rebuilt keys added in the meantime are also collected here
+        self._license_filter_pending = None
+        self.license_filter_checks = 0
+        self.license_filter_rejections = 0
+        # guild_id -> prefix, prefix is fetched for every message so we don't want to hit the db each time
+        self._prefix_cache = {}
+        self.prefix_cache_hits = 0
+        self.prefix_cache_misses = 0
+        # Row counts of LICENSED_MEMBERS and GUILD_LICENSES so statistics don't need COUNT(*) queries,
+        # only guilds on our shards are counted.
+        self.licensed_members_counter = TableCounter()
+        self.stored_licenses_counter = TableCounter()
 
     async def _get_connection(self) -> aiosqlite.core.Connection:
         """
-        Returns a connection to the db, if db doesn't exist create new
+        Returns a connection to the db, if db doesn't exist create new.
+        Either way the database schema is migrated to the latest version.
         :return: aiosqlite.core.Connection
         """
         path = DatabaseHandler._construct_path(self.db_name)
         if Path(path).is_file():
             conn = await aiosqlite.connect(path)
-            return conn
         else:
             logger.warning("Database not found! Creating fresh ...")
             misc.check_create_directory(DatabaseHandler.DB_PATH)
-            return await DatabaseHandler._create_database(path)
+            conn = await DatabaseHandler._create_database(path)
+
+        await self._apply_connection_profile(conn)
+        await database_migrations.migrate(conn)
+        return conn
+
+    async def _get_reader_connection(self) -> aiosqlite.core.Connection:
+        """
+        Returns a read only connection to the db, db has to already exist.
+        In WAL journal mode readers don't block the writer and vice versa.
+        :return: aiosqlite.core.Connection
+        """
+        uri = Path(DatabaseHandler._construct_path(self.db_name)).resolve().as_uri() + "?mode=ro"
+        conn = await aiosqlite.connect(uri, uri=True)
+        # Journal mode is persisted in the database file and can't be changed by read only connection anyway
+        await self._apply_connection_profile(conn, skip=("journal_mode",))
+        return conn
+
+    async def _apply_connection_profile(self, conn: aiosqlite.core.Connection, skip: Tuple[str, ...] = ()):
+        for pragma, value in self.connection_profile.items():
+            if pragma in skip:
+                continue
+            # PRAGMA doesn't support parameters so don't let config inject anything
+            if not pragma.isidentifier() or not str(value).lstrip("-").isalnum():
+                logger.critical(f"Ignoring invalid database connection PRAGMA {pragma}={value}")
+                continue
+            await conn.execute(f"PRAGMA {pragma}={value}")
+
+    async def get_connection_profile_values(self) -> Dict[str, Any]:
+        """
+        Reads back values of PRAGMAs from the connection profile, useful to check if they were applied.
+        Some can silently fail, for example journal_mode=WAL on file systems that don't support it.
+        :return: dict PRAGMA name -> current value
+        """
+        values = {}
+        for pragma in self.connection_profile:
+            if not pragma.isidentifier():
+                continue
+            async with self.connection.execute(f"PRAGMA {pragma}") as cursor:
+                row = await cursor.fetchone()
+                values[pragma] = None if row is None else row[0]
+        return values
 
     @staticmethod
     def _construct_path(db_name: str) -> str:
@@ -55,6 +214,7 @@ class DatabaseHandler:
     @staticmethod
     async def _create_database(path: str) -> aiosqlite.core.Connection:
         """
+        Creates the initial (version 0) schema, database_migrations then upgrades it to the latest version.
         :param path: path where database will be created, including file name and extension
         :return: aiosqlite.core.Connection
         """
@@ -93,30 +253,149 @@ class DatabaseHandler:
         logger.info("Database successfully created!")
         return conn
 
-    async def update_database(self, query: str, *args):
-        await self.connection.execute(query, args)
-        await self.connection.commit()
+    async def close(self):
+        """Commits all pending writes and closes all database connections."""
+        async with self._write_lock:
+            await self.connection.commit()
+            await self.connection.close()
+        for reader in self._readers:
+            await reader.close()
+
+    def get_queue_depths(self) -> Dict[str, int]:
+        """
+        :return: dict connection name -> number of queries currently queued/running on it
+        """
+        depths = {"writer": self._queue_depth[self.connection]}
+        for index, reader in enumerate(self._readers):
+            depths[f"reader {index}"] = self._queue_depth[reader]
+        return depths
+
+    async def _fetch_one(self, query: str, *args) -> Optional[tuple]:
+        """Executes read query on the least busy reader connection and returns first row or None."""
+        return await self._read(query, args, fetch_all=False)
+
+    async def _fetch_all(self, query: str, *args) -> List[tuple]:
+        """Executes read query on the least busy reader connection and returns all rows."""
+        return await self._read(query, args, fetch_all=True)
+
+    def _get_least_busy_reader(self) -> aiosqlite.core.Connection:
+        """:return: reader connection with the least queries queued, writer if there are no readers"""
+        # Readers only see committed data, that's fine since writes don't return until they are committed
+        if self._readers:
+            return min(self._readers, key=self._queue_depth.__getitem__)
+        return self.connection
+
+    async def _read(self, query: str, args: tuple, *, fetch_all: bool):
+        connection = self._get_least_busy_reader()
+        self._queue_depth[connection] += 1
+        try:
+            async with connection.execute(query, args) as cursor:
+                if fetch_all:
+                    return await cursor.fetchall()
+                else:
+                    return await cursor.fetchone()
+        finally:
+            self._queue_depth[connection] -= 1
+
+    def transaction(self) -> _Transaction:
+        """
+        Use for writes that need to be atomic, example:
+            async with self.transaction() as connection:
+                await connection.execute(...)
+                await connection.executemany(...)
+        Everything is committed at once when block exits or rolled back if exception is raised.
+        """
+        return _Transaction(self)
+
+    async def update_database(self, query: str, *args) -> aiosqlite.core.Cursor:
+        """
+        Executes write query and waits until it is committed.
+        Commit is shared with all other writes that arrived in the meantime (group commit)
+        so a burst of writes results in one commit instead of one commit each.
+        :return: cursor of the executed query
+        """
+        self._queue_depth[self.connection] += 1
+        try:
+            async with self._write_lock:
+                cursor = await self.connection.execute(query, args)
+        finally:
+            self._queue_depth[self.connection] -= 1
+        await self._group_commit()
+        return cursor
+
+    async def _group_commit(self):
+        if self._pending_commit is None:
+            loop = asyncio.get_event_loop()
+            self._pending_commit = loop.create_future()
+            loop.call_later(DatabaseHandler.COMMIT_DELAY, lambda: asyncio.ensure_future(self._commit_pending()))
+        # Shielded since cancelling one of the waiters shouldn't cancel the commit for all of them
+        await asyncio.shield(self._pending_commit)
+
+    async def _commit_pending(self):
+        future, self._pending_commit = self._pending_commit, None
+        try:
+            async with self._write_lock:
+                await self.connection.commit()
+        except Exception as e:
+            future.set_exception(e)
+        else:
+            future.set_result(None)
 
     # TABLE GUILDS #######################################################################
     async def setup_new_guild(self, guild_id: int, default_prefix: str):
         insert_guild_query = "INSERT INTO GUILDS(GUILD_ID, PREFIX) VALUES(?,?)"
         await self.update_database(insert_guild_query, guild_id, default_prefix)
+        self._prefix_cache[guild_id] = default_prefix
+
+    async def setup_new_guilds(self, guild_ids: Iterable[int], default_prefix: str):
+        """
+        Same as setup_new_guild but for multiple guilds at once, all are added in one transaction.
+        Guilds that are already in the database are left as they are.
+        """
+        insert_guild_query = "INSERT OR IGNORE INTO GUILDS(GUILD_ID, PREFIX) VALUES(?,?)"
+        guild_ids = list(guild_ids)
+        async with self.transaction() as connection:
+            await connection.executemany(insert_guild_query, [(guild_id, default_prefix) for guild_id in guild_ids])
+        for guild_id in guild_ids:
+            self._prefix_cache.setdefault(guild_id, default_prefix)
 
     async def get_guild_prefix(self, guild_id: int) -> str:
+        """
+        Returns guild prefix from cache, database is only queried if guild is not cached.
+        """
+        prefix = self._prefix_cache.get(guild_id)
+        if prefix is not None:
+            self.prefix_cache_hits += 1
+            return prefix
+
+        self.prefix_cache_misses += 1
         query = "SELECT PREFIX FROM GUILDS WHERE GUILD_ID=?"
-        async with self.connection.execute(query, (guild_id,)) as cursor:
-            row = await cursor.fetchone()
-            return row[0]
+        row = await self._fetch_one(query, guild_id)
+        self._prefix_cache[guild_id] = row[0]
+        return row[0]
+
+    async def _load_prefix_cache(self):
+        """Loads prefixes of all guilds on our shards into cache with a single query."""
+        shard_condition, shard_args = self.shard_partition.get_sql_condition()
+        query = f"SELECT GUILD_ID, PREFIX FROM GUILDS WHERE {shard_condition}"
+        results = await self._fetch_all(query, *shard_args)
+        self._prefix_cache = {row[0]: row[1] for row in results}
 
-    async def get_all_guild_ids(self):
+    def get_prefix_cache_stats(self) -> Tuple[int, int, int]:
         """
-        :return: a tuple of all guild ids (ints)
+        :return: tuple(int cached guilds, int cache hits, int cache misses)
+        """
+        return len(self._prefix_cache), self.prefix_cache_hits, self.prefix_cache_misses
+
+    async def get_all_guild_ids(self) -> Set[int]:
+        """
+        :return: a set of all guild ids (ints) on our shards
 
         """
-        query = "SELECT GUILD_ID FROM GUILDS"
-        async with self.connection.execute(query) as cursor:
-            results = await cursor.fetchall()
-            return tuple(int(guild_id[0]) for guild_id in results)
+        shard_condition, shard_args = self.shard_partition.get_sql_condition()
+        query = f"SELECT GUILD_ID FROM GUILDS WHERE {shard_condition}"
+        results = await self._fetch_all(query, *shard_args)
+        return {guild_id[0] for guild_id in results}
 
     async def change_guild_prefix(self, guild_id: int, prefix: str):
         """
@@ -126,6 +405,7 @@ class DatabaseHandler:
         """
         query = "UPDATE GUILDS SET PREFIX=? WHERE GUILD_ID=?"
         await self.update_database(query, prefix, guild_id)
+        self._prefix_cache[guild_id] = prefix
 
     async def change_default_guild_role(self, guild_id: int, role_id: int):
         query = "UPDATE GUILDS SET DEFAULT_LICENSE_ROLE_ID=? WHERE GUILD_ID=?"
@@ -144,16 +424,15 @@ class DatabaseHandler:
 
         """
         query = "SELECT DEFAULT_LICENSE_ROLE_ID FROM GUILDS WHERE GUILD_ID=?"
-        async with self.connection.execute(query, (guild_id,)) as cursor:
-            row = await cursor.fetchone()
-            try:
-                return int(row[0])
-            except TypeError:
-                raise DefaultGuildRoleNotSet("Default guild license not set!\n\n"
-                                             "For more information call command:\n"
-                                             "{prefix}help default_role\n\n"
-                                             "If still in doubt call:\n"
-                                             "{prefix}help")
+        row = await self._fetch_one(query, guild_id)
+        if row is not None and row[0] is not None:
+            return row[0]
+        else:
+            raise DefaultGuildRoleNotSet("Default guild license not set!\n\n"
+                                         "For more information call command:\n"
+                                         "{prefix}help default_role\n\n"
+                                         "If still in doubt call:\n"
+                                         "{prefix}help")
 
     async def get_default_guild_license_duration_hours(self, guild_id: int) -> int:
         """
@@ -162,105 +441,155 @@ class DatabaseHandler:
 
         """
         query = "SELECT DEFAULT_LICENSE_DURATION_HOURS FROM GUILDS WHERE GUILD_ID=?"
-        async with self.connection.execute(query, (guild_id,)) as cursor:
-            row = await cursor.fetchone()
-            #
-            if not row:
-                # License duration has default value.
-                # So if this is None it means the guild is not found in database.
-                raise DatabaseMissingData(f"Guild {guild_id} not found in database!")
-            return int(row[0])
+        row = await self._fetch_one(query, guild_id)
+        if not row:
+            # License duration has default value.
+            # So if this is None it means the guild is not found in database.
+            raise DatabaseMissingData(f"Guild {guild_id} not found in database!")
+        return row[0]
 
-    async def get_guild_info(self, guild_id: int) -> Tuple[str, str, int]:
+    async def get_guild_info(self, guild_id: int) -> Tuple[str, Optional[int], int]:
         """
         :param guild_id:
-        :return: tuple(str prefix, str role_id, int expiration hours)
+        :return: tuple(str prefix, int role_id or None if not set, int expiration hours)
         """
         query = "SELECT * FROM GUILDS WHERE GUILD_ID=?"
-        async with self.connection.execute(query, (guild_id,)) as cursor:
-            row = await cursor.fetchone()
-            # ('guild_id', 'prefix', 0, None, 'role_id', hours)
-            return row[1], row[4], row[5]
+        row = await self._fetch_one(query, guild_id)
+        # (guild_id, 'prefix', 0, None, role_id, hours)
+        return row[1], row[4], row[5]
 
     # TABLE LICENSED_MEMBERS #############################################################
 
     async def add_new_licensed_member(self, member_id: int, guild_id: int,
                                       expiration_date: datetime, licensed_role_id: int):
+        """
+        :param expiration_date: timezone aware datetime, saved in the database as unix timestamp
+        """
+        expiration_timestamp = licence_helper.datetime_to_timestamp(expiration_date)
         query = "INSERT INTO LICENSED_MEMBERS(MEMBER_ID, GUILD_ID, EXPIRATION_DATE, LICENSED_ROLE_ID) VALUES(?,?,?,?)"
-        await self.update_database(query, member_id, guild_id, expiration_date, licensed_role_id)
+        await self.update_database(query, member_id, guild_id, expiration_timestamp, licensed_role_id)
+        self._schedule_expiration(member_id, guild_id, expiration_timestamp, licensed_role_id)
+        self.licensed_members_counter.add(guild_id)
 
-    async def delete_licensed_member(self, member_id: int, licensed_role_id: int):
+    async def delete_licensed_member(self, member_id: int, licensed_role_id: int, guild_id: int):
         """
         Called when member licensed role has expired
         The member row is deleted from table LICENSED_MEMBERS.
-        MEMBER_ID and LICENSED_ROLE_ID are unique so we only need that to differentiate
+        MEMBER_ID and LICENSED_ROLE_ID are unique so we only need that to differentiate,
+        guild_id is needed to keep the row counters up to date.
 
         """
         delete_query = "DELETE FROM LICENSED_MEMBERS WHERE MEMBER_ID=? AND LICENSED_ROLE_ID=?"
-        await self.update_database(delete_query, member_id, licensed_role_id)
+        cursor = await self.update_database(delete_query, member_id, licensed_role_id)
+        self.expiration_scheduler.unschedule(member_id, licensed_role_id)
+        self.licensed_members_counter.add(guild_id, -cursor.rowcount)
+
+    async def delete_licensed_members(self, members: List[Tuple[int, int, int]]):
+        """
+        Same as delete_licensed_member but for multiple members at once, all are deleted in one transaction.
+        :param members: list of tuples in format (member_id, licensed_role_id, guild_id)
+        """
+        if not members:
+            return
+
+        # Grouped by guild so we know how many rows were deleted from each guild
+        guild_members = defaultdict(list)
+        for member_id, licensed_role_id, guild_id in members:
+            guild_members[guild_id].append((member_id, licensed_role_id))
+
+        delete_query = "DELETE FROM LICENSED_MEMBERS WHERE MEMBER_ID=? AND LICENSED_ROLE_ID=?"
+        deleted_counts = {}
+        async with self.transaction() as connection:
+            for guild_id, params in guild_members.items():
+                cursor = await connection.executemany(delete_query, params)
+                deleted_counts[guild_id] = cursor.rowcount
 
-    async def get_member_license_expiration_date(self, member_id: int, licensed_role_id: int) -> str:
+        for member_id, licensed_role_id, _guild_id in members:
+            self.expiration_scheduler.unschedule(member_id, licensed_role_id)
+        for guild_id, deleted_count in deleted_counts.items():
+            self.licensed_members_counter.add(guild_id, -deleted_count)
+
+    async def get_all_licensed_members(self) -> List[Tuple[int, int, int, int]]:
+        """
+        Used to load the expiration scheduler at startup, only guilds on our shards are loaded.
+        :return: list of tuples in format (member_id, guild_id, int expiration timestamp, licensed_role_id)
+        """
+        shard_condition, shard_args = self.shard_partition.get_sql_condition()
+        query = f"SELECT MEMBER_ID, GUILD_ID, EXPIRATION_DATE, LICENSED_ROLE_ID FROM LICENSED_MEMBERS WHERE {shard_condition}"
+        return await self._fetch_all(query, *shard_args)
+
+    async def get_expired_licenses(self, now: int, limit: int,
+                                   after: Optional[Tuple[int, int]] = None) -> List[Tuple[int, int, int, int, int]]:
+        """
+        Returns licensed members whose license has expired, ordered by expiration date.
+        Range query on the EXPIRATION_DATE index so only rows that are due are read.
+        Only licenses of guilds on our shards are returned.
+
+        Results are paged by expiration date and rowid instead of offset since rows
+        get deleted between pages as they are processed.
+        :param now: int unix timestamp, licenses with expiration date <= now are returned
+        :param limit: int maximum number of rows to return
+        :param after: tuple(int expiration timestamp, int rowid) of the last row from the previous page,
+                      None to get the first page.
+        :return: list of tuples (rowid, member_id, guild_id, expiration timestamp, licensed_role_id)
+        """
+        last_expiration, last_rowid = after if after is not None else (-1, -1)
+        shard_condition, shard_args = self.shard_partition.get_sql_condition()
+        query = f"""SELECT ROWID, MEMBER_ID, GUILD_ID, EXPIRATION_DATE, LICENSED_ROLE_ID FROM LICENSED_MEMBERS
+                    WHERE EXPIRATION_DATE <= ? AND (EXPIRATION_DATE > ? OR (EXPIRATION_DATE = ? AND ROWID > ?))
+                    AND {shard_condition}
+                    ORDER BY EXPIRATION_DATE, ROWID LIMIT ?"""
+        return await self._fetch_all(query, now, last_expiration, last_expiration, last_rowid, *shard_args, limit)
+
+    async def get_member_license_expiration_date(self, member_id: int, licensed_role_id: int) -> int:
+        """
+        :return: int expiration unix timestamp
+        """
         query = "SELECT EXPIRATION_DATE FROM LICENSED_MEMBERS WHERE MEMBER_ID=? AND LICENSED_ROLE_ID=?"
-        async with self.connection.execute(query, (member_id, licensed_role_id)) as cursor:
-            row = await cursor.fetchone()
-            if row is not None:
-                return row[0]
-            else:
-                raise DatabaseMissingData(f"ID {member_id} doesn't exists in database table LICENSED_MEMBERS.")
+        row = await self._fetch_one(query, member_id, licensed_role_id)
+        if row is not None:
+            return row[0]
+        else:
+            raise DatabaseMissingData(f"ID {member_id} doesn't exists in database table LICENSED_MEMBERS.")
 
     async def get_member_data(self, guild_id: int, member_id: int) -> List[Tuple]:
         """
         Return type:
-        [(), ()...]
-        Note that returned LICENSED_ROLE_ID is string
+        [(int licensed_role_id, int expiration timestamp), ()...]
         """
         query = "SELECT LICENSED_ROLE_ID, EXPIRATION_DATE FROM LICENSED_MEMBERS WHERE GUILD_ID=? AND MEMBER_ID=?"
-        async with self.connection.execute(query, (guild_id, member_id)) as cursor:
-            results = await cursor.fetchall()
-            if results is not None:
-                return results
-            else:
-                raise DatabaseMissingData(f"No active licenses for member {member_id} in guild {guild_id}.")
+        results = await self._fetch_all(query, guild_id, member_id)
+        if results is not None:
+            return results
+        else:
+            raise DatabaseMissingData(f"No active licenses for member {member_id} in guild {guild_id}.")
 
     async def get_guild_licensed_roles_total_count(self, guild_id: int) -> int:
-        query = "SELECT COUNT(*) FROM LICENSED_MEMBERS WHERE GUILD_ID=?"
-        async with self.connection.execute(query, (guild_id,)) as cursor:
-            result = await cursor.fetchone()
-            return result[0]
+        return self.licensed_members_counter.get(guild_id)
 
     async def get_licensed_roles_total_count(self) -> int:
-        query = "SELECT COUNT(*) FROM LICENSED_MEMBERS"
-        async with self.connection.execute(query) as cursor:
-            result = await cursor.fetchone()
-            return result[0]
+        return self.licensed_members_counter.total
 
     # TABLE GUILD_LICENSES ###############################################################
 
-    async def get_license_data(self, license: str) -> Union[Tuple[int, int], None]:
+    async def get_license_data(self, license: str, redeem_guild_id: Optional[int] = None) -> Union[Tuple[int, int], None]:
         """
         Returns licensed role id that the param license is linked to
         :param license: license the role is linked to
+        :param redeem_guild_id: guild where the license is used, None if it's used in DMs
         :return: tuple(int guild id, int license role id)
 
         """
+        license_key = self._license_key(license)
+        if self._is_rejected_by_license_filter(license_key, redeem_guild_id):
+            return None
         query = "SELECT GUILD_ID, LICENSED_ROLE_ID FROM GUILD_LICENSES WHERE LICENSE=?"
-        async with self.connection.execute(query, (license,)) as cursor:
-            row = await cursor.fetchone()
-            # TODO: Temporal quick fix. Refactor
-            if row is None:
-                return None
-            else:
-                return int(row[0]), int(row[1])
-
-    async def get_license_duration_hours(self, license):
-        """
-        :param license: It's unique so no need to pass any additional argument
-        :return: int representing license duration in hours
-        """
-        query = "SELECT LICENSE_DURATION_HOURS FROM GUILD_LICENSES WHERE LICENSE=?"
-        async with self.connection.execute(query, (license,)) as cursor:
-            row = await cursor.fetchone()
-            return int(row[0])
+        row = await self._fetch_one(query, license_key)
+        # TODO: Temporal quick fix. Refactor
+        if row is None:
+            return None
+        else:
+            return row[0], row[1]
 
     async def generate_guild_licenses(self, number: int, guild_id: int,
                                       license_role_id: int, license_duration: int) -> list:
@@ -273,27 +602,110 @@ class DatabaseHandler:
         :param license_duration: int representing license duration in hours
         :return: list of all generated licenses
 
+        All licenses are inserted with one statement. Licenses that already exist in the database are ignored
+        and new ones are generated in their place until the requested number is inserted.
         """
-        licenses = licence_helper.generate_multiple(number)
-        query = """INSERT INTO GUILD_LICENSES(LICENSE, GUILD_ID, LICENSED_ROLE_ID, LICENSE_DURATION_HOURS)
-                   VALUES(?,?,?,?)"""
-        for license in licenses:
-            await self.connection.execute(query, (license, guild_id, license_role_id, license_duration))
-        await self.connection.commit()
+        insert_query = """INSERT OR IGNORE INTO GUILD_LICENSES(LICENSE, LICENSE_PREFIX, GUILD_ID,
+                                                               LICENSED_ROLE_ID, LICENSE_DURATION_HOURS)
+                          VALUES(?,?,?,?,?)"""
+        # New rows get rowid larger than the current maximum, used to find which licenses were inserted
+        max_rowid_query = "SELECT IFNULL(MAX(rowid), 0) FROM GUILD_LICENSES"
+        inserted_query = "SELECT LICENSE FROM GUILD_LICENSES WHERE rowid > ?"
+        licenses = []
+        async with self.transaction() as connection:
+            while len(licenses) < number:
+                candidates = licence_helper.generate_multiple(number - len(licenses))
+                # stored key (license or it's hash) -> license
+                candidate_keys = {self._license_key(license): license for license in candidates}
+                async with connection.execute(max_rowid_query) as cursor:
+                    max_rowid = (await cursor.fetchone())[0]
+                cursor = await connection.executemany(
+                    insert_query,
+                    [(key, self._license_prefix(license), guild_id, license_role_id, license_duration)
+                     for key, license in candidate_keys.items()]
+                )
+                # Added before commit so they can't be rejected once they are visible, if the transaction
+                # fails they are only false positives.
+                self._add_to_license_filter(candidate_keys)
+                if cursor.rowcount == len(candidates):
+                    licenses.extend(candidates)
+                    continue
+
+                logger.warning(f"{len(candidates) - cursor.rowcount} generated licenses already exist, regenerating.")
+                async with connection.execute(inserted_query, (max_rowid,)) as cursor:
+                    licenses.extend(candidate_keys[row[0]] for row in await cursor.fetchall())
+        self.stored_licenses_counter.add(guild_id, len(licenses))
         return licenses
 
-    async def delete_license(self, license: str):
+    async def iterate_guild_licenses(self, guild_id: int, license_role_id: Optional[int] = None,
+                                     batch_size: int = 1000) -> AsyncIterator[List[Tuple[str, int, int]]]:
+        """
+        Yields stored guild licenses in batches, used for exporting them.
+        Licenses stored as hashes are returned as their display prefix.
+        Rows are read incrementally from a single cursor so all licenses are never loaded in memory at once,
+        since it's a single read it sees a consistent snapshot even if licenses are changed in the meantime.
+        :param guild_id: guild whose licenses to return
+        :param license_role_id: if passed only licenses linked to this role are returned
+        :param batch_size: max number of licenses in each batch
+        :return: async iterator of lists of tuples in format (license, licensed_role_id, license_duration_hours)
+        """
+        query = f"""SELECT {DatabaseHandler.LICENSE_DISPLAY_COLUMN}, LICENSED_ROLE_ID, LICENSE_DURATION_HOURS
+                    FROM GUILD_LICENSES WHERE GUILD_ID=?"""
+        args = (guild_id,)
+        if license_role_id is not None:
+            query += " AND LICENSED_ROLE_ID=?"
+            args += (license_role_id,)
+
+        connection = self._get_least_busy_reader()
+        self._queue_depth[connection] += 1
+        try:
+            async with connection.execute(query, args) as cursor:
+                while True:
+                    rows = await cursor.fetchmany(batch_size)
+                    if not rows:
+                        break
+                    yield rows
+        finally:
+            self._queue_depth[connection] -= 1
+
+    async def import_guild_licenses(self, guild_id: int, licenses: List[Tuple[str, int, int]],
+                                    batch_size: int = 1000) -> int:
+        """
+        Stores pre-generated licenses (for example from external storefront).
+        Each batch is inserted in it's own transaction so other writes don't wait for the whole import.
+        Licenses that already exist in the database are skipped.
+        :param guild_id: guild the licenses will belong to
+        :param licenses: list of tuples in format (license, licensed_role_id, license_duration_hours)
+        :param batch_size: number of licenses inserted in one transaction
+        :return: number of licenses that were stored
+        """
+        query = """INSERT OR IGNORE INTO GUILD_LICENSES(LICENSE, LICENSE_PREFIX, GUILD_ID,
+                                                        LICENSED_ROLE_ID, LICENSE_DURATION_HOURS)
+                   VALUES(?,?,?,?,?)"""
+        imported = 0
+        for i in range(0, len(licenses), batch_size):
+            rows = [(self._license_key(license), self._license_prefix(license), guild_id, role_id, duration)
+                    for license, role_id, duration in licenses[i:i + batch_size]]
+            async with self.transaction() as connection:
+                cursor = await connection.executemany(query, rows)
+                self._add_to_license_filter(row[0] for row in rows)
+                inserted = cursor.rowcount
+            imported += inserted
+            self.stored_licenses_counter.add(guild_id, inserted)
+        return imported
+
+    async def delete_license(self, license: str, guild_id: int):
         """
         Called for example when member has redeemed license.
         The license is deleted from table GUILD_LICENSES.
-        Guild ID is not needed since licenses are unique.
-        But if deleting from withing the guild better to call is_valid_license beforehand
-        to prevent deletion of other guild licenses in other guilds.
+        Only deleted if it belongs to param guild_id so licenses of other guilds can't be deleted.
         :param license: license to delete
+        :param guild_id: guild the license belongs to
 
         """
-        delete_query = "DELETE FROM GUILD_LICENSES WHERE LICENSE=?"
-        await self.update_database(delete_query, license)
+        delete_query = "DELETE FROM GUILD_LICENSES WHERE LICENSE=? AND GUILD_ID=?"
+        cursor = await self.update_database(delete_query, self._license_key(license), guild_id)
+        self.stored_licenses_counter.add(guild_id, -cursor.rowcount)
 
     async def get_guild_licenses(self, number: int, guild_id: int, license_role_id: int) -> list:
         """
@@ -304,24 +716,18 @@ class DatabaseHandler:
                          another guild (where linked roles don't exist).
         :param license_role_id: we get only those licenses that are linked to this role id
         :return: List of tuples in format [('license', license_duration_int_hours)]
+                 Licenses stored as hashes are returned as their display prefix.
 
         """
-        query = """SELECT LICENSE, LICENSE_DURATION_HOURS FROM GUILD_LICENSES
-                   WHERE GUILD_ID=? AND LICENSED_ROLE_ID=? LIMIT ?"""
-        async with self.connection.execute(query, (guild_id, license_role_id, number)) as cursor:
-            return await cursor.fetchall()
+        query = f"""SELECT {DatabaseHandler.LICENSE_DISPLAY_COLUMN}, LICENSE_DURATION_HOURS FROM GUILD_LICENSES
+                    WHERE GUILD_ID=? AND LICENSED_ROLE_ID=? LIMIT ?"""
+        return await self._fetch_all(query, guild_id, license_role_id, number)
 
     async def get_guild_license_total_count(self, guild_id: int) -> int:
-        query = "SELECT COUNT(*) FROM GUILD_LICENSES WHERE GUILD_ID=?"
-        async with self.connection.execute(query, (guild_id,)) as cursor:
-            result = await cursor.fetchone()
-            return result[0]
+        return self.stored_licenses_counter.get(guild_id)
 
     async def get_stored_license_total_count(self) -> int:
-        query = "SELECT COUNT(*) FROM GUILD_LICENSES"
-        async with self.connection.execute(query) as cursor:
-            result = await cursor.fetchone()
-            return result[0]
+        return self.stored_licenses_counter.total
 
     async def is_valid_license(self, license: str, guild_id: int) -> bool:
         """
@@ -332,22 +738,43 @@ class DatabaseHandler:
         :return: True if license is valid, False otherwise
 
         """
-        query = "SELECT LICENSE FROM GUILD_LICENSES WHERE LICENSE=? AND GUILD_ID=?"
-        async with self.connection.execute(query, (license, guild_id)) as cursor:
-            row = await cursor.fetchone()
-            if row is not None:
-                return True
-        return False
+        license_key = self._license_key(license)
+        if self._is_rejected_by_license_filter(license_key, guild_id):
+            return False
+        query = "SELECT 1 FROM GUILD_LICENSES WHERE LICENSE=? AND GUILD_ID=?"
+        row = await self._fetch_one(query, license_key, guild_id)
+        return row is not None
+
+    async def get_licenses_data(self, licenses: List[str], guild_id: int) -> Dict[str, Tuple[int, int]]:
+        """
+        Same as get_license_data but for multiple licenses at once, done in a single query per
+        MAX_QUERY_PARAMETERS licenses. Licenses that don't exist or don't belong to guild_id are left out.
+        :param licenses: licenses to look up
+        :param guild_id: guild the licenses have to belong to
+        :return: dict in format {license: (int licensed role id, int license duration hours)}
+        """
+        # stored key (license or it's hash) -> license
+        license_keys = {self._license_key(license): license for license in licenses}
+        keys = [key for key in license_keys if not self._is_rejected_by_license_filter(key, guild_id)]
+        licenses_data = {}
+        for i in range(0, len(keys), DatabaseHandler.MAX_QUERY_PARAMETERS):
+            chunk = keys[i:i + DatabaseHandler.MAX_QUERY_PARAMETERS]
+            placeholders = ",".join("?" * len(chunk))
+            query = f"""SELECT LICENSE, LICENSED_ROLE_ID, LICENSE_DURATION_HOURS FROM GUILD_LICENSES
+                        WHERE GUILD_ID=? AND LICENSE IN ({placeholders})"""
+            for key, licensed_role_id, license_duration in await self._fetch_all(query, guild_id, *chunk):
+                licenses_data[license_keys[key]] = (licensed_role_id, license_duration)
+        return licenses_data
 
     async def get_random_licenses(self, guild_id: int, amount: int):
-        query = """SELECT LICENSE, LICENSED_ROLE_ID, LICENSE_DURATION_HOURS FROM GUILD_LICENSES
-                   WHERE GUILD_ID=? ORDER BY RANDOM() LIMIT ?"""
-        async with self.connection.execute(query, (guild_id, amount)) as cursor:
-            return await cursor.fetchall()
+        query = f"""SELECT {DatabaseHandler.LICENSE_DISPLAY_COLUMN}, LICENSED_ROLE_ID, LICENSE_DURATION_HOURS
+                    FROM GUILD_LICENSES WHERE GUILD_ID=? ORDER BY RANDOM() LIMIT ?"""
+        return await self._fetch_all(query, guild_id, amount)
 
     async def remove_all_stored_guild_licenses(self, guild_id: int):
         query = "DELETE FROM GUILD_LICENSES WHERE GUILD_ID=?"
         await self.update_database(query, guild_id)
+        self.stored_licenses_counter.set(guild_id, 0)
 
     # ALL TABLES #########################################################################
 
@@ -356,15 +783,314 @@ class DatabaseHandler:
                    "DELETE FROM GUILD_LICENSES WHERE GUILD_ID=?"]
         if guild_table_too:
             queries.append("DELETE FROM GUILDS WHERE GUILD_ID=?")
-        for query in queries:
-            await self.connection.execute(query, (guild_id,))
+        async with self.transaction() as connection:
+            for query in queries:
+                await connection.execute(query, (guild_id,))
+
+        self.expiration_scheduler.unschedule_guild(guild_id)
+        self.licensed_members_counter.set(guild_id, 0)
+        self.stored_licenses_counter.set(guild_id, 0)
+        if guild_table_too:
+            self._prefix_cache.pop(guild_id, None)
+
+    async def remove_all_guild_role_data(self, role_id: int, guild_id: int):
+        """
+        Removes licensed members and licenses of the role and unsets it as default guild role if it was set.
+        :param role_id: role to remove all data of
+        :param guild_id: guild the role is from, needed to keep the row counters up to date
+        """
+        await self.remove_all_guild_roles_data([(guild_id, role_id)])
+
+    async def remove_all_guild_roles_data(self, guild_roles: List[Tuple[int, int]]) -> Tuple[int, int, int]:
+        """
+        Same as remove_all_guild_role_data but for multiple roles at once, all are removed in one transaction.
+        :param guild_roles: list of tuples in format (guild_id, role_id)
+        :return: tuple(int deleted licensed members, int deleted licenses, int guilds whose default role was unset)
+        """
+        role_ids_per_guild = defaultdict(list)
+        for guild_id, role_id in guild_roles:
+            role_ids_per_guild[guild_id].append(role_id)
+
+        delete_members_query = "DELETE FROM LICENSED_MEMBERS WHERE LICENSED_ROLE_ID=?"
+        delete_licenses_query = "DELETE FROM GUILD_LICENSES WHERE LICENSED_ROLE_ID=?"
+        unset_default_role_query = "UPDATE GUILDS SET DEFAULT_LICENSE_ROLE_ID=NULL WHERE DEFAULT_LICENSE_ROLE_ID=?"
+        deleted_counts = {}
+        unset_default_roles = 0
+        async with self.transaction() as connection:
+            # Grouped by guild so we know how many rows were deleted from each guild
+            for guild_id, role_ids in role_ids_per_guild.items():
+                params = [(role_id,) for role_id in role_ids]
+                cursor = await connection.executemany(delete_members_query, params)
+                deleted_members = cursor.rowcount
+                cursor = await connection.executemany(delete_licenses_query, params)
+                deleted_counts[guild_id] = (deleted_members, cursor.rowcount)
+                cursor = await connection.executemany(unset_default_role_query, params)
+                unset_default_roles += cursor.rowcount
+
+        self.expiration_scheduler.unschedule_roles({role_id for _guild_id, role_id in guild_roles})
+        for guild_id, (deleted_members, deleted_licenses) in deleted_counts.items():
+            self.licensed_members_counter.add(guild_id, -deleted_members)
+            self.stored_licenses_counter.add(guild_id, -deleted_licenses)
+        return (sum(counts[0] for counts in deleted_counts.values()),
+                sum(counts[1] for counts in deleted_counts.values()),
+                unset_default_roles)
+
+    async def get_guilds_role_ids(self, guild_ids: List[int]) -> List[Tuple[int, int]]:
+        """
+        Returns all roles that guilds have saved in the database, either as default guild role,
+        as role linked to stored licenses or as role of licensed members.
+        :param guild_ids: guilds to get roles of
+        :return: list of unique tuples in format (guild_id, role_id)
+        """
+        guild_roles = set()
+        for i in range(0, len(guild_ids), DatabaseHandler.MAX_QUERY_PARAMETERS):
+            chunk = guild_ids[i:i + DatabaseHandler.MAX_QUERY_PARAMETERS]
+            placeholders = ",".join("?" * len(chunk))
+            queries = (
+                f"""SELECT GUILD_ID, DEFAULT_LICENSE_ROLE_ID FROM GUILDS
+                    WHERE GUILD_ID IN ({placeholders}) AND DEFAULT_LICENSE_ROLE_ID IS NOT NULL""",
+                f"SELECT DISTINCT GUILD_ID, LICENSED_ROLE_ID FROM GUILD_LICENSES WHERE GUILD_ID IN ({placeholders})",
+                f"SELECT DISTINCT GUILD_ID, LICENSED_ROLE_ID FROM LICENSED_MEMBERS WHERE GUILD_ID IN ({placeholders})"
+            )
+            for query in queries:
+                guild_roles.update((guild_id, role_id) for guild_id, role_id in await self._fetch_all(query, *chunk))
+        return list(guild_roles)
+
+    async def redeem_licenses(self, guild_id: int, redemptions: List[Tuple[str, int, int, datetime]]) -> List[str]:
+        """
+        Redeems multiple licenses at once, all database changes are done in one transaction.
+        For each redemption the license is deleted from table GUILD_LICENSES and the member is added
+        to table LICENSED_MEMBERS, replacing the existing entry for that role if there is one.
+        Licenses that are no longer in the database (for example redeemed in the meantime) are skipped.
+        :param guild_id: guild all of the licenses belong to
+        :param redemptions: list of tuples in format (license, member_id, licensed_role_id, expiration_date)
+                            where expiration_date is timezone aware datetime
+        :return: list of licenses that were redeemed
+        """
+        delete_license_query = "DELETE FROM GUILD_LICENSES WHERE LICENSE=? AND GUILD_ID=?"
+        redeemed = []
+        replaced_members = 0
+        async with self.transaction() as connection:
+            for license, member_id, licensed_role_id, expiration_date in redemptions:
+                cursor = await connection.execute(delete_license_query, (self._license_key(license), guild_id))
+                if not cursor.rowcount:
+                    continue
+                expiration_timestamp = licence_helper.datetime_to_timestamp(expiration_date)
+                replaced_members += await self._replace_licensed_member(connection, member_id, guild_id,
+                                                                        expiration_timestamp, licensed_role_id)
+                redeemed.append((license, member_id, licensed_role_id, expiration_timestamp))
+
+        for _license, member_id, licensed_role_id, expiration_timestamp in redeemed:
+            self._schedule_expiration(member_id, guild_id, expiration_timestamp, licensed_role_id)
+        self.licensed_members_counter.add(guild_id, len(redeemed) - replaced_members)
+        self.stored_licenses_counter.add(guild_id, -len(redeemed))
+        return [license for license, *_ in redeemed]
+
+    async def claim_license(self, license: str, guild_id: int, member_id: int) -> Optional[Tuple[int, int, bool]]:
+        """
+        Redeems license for member in one transaction: license is deleted from table GUILD_LICENSES and
+        member is added to table LICENSED_MEMBERS, replacing the existing entry for that role if there is one.
+        Since the license is read and deleted in the same transaction the same license can't be
+        claimed twice even if it's redeemed by multiple members at the same time.
+        :param license: license to claim
+        :param guild_id: guild the license has to belong to
+        :param member_id: member to add the license to
+        :return: None if license is invalid, otherwise tuple(int licensed role id, int license duration hours,
+                 bool True if existing member entry for that role was replaced)
+        """
+        select_query = "SELECT LICENSED_ROLE_ID, LICENSE_DURATION_HOURS FROM GUILD_LICENSES WHERE LICENSE=? AND GUILD_ID=?"
+        delete_query = "DELETE FROM GUILD_LICENSES WHERE LICENSE=? AND GUILD_ID=?"
+        # Hashed only once, before the write lock is taken
+        license_key = self._license_key(license)
+        if self._is_rejected_by_license_filter(license_key, guild_id):
+            return None
+        async with self.transaction() as connection:
+            async with connection.execute(select_query, (license_key, guild_id)) as cursor:
+                row = await cursor.fetchone()
+            if row is None:
+                return None
+            licensed_role_id, license_duration = row
+            await connection.execute(delete_query, (license_key, guild_id))
+            expiration_date = licence_helper.construct_expiration_date(license_duration)
+            expiration_timestamp = licence_helper.datetime_to_timestamp(expiration_date)
+            replaced = await self._replace_licensed_member(connection, member_id, guild_id,
+                                                           expiration_timestamp, licensed_role_id)
+
+        self._schedule_expiration(member_id, guild_id, expiration_timestamp, licensed_role_id)
+        self.licensed_members_counter.add(guild_id, 1 - replaced)
+        self.stored_licenses_counter.add(guild_id, -1)
+        return licensed_role_id, license_duration, bool(replaced)
+
+    async def release_license(self, license: str, guild_id: int, member_id: int,
+                              licensed_role_id: int, license_duration: int):
+        """
+        Reverts claim_license, used when the role couldn't be added to the member after claiming.
+        License is stored back to table GUILD_LICENSES and member is deleted from table LICENSED_MEMBERS,
+        both in one transaction.
+        :param license: license that was claimed
+        :param guild_id: guild the license belongs to
+        :param member_id: member that claimed the license
+        :param licensed_role_id: role linked to the license
+        :param license_duration: int representing license duration in hours
+        """
+        insert_query = """INSERT INTO GUILD_LICENSES(LICENSE, LICENSE_PREFIX, GUILD_ID,
+                                                     LICENSED_ROLE_ID, LICENSE_DURATION_HOURS)
+                          VALUES(?,?,?,?,?)"""
+        delete_query = "DELETE FROM LICENSED_MEMBERS WHERE MEMBER_ID=? AND LICENSED_ROLE_ID=?"
+        async with self.transaction() as connection:
+            license_key = self._license_key(license)
+            await connection.execute(insert_query, (license_key, self._license_prefix(license),
+                                                    guild_id, licensed_role_id, license_duration))
+            self._add_to_license_filter((license_key,))
+            cursor = await connection.execute(delete_query, (member_id, licensed_role_id))
+            deleted_members = cursor.rowcount
 
-        await self.connection.commit()
+        self.expiration_scheduler.unschedule(member_id, licensed_role_id)
+        self.licensed_members_counter.add(guild_id, -deleted_members)
+        self.stored_licenses_counter.add(guild_id, 1)
 
-    async def remove_all_guild_role_data(self, role_id: int):
-        queries = ["DELETE FROM LICENSED_MEMBERS WHERE LICENSED_ROLE_ID=?",
-                   "DELETE FROM GUILD_LICENSES WHERE LICENSED_ROLE_ID=?"]
-        for query in queries:
-            await self.connection.execute(query, (role_id,))
+    def _license_key(self, license: str) -> Union[str, bytes]:
+        """
+        :return: value stored in column LICENSE for param license, keyed hash if licenses are stored hashed
+                 otherwise the license itself
+        """
+        if self.license_hasher is None:
+            return license
+        return self.license_hasher.hash(license)
+
+    def _license_prefix(self, license: str) -> Optional[str]:
+        """:return: value stored in column LICENSE_PREFIX, None if licenses are stored in plaintext"""
+        if self.license_hasher is None:
+            return None
+        return self.license_hasher.display_prefix(license)
+
+    async def rebuild_license_filter(self):
+        """
+        Builds the license filter from scratch from licenses of guilds on our shards.
+        Licenses can't be removed from the filter so this is also how deleted licenses are cleared from it.
+        """
+        shard_condition, shard_args = self.shard_partition.get_sql_condition()
+        count_query = f"SELECT COUNT(*) FROM GUILD_LICENSES WHERE {shard_condition}"
+        licenses_query = f"SELECT LICENSE FROM GUILD_LICENSES WHERE {shard_condition}"
+        self._license_filter_pending = []
+        try:
+            # Transactions add their licenses to the filter before they commit. Those that have added them before
+            # we started collecting pending licenses hold the write lock until they commit, so once we get it
+            # their licenses are committed and will be in what we read.
+            async with self._write_lock:
+                pass
+            license_count = (await self._fetch_one(count_query, *shard_args))[0]
+            license_filter = BloomFilter(
+                max(license_count * DatabaseHandler.LICENSE_FILTER_GROWTH, DatabaseHandler.LICENSE_FILTER_MIN_CAPACITY),
+                DatabaseHandler.LICENSE_FILTER_FALSE_POSITIVE_RATE
+            )
+            for (license_key,) in await self._fetch_all(licenses_query, *shard_args):
+                license_filter.add(license_key)
+            # Licenses added while we were reading, they might not be in what we've read
+            for license_key in self._license_filter_pending:
+                license_filter.add(license_key)
+            self.license_filter = license_filter
+        finally:
+            self._license_filter_pending = None
+
+    async def maybe_rebuild_license_filter(self):
+        """
+        Rebuilds the license filter if it's false positive rate got too high, either because a lot of licenses were
+        added and it's over capacity or because most of the licenses in it were deleted in the meantime.
+        """
+        license_filter = self.license_filter
+        stored_count = self.stored_licenses_counter.total
+        if (len(license_filter) > license_filter.capacity or
+                len(license_filter) > DatabaseHandler.LICENSE_FILTER_GROWTH * stored_count +
+                DatabaseHandler.LICENSE_FILTER_MIN_CAPACITY):
+            await self.rebuild_license_filter()
+            logger.info(f"Rebuilt license filter with {len(self.license_filter)} licenses.")
 
-        await self.connection.commit()
+    def get_license_filter_stats(self) -> Dict[str, Union[int, float]]:
+        return {
+            "licenses": len(self.license_filter),
+            "capacity": self.license_filter.capacity,
+            "memory (bytes)": self.license_filter.memory_size,
+            "estimated false positive rate": self.license_filter.get_current_false_positive_rate(),
+            "checks": self.license_filter_checks,
+            "rejections": self.license_filter_rejections
+        }
+
+    def _add_to_license_filter(self, license_keys: Iterable[Union[str, bytes]]):
+        for license_key in license_keys:
+            self.license_filter.add(license_key)
+            if self._license_filter_pending is not None:
+                self._license_filter_pending.append(license_key)
+
+    def _is_rejected_by_license_filter(self, license_key: Union[str, bytes], guild_id: Optional[int]) -> bool:
+        """
+        :param license_key: stored key of the license to check
+        :param guild_id: guild where the license is used, None if unknown
+        :return: True if license is certainly not stored, False if it might be
+        """
+        # Filter only has licenses of guilds on our shards, other processes generate licenses for other guilds
+        if self.shard_partition.is_partitioned and (guild_id is None or not self.shard_partition.owns_guild(guild_id)):
+            return False
+        self.license_filter_checks += 1
+        if license_key in self.license_filter:
+            return False
+        self.license_filter_rejections += 1
+        return True
+
+    async def _check_license_storage(self):
+        """
+        If licenses are stored hashed converts all licenses that are still stored in plaintext (from before it
+        was enabled), all at once in one transaction. Otherwise warns about hashed licenses that can't be used.
+        """
+        if self.license_hasher is None:
+            row = await self._fetch_one("SELECT COUNT(*) FROM GUILD_LICENSES WHERE typeof(LICENSE)='blob'")
+            if row[0]:
+                logger.critical(f"{row[0]} licenses are stored hashed but license hash secret is not set, "
+                                f"they can't be redeemed!")
+            return
+
+        select_query = "SELECT LICENSE FROM GUILD_LICENSES WHERE typeof(LICENSE)='text'"
+        update_query = "UPDATE GUILD_LICENSES SET LICENSE=?, LICENSE_PREFIX=? WHERE LICENSE=?"
+        async with self.transaction() as connection:
+            async with connection.execute(select_query) as cursor:
+                licenses = [row[0] for row in await cursor.fetchall()]
+            await connection.executemany(
+                update_query,
+                [(self._license_key(license), self._license_prefix(license), license) for license in licenses]
+            )
+        if licenses:
+            logger.info(f"Converted {len(licenses)} plaintext licenses to hashes.")
+
+    @staticmethod
+    async def _replace_licensed_member(connection: aiosqlite.core.Connection, member_id: int, guild_id: int,
+                                       expiration_timestamp: int, licensed_role_id: int) -> int:
+        """
+        Adds member to table LICENSED_MEMBERS, replacing the existing entry for that role.
+        Has to be called inside transaction.
+        :return: int number of replaced entries, 0 or 1
+        """
+        # Delete + insert instead of INSERT OR REPLACE so we know if there was an existing entry
+        delete_query = "DELETE FROM LICENSED_MEMBERS WHERE MEMBER_ID=? AND LICENSED_ROLE_ID=?"
+        insert_query = """INSERT INTO LICENSED_MEMBERS(MEMBER_ID, GUILD_ID, EXPIRATION_DATE, LICENSED_ROLE_ID)
+                          VALUES(?,?,?,?)"""
+        cursor = await connection.execute(delete_query, (member_id, licensed_role_id))
+        await connection.execute(insert_query, (member_id, guild_id, expiration_timestamp, licensed_role_id))
+        return cursor.rowcount
+
+    def _schedule_expiration(self, member_id: int, guild_id: int, expiration_timestamp: int, licensed_role_id: int):
+        # Guilds on other shards are expired by other processes, if we scheduled them we would
+        # also try to expire them and delete their data since we don't have the guild.
+        if self.shard_partition.owns_guild(guild_id):
+            self.expiration_scheduler.schedule(member_id, guild_id, expiration_timestamp, licensed_role_id)
+
+    async def reconcile_counters(self):
+        """
+        Recounts the table row counters from the actual tables.
+        Counters are updated incrementally on each write so this only fixes eventual drift.
+        Only guilds on our shards are counted, other guilds are written to (and counted by) other processes.
+        """
+        shard_condition, shard_args = self.shard_partition.get_sql_condition()
+        query = f"SELECT GUILD_ID, COUNT(*) FROM LICENSED_MEMBERS WHERE {shard_condition} GROUP BY GUILD_ID"
+        self.licensed_members_counter.reset(await self._fetch_all(query, *shard_args))
+        query = f"SELECT GUILD_ID, COUNT(*) FROM GUILD_LICENSES WHERE {shard_condition} GROUP BY GUILD_ID"
+        self.stored_licenses_counter.reset(await self._fetch_all(query, *shard_args))
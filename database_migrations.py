@@ -0,0 +1,137 @@
+"""
+Versioned database schema migrations.
+
+Schema version of the database file is tracked with PRAGMA user_version.
+Migration at index N of MIGRATIONS upgrades the database from version N to N + 1, so
+migrations must only ever be appended to the list, never reordered or removed.
+
+Each migration is ran in it's own transaction together with the version bump so
+if it fails the database is left at the previous version.
+The transaction takes the write lock before checking the version so multiple processes
+starting at the same time don't run the same migration twice.
+"""
+import logging
+
+import aiosqlite
+
+
+logger = logging.getLogger(__name__)
+
+
+async def _add_lookup_indexes(conn: aiosqlite.core.Connection):
+    """Add indexes for guild, role and expiration date lookups."""
+    # Indexes on (GUILD_ID, X) also cover the queries that only filter by GUILD_ID
+    # and (MEMBER_ID, LICENSED_ROLE_ID) is already covered by the UNIQUE constraint.
+    await conn.execute("CREATE INDEX IF NOT EXISTS IDX_LICENSED_MEMBERS_GUILD_MEMBER "
+                       "ON LICENSED_MEMBERS(GUILD_ID, MEMBER_ID)")
+    await conn.execute("CREATE INDEX IF NOT EXISTS IDX_LICENSED_MEMBERS_ROLE "
+                       "ON LICENSED_MEMBERS(LICENSED_ROLE_ID)")
+    await conn.execute("CREATE INDEX IF NOT EXISTS IDX_LICENSED_MEMBERS_EXPIRATION "
+                       "ON LICENSED_MEMBERS(EXPIRATION_DATE)")
+    await conn.execute("CREATE INDEX IF NOT EXISTS IDX_GUILD_LICENSES_GUILD_ROLE "
+                       "ON GUILD_LICENSES(GUILD_ID, LICENSED_ROLE_ID)")
+    await conn.execute("CREATE INDEX IF NOT EXISTS IDX_GUILD_LICENSES_ROLE "
+                       "ON GUILD_LICENSES(LICENSED_ROLE_ID)")
+
+
+async def _integer_columns(conn: aiosqlite.core.Connection):
+    """Store IDs as INTEGER and expiration dates as INTEGER unix timestamps."""
+    # SQLite can't change column types so tables are rebuilt.
+    await conn.execute("CREATE TABLE GUILDS_NEW "
+                       "("
+                       "GUILD_ID INTEGER PRIMARY KEY, "
+                       "PREFIX TEXT CHECK(PREFIX IS NULL OR LENGTH(PREFIX) <= 5), "
+                       "ENABLE_LOG_CHANNEL TINYINT DEFAULT 0, "
+                       "LOG_CHANNEL_ID INTEGER, "
+                       "DEFAULT_LICENSE_ROLE_ID INTEGER, "
+                       "DEFAULT_LICENSE_DURATION_HOURS UNSIGNED BIG INT DEFAULT 720"
+                       ")"
+                       )
+    await conn.execute("INSERT INTO GUILDS_NEW "
+                       "SELECT CAST(GUILD_ID AS INTEGER), PREFIX, ENABLE_LOG_CHANNEL, CAST(LOG_CHANNEL_ID AS INTEGER), "
+                       "CAST(DEFAULT_LICENSE_ROLE_ID AS INTEGER), DEFAULT_LICENSE_DURATION_HOURS FROM GUILDS")
+
+    await conn.execute("CREATE TABLE LICENSED_MEMBERS_NEW "
+                       "("
+                       "MEMBER_ID INTEGER, "
+                       "GUILD_ID INTEGER, "
+                       "EXPIRATION_DATE INTEGER, "
+                       "LICENSED_ROLE_ID INTEGER, "
+                       "UNIQUE(MEMBER_ID, LICENSED_ROLE_ID)"
+                       ")"
+                       )
+    # Dates were saved as naive datetime strings in the local time of the machine
+    # hosting the bot, 'utc' modifier converts them from local time to UTC.
+    await conn.execute("INSERT INTO LICENSED_MEMBERS_NEW "
+                       "SELECT CAST(MEMBER_ID AS INTEGER), CAST(GUILD_ID AS INTEGER), "
+                       "CAST(strftime('%s', EXPIRATION_DATE, 'utc') AS INTEGER), "
+                       "CAST(LICENSED_ROLE_ID AS INTEGER) FROM LICENSED_MEMBERS")
+
+    await conn.execute("CREATE TABLE GUILD_LICENSES_NEW "
+                       "("
+                       "LICENSE TEXT PRIMARY KEY, "
+                       "GUILD_ID INTEGER, "
+                       "LICENSED_ROLE_ID INTEGER, "
+                       "LICENSE_DURATION_HOURS UNSIGNED BIG INT"
+                       ")"
+                       )
+    await conn.execute("INSERT INTO GUILD_LICENSES_NEW "
+                       "SELECT LICENSE, CAST(GUILD_ID AS INTEGER), CAST(LICENSED_ROLE_ID AS INTEGER), "
+                       "LICENSE_DURATION_HOURS FROM GUILD_LICENSES")
+
+    for table in ("GUILDS", "LICENSED_MEMBERS", "GUILD_LICENSES"):
+        await conn.execute(f"DROP TABLE {table}")
+        await conn.execute(f"ALTER TABLE {table}_NEW RENAME TO {table}")
+
+    # Indexes were dropped together with the old tables
+    await _add_lookup_indexes(conn)
+
+
+async def _license_prefix(conn: aiosqlite.core.Connection):
+    """Add license prefix column, used for displaying licenses that are stored as hashes."""
+    # Stays NULL for licenses stored in plaintext
+    await conn.execute("ALTER TABLE GUILD_LICENSES ADD COLUMN LICENSE_PREFIX TEXT")
+
+
+MIGRATIONS = [
+    _add_lookup_indexes,
+    _integer_columns,
+    _license_prefix,
+]
+
+
+async def get_schema_version(conn: aiosqlite.core.Connection) -> int:
+    async with conn.execute("PRAGMA user_version") as cursor:
+        row = await cursor.fetchone()
+        return row[0]
+
+
+async def migrate(conn: aiosqlite.core.Connection):
+    """
+    Upgrades database schema to the latest version by running all migrations that were not yet applied.
+    :param conn: connection to the database to upgrade
+    :raise: any exception from failed migration, database is rolled back to the last successful version
+    """
+    version = await get_schema_version(conn)
+    if version > len(MIGRATIONS):
+        logger.warning(f"Database schema version {version} is newer than the latest known version {len(MIGRATIONS)}!")
+        return
+
+    for new_version, migration in enumerate(MIGRATIONS[version:], start=version + 1):
+        await conn.execute("BEGIN IMMEDIATE")
+        if await get_schema_version(conn) >= new_version:
+            # Another process has migrated it while we were waiting for the lock
+            await conn.rollback()
+            continue
+
+        logger.info(f"Migrating database to version {new_version}: {migration.__doc__}")
+        try:
+            await migration(conn)
+            # PRAGMA doesn't support parameters
+            await conn.execute(f"PRAGMA user_version={new_version}")
+            await conn.commit()
+        except Exception:
+            await conn.rollback()
+            logger.critical(f"Database migration to version {new_version} failed!")
+            raise
+        logger.info(f"Database migrated to version {new_version}.")
@@ -3,8 +3,11 @@ Script to backup your guild data if you need to keep it safe or to migrate.
 If you need different functionality you're free to download it and modify it however you want.
 Example usage:
 Backup(JSONBackup()).backup(123456789)
-above will get you naive dates (without timezone). If you know timezone of server the bot is in you can use:
+above will get you expiration dates as unix timestamps (same as they are saved). If you want readable dates use:
 Backup(JSONBackup()).backup(123456789, server_timezone=timezone(timedelta(hours=-8)))
+
+If the bot is ran with license_hash_secret then licenses are stored as hashes (bytes), JSON backup
+has them as hex strings (bytes.fromhex to get them back) while sqlite backup keeps them as they are.
 """
 import json
 import sqlite3
@@ -30,7 +33,14 @@ class BackupAdapter(ABC):
 
 class JSONBackup(BackupAdapter):
     def format(self, data: dict) -> Any:
-        return json.dumps(data, indent=2)
+        return json.dumps(data, indent=2, default=self._encode_bytes)
+
+    @classmethod
+    def _encode_bytes(cls, value: Any) -> str:
+        # Hashed licenses are the only bytes values
+        if isinstance(value, bytes):
+            return value.hex()
+        raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
 
     @property
     def file_extension(self) -> str:
@@ -59,21 +69,21 @@ class SqliteBackup(BackupAdapter):
         cur = con.cursor()
         cur.execute("CREATE TABLE GUILDS"
                     "("
-                    "GUILD_ID TEXT PRIMARY KEY, "
+                    "GUILD_ID INTEGER PRIMARY KEY, "
                     "PREFIX TEXT CHECK(PREFIX IS NULL OR LENGTH(PREFIX) <= 5), "
                     "ENABLE_LOG_CHANNEL TINYINT DEFAULT 0, "
-                    "LOG_CHANNEL_ID TEXT, "
-                    "DEFAULT_LICENSE_ROLE_ID TEXT, "
+                    "LOG_CHANNEL_ID INTEGER, "
+                    "DEFAULT_LICENSE_ROLE_ID INTEGER, "
                     "DEFAULT_LICENSE_DURATION_HOURS UNSIGNED BIG INT DEFAULT 720"
                     ")"
                     )
 
         cur.execute("CREATE TABLE LICENSED_MEMBERS"
                     "("
-                    "MEMBER_ID TEXT,"
-                    "GUILD_ID TEXT,"
-                    "EXPIRATION_DATE DATE,"
-                    "LICENSED_ROLE_ID TEXT,"
+                    "MEMBER_ID INTEGER,"
+                    "GUILD_ID INTEGER,"
+                    "EXPIRATION_DATE INTEGER,"
+                    "LICENSED_ROLE_ID INTEGER,"
                     "UNIQUE(MEMBER_ID, LICENSED_ROLE_ID)"
                     ")"
                     )
@@ -81,9 +91,10 @@ class SqliteBackup(BackupAdapter):
         cur.execute("CREATE TABLE GUILD_LICENSES"
                     "("
                     "LICENSE TEXT PRIMARY KEY,"
-                    "GUILD_ID TEXT,"
-                    "LICENSED_ROLE_ID TEXT,"
-                    "LICENSE_DURATION_HOURS UNSIGNED BIG INT"
+                    "GUILD_ID INTEGER,"
+                    "LICENSED_ROLE_ID INTEGER,"
+                    "LICENSE_DURATION_HOURS UNSIGNED BIG INT,"
+                    "LICENSE_PREFIX TEXT"
                     ")"
                     )
 
@@ -120,15 +131,21 @@ class SqliteBackup(BackupAdapter):
             )
 
         for guild_license_sub_dict in data["GUILD_LICENSES"].values():
-            guild_license_data = [*guild_license_sub_dict.values()]
             cur.execute(
                 "INSERT INTO GUILD_LICENSES("
                 "LICENSE,"
                 "GUILD_ID,"
                 "LICENSED_ROLE_ID,"
-                "LICENSE_DURATION_HOURS"
-                ") VALUES(?,?,?,?)",
-                (*guild_license_data,),
+                "LICENSE_DURATION_HOURS,"
+                "LICENSE_PREFIX"
+                ") VALUES(?,?,?,?,?)",
+                (
+                    guild_license_sub_dict["LICENSE"],
+                    guild_license_sub_dict["GUILD_ID"],
+                    guild_license_sub_dict["LICENSED_ROLE_ID"],
+                    guild_license_sub_dict["LICENSE_DURATION_HOURS"],
+                    guild_license_sub_dict["LICENSE_PREFIX"]
+                ),
             )
 
         con.commit()
@@ -146,13 +163,13 @@ class Backup:
         """
         :param guild_id: int ID you want to backup from the database
         :param file_name: str of file name to save backup data to. Defaults to "backup"
-        :param server_timezone: optional timezone. Licensy backend code saves dates as naive datetimes (><) but if you
-        pass this param then extracted datetimes will be converted to this timezone. If not passed extracted dates will
-        be naive.
+        :param server_timezone: optional timezone. Licensy backend code saves dates as unix timestamps but if you
+        pass this param then extracted dates will be converted to datetime strings in this timezone. If not passed
+        extracted dates will be unix timestamps.
         """
         licensed_members = self.get_licensed_members_table(guild_id)
         if server_timezone is not None:
-            self._naive_dates_to_tz(licensed_members, server_timezone)
+            self._timestamps_to_tz(licensed_members, server_timezone)
 
         data = {
             "GUILDS": self.get_guild_table(guild_id),
@@ -166,11 +183,11 @@ class Backup:
         """
         Return format:
         {
-            'GUILD_ID': 'id',
+            'GUILD_ID': id,
             'PREFIX': 'prefix',
             'ENABLE_LOG_CHANNEL': int,
-            'LOG_CHANNEL_ID': Union[None, 'id'],
-            'DEFAULT_LICENSE_ROLE_ID': Union[None, 'id'],
+            'LOG_CHANNEL_ID': Union[None, id],
+            'DEFAULT_LICENSE_ROLE_ID': Union[None, id],
             'DEFAULT_LICENSE_DURATION_HOURS': int
         }
         """
@@ -182,14 +199,13 @@ class Backup:
 
     def get_licensed_members_table(self, guild_id: int,) -> Dict[int, Dict[str, Any]]:
         """
-        Bot was done in a way that timezone is not saved -.-
-        So you'll get datetime but need to know what timezone your server/PC that is hosting the bot is in.
+        Expiration dates are unix timestamps (seconds, UTC).
         {
             0: {
-                "MEMBER_ID": "id",
-                "GUILD_ID": "id",
-                "EXPIRATION_DATE": "NAIVE datetime in format 2021-02-14 08:40:06.459694",
-                "LICENSED_ROLE_ID": "id"
+                "MEMBER_ID": id,
+                "GUILD_ID": id,
+                "EXPIRATION_DATE": int timestamp, example 1613292006,
+                "LICENSED_ROLE_ID": id
             },
             1:{...},
             2:{...},
@@ -210,10 +226,11 @@ class Backup:
         Return data:
         {
             0:{
-                "LICENSE": "string",
-                "GUILD_ID": "id",
-                "LICENSED_ROLE_ID": "id",
-                "LICENSE_DURATION_HOURS": int
+                "LICENSE": "string" or bytes hash,
+                "GUILD_ID": id,
+                "LICENSED_ROLE_ID": id,
+                "LICENSE_DURATION_HOURS": int,
+                "LICENSE_PREFIX": Union[None, "string"]
             },
             1:{...},
             2:{...},
@@ -221,7 +238,8 @@ class Backup:
             N:{...}
         """
         cursor = self._conn.cursor()
-        cursor.execute("SELECT * FROM GUILD_LICENSES WHERE GUILD_ID=?", (guild_id,))
+        cursor.execute("SELECT LICENSE, GUILD_ID, LICENSED_ROLE_ID, LICENSE_DURATION_HOURS, LICENSE_PREFIX "
+                       "FROM GUILD_LICENSES WHERE GUILD_ID=?", (guild_id,))
         col_names = next(zip(*cursor.description))
         return_data = {}
         for i, row in enumerate(cursor.fetchall()):
@@ -229,8 +247,7 @@ class Backup:
         return return_data
 
     @classmethod
-    def _naive_dates_to_tz(cls, licensed_members_data: dict, server_timezone: timezone):
+    def _timestamps_to_tz(cls, licensed_members_data: dict, server_timezone: timezone):
         for sub_dict in licensed_members_data.values():
-            naive_datetime = datetime.strptime(sub_dict["EXPIRATION_DATE"], "%Y-%m-%d %H:%M:%S.%f")
-            proper_datetime = naive_datetime.replace(tzinfo=server_timezone)
+            proper_datetime = datetime.fromtimestamp(sub_dict["EXPIRATION_DATE"], server_timezone)
             sub_dict["EXPIRATION_DATE"] = str(proper_datetime)
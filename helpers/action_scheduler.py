@@ -0,0 +1,216 @@
+import time
+import heapq
+import asyncio
+import logging
+import itertools
+from typing import Callable, Awaitable, Hashable, Dict, Tuple, Optional, Any
+
+from discord import HTTPException
+
+
+logger = logging.getLogger(__name__)
+
+# Action priorities, actions with lower number are executed first.
+PRIORITY_REDEEM = 0
+PRIORITY_EXPIRY = 1
+PRIORITY_NOTIFICATION = 2
+PRIORITY_NAMES = {
+    PRIORITY_REDEEM: "redeem",
+    PRIORITY_EXPIRY: "expiry",
+    PRIORITY_NOTIFICATION: "notification",
+}
+
+# Opening a DM channel is rate limited globally for the bot, not per user.
+DM_ROUTE = ("dm",)
+
+
+def member_roles_route(guild_id: int) -> Tuple[str, int]:
+    """Adding and removing member roles is rate limited per guild."""
+    return "member roles", guild_id
+
+
+def channel_messages_route(channel_id: int) -> Tuple[str, int]:
+    """Sending messages is rate limited per channel."""
+    return "messages", channel_id
+
+
+def discord_retry_after(exception: Exception) -> Optional[float]:
+    """
+    :param exception: exception raised by an action
+    :return: float seconds to wait if exception is a 429 Too Many Requests response, None otherwise
+    """
+    if not isinstance(exception, HTTPException) or exception.status != 429:
+        return None
+    headers = getattr(exception.response, "headers", None) or {}
+    try:
+        return float(headers.get("Retry-After", 1))
+    except ValueError:
+        return 1.0
+
+
+class _RouteBucket:
+    """Token bucket for one route together with the queue of actions waiting for it."""
+    def __init__(self, rate: int, per: float):
+        self.rate = rate
+        self.per = per
+        self.tokens = float(rate)
+        self.updated = time.monotonic()
+        # Set when we get rate limited anyway, nothing is executed on this route until then
+        self.paused_until = 0.0
+        # Heap of tuples (priority, sequence, queued time, action, future, rate limit retries)
+        self.actions = []
+        self.drain_task: Optional[asyncio.Task] = None
+
+    def get_delay(self) -> float:
+        """
+        :return: seconds until the next action on this route can be executed
+        """
+        now = time.monotonic()
+        self.tokens = min(self.rate, self.tokens + (now - self.updated) * self.rate / self.per)
+        self.updated = now
+        delay = max(self.paused_until - now, 0.0)
+        if self.tokens < 1:
+            delay = max(delay, (1 - self.tokens) * self.per / self.rate)
+        return delay
+
+    def is_idle(self) -> bool:
+        return not self.actions and self.get_delay() == 0 and self.tokens >= self.rate
+
+
+class ActionScheduler:
+    """
+    Central scheduler for outbound Discord actions (role edits, DMs, messages).
+
+    Each action is queued on a route (for example member role edits of a single guild) and each
+    route has it's own token bucket so we stay under Discord rate limits instead of relying on
+    hitting them and getting 429 responses. Waiting actions on the same route are executed in order
+    of priority so user facing actions (redeem) don't wait behind mass expirations.
+
+    If an action still gets rate limited (detected by retry_after function) the route is paused for
+    the returned time and the action is put back to the queue. retry_after can be replaced to use
+    the scheduler with something other than discord.py, for example a fake HTTP client.
+    """
+    # Route type: (number of actions, per seconds), can be overridden with "action_route_limits" dict in config
+    DEFAULT_ROUTE_LIMITS = {
+        "member roles": (10, 10),
+        "dm": (5, 5),
+        "messages": (5, 5),
+    }
+    # Limit for route types that are not in the route limits
+    FALLBACK_ROUTE_LIMIT = (5, 5)
+    # How many times an action is retried if it gets rate limited
+    MAX_RATE_LIMIT_RETRIES = 5
+    # Idle buckets are removed when there are more than this many of them
+    MAX_IDLE_BUCKETS = 1000
+
+    def __init__(self, route_limits: Dict[str, Tuple[int, float]] = None, max_concurrency: int = 10,
+                 retry_after: Callable[[Exception], Optional[float]] = discord_retry_after):
+        """
+        :param route_limits: overrides for DEFAULT_ROUTE_LIMITS
+        :param max_concurrency: maximum number of actions executing at the same time across all routes
+        :param retry_after: function that returns seconds to wait if exception is a rate limit, None otherwise
+        """
+        self.route_limits = {**ActionScheduler.DEFAULT_ROUTE_LIMITS, **(route_limits or {})}
+        self._retry_after = retry_after
+        self._concurrency = asyncio.Semaphore(max_concurrency)
+        self._buckets: Dict[Hashable, _RouteBucket] = {}
+        self._sequence = itertools.count()
+        # priority: [number of executed actions, total wait time, max wait time]
+        self._wait_times = {priority: [0, 0.0, 0.0] for priority in PRIORITY_NAMES}
+        self.rate_limited = 0
+
+    async def run(self, route: Tuple, priority: int, action: Callable[[], Awaitable]) -> Any:
+        """
+        Queues action and waits until it's executed.
+        :param route: route the action uses, for example member_roles_route(guild.id)
+        :param priority: one of PRIORITY_ constants
+        :param action: function returning the awaitable to execute, for example lambda: member.add_roles(role)
+        :return: whatever action returns
+        :raise: whatever action raises, rate limits are retried up to MAX_RATE_LIMIT_RETRIES times
+        """
+        bucket = self._get_bucket(route)
+        future = asyncio.get_event_loop().create_future()
+        heapq.heappush(bucket.actions, (priority, next(self._sequence), time.monotonic(), action, future, 0))
+        if bucket.drain_task is None or bucket.drain_task.done():
+            bucket.drain_task = asyncio.ensure_future(self._drain(route, bucket))
+        return await future
+
+    def get_stats(self) -> Dict[str, Dict[str, float]]:
+        """
+        :return: dict {priority name: {"queued": int, "executed": int, "average wait": float s, "max wait": float s}}
+        """
+        queued = {priority: 0 for priority in PRIORITY_NAMES}
+        for bucket in self._buckets.values():
+            for action in bucket.actions:
+                queued[action[0]] = queued.get(action[0], 0) + 1
+
+        stats = {}
+        for priority, name in PRIORITY_NAMES.items():
+            executed, total_wait, max_wait = self._wait_times[priority]
+            stats[name] = {
+                "queued": queued[priority],
+                "executed": executed,
+                "average wait": total_wait / executed if executed else 0.0,
+                "max wait": max_wait
+            }
+        return stats
+
+    def get_active_routes_count(self) -> int:
+        return sum(1 for bucket in self._buckets.values() if bucket.actions)
+
+    def _get_bucket(self, route: Tuple) -> _RouteBucket:
+        bucket = self._buckets.get(route)
+        if bucket is None:
+            if len(self._buckets) > ActionScheduler.MAX_IDLE_BUCKETS:
+                self._remove_idle_buckets()
+            rate, per = self.route_limits.get(route[0], ActionScheduler.FALLBACK_ROUTE_LIMIT)
+            bucket = _RouteBucket(rate, per)
+            self._buckets[route] = bucket
+        return bucket
+
+    def _remove_idle_buckets(self):
+        # Idle bucket is full so removing it doesn't let anything through sooner than it would anyway
+        for route in [route for route, bucket in self._buckets.items() if bucket.is_idle()]:
+            del self._buckets[route]
+
+    async def _drain(self, route: Tuple, bucket: _RouteBucket):
+        """Executes actions queued on a route one by one as the route limit allows."""
+        while bucket.actions:
+            delay = bucket.get_delay()
+            if delay > 0:
+                await asyncio.sleep(delay)
+                # Higher priority action could have been queued in the meantime
+                continue
+
+            priority, sequence, queued_time, action, future, retries = heapq.heappop(bucket.actions)
+            if future.done():
+                # Caller was cancelled while waiting
+                continue
+
+            bucket.tokens -= 1
+            if not retries:
+                self._record_wait_time(priority, time.monotonic() - queued_time)
+
+            async with self._concurrency:
+                try:
+                    result = await action()
+                except Exception as e:
+                    retry_after = self._retry_after(e)
+                    if retry_after is not None and retries < ActionScheduler.MAX_RATE_LIMIT_RETRIES:
+                        self.rate_limited += 1
+                        bucket.paused_until = time.monotonic() + retry_after
+                        logger.warning(f"Rate limited on route {route}, retrying in {retry_after}s.")
+                        # Same sequence so it stays in front of actions with the same priority
+                        heapq.heappush(bucket.actions, (priority, sequence, queued_time, action, future, retries + 1))
+                    elif not future.done():
+                        future.set_exception(e)
+                    continue
+
+            if not future.done():
+                future.set_result(result)
+
+    def _record_wait_time(self, priority: int, wait_time: float):
+        wait_times = self._wait_times.setdefault(priority, [0, 0.0, 0.0])
+        wait_times[0] += 1
+        wait_times[1] += wait_time
+        wait_times[2] = max(wait_times[2], wait_time)
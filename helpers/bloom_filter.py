@@ -0,0 +1,57 @@
+import math
+import hashlib
+from typing import Union
+
+
+class BloomFilter:
+    """
+    Probabilistic set of strings/bytes, uses only a few bits per item.
+
+    If an item is not in the filter it's certainly not in the set (no false negatives), if it is in the filter
+    it's in the set with probability 1 - false positive rate. Used to reject items without looking them up.
+
+    Items can't be removed, removed items stay in the filter as false positives until it's rebuilt.
+    False positive rate is only kept while the number of items is below capacity.
+    """
+    def __init__(self, capacity: int, false_positive_rate: float = 0.001):
+        """
+        :param capacity: expected number of items
+        :param false_positive_rate: wanted false positive rate when the filter is at capacity
+        """
+        self.capacity = max(capacity, 1)
+        self.false_positive_rate = false_positive_rate
+        # Optimal sizes for the wanted false positive rate
+        self.bit_count = math.ceil(-self.capacity * math.log(false_positive_rate) / math.log(2) ** 2)
+        self.hash_count = max(round(self.bit_count / self.capacity * math.log(2)), 1)
+        self._bits = bytearray((self.bit_count + 7) // 8)
+        # Number of added items, duplicates included
+        self.count = 0
+
+    def __len__(self):
+        return self.count
+
+    def __contains__(self, item: Union[str, bytes]) -> bool:
+        return all(self._bits[position >> 3] & (1 << (position & 7)) for position in self._positions(item))
+
+    def add(self, item: Union[str, bytes]):
+        for position in self._positions(item):
+            self._bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    @property
+    def memory_size(self) -> int:
+        """:return: int size of the bit array in bytes"""
+        return len(self._bits)
+
+    def get_current_false_positive_rate(self) -> float:
+        """:return: float estimated false positive rate for the current number of items"""
+        return (1 - math.exp(-self.hash_count * self.count / self.bit_count)) ** self.hash_count
+
+    def _positions(self, item: Union[str, bytes]):
+        if isinstance(item, str):
+            item = item.encode()
+        digest = hashlib.blake2b(item, digest_size=16).digest()
+        # All positions are derived from 2 hashes (Kirsch-Mitzenmacher) instead of computing hash_count hashes
+        first_hash = int.from_bytes(digest[:8], "little")
+        second_hash = int.from_bytes(digest[8:], "little") | 1
+        return ((first_hash + i * second_hash) % self.bit_count for i in range(self.hash_count))
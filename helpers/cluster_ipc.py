@@ -0,0 +1,301 @@
+"""
+Messages between cluster workers, routed by the coordinator process (cluster.py).
+
+Workers connect to the coordinator over a local TCP socket and each message is one line of JSON.
+A worker can send a request either to the worker that owns a guild (routed by the shard of the guild)
+or to all workers at once (gather), the coordinator forwards it and sends the response back.
+
+Request:  {"id": int, "op": str, "guild_id": int or None for gather, "payload": dict}
+Response: {"id": int, "result": any} or {"id": int, "error": str}
+
+Handlers are registered on the ClusterClient by op name, they are called with the payload as keyword
+arguments and have to return something JSON serializable.
+"""
+import hmac
+import json
+import asyncio
+import logging
+import itertools
+from typing import Callable, Awaitable, Dict, List, Any, Optional, Iterable
+
+from helpers.sharding import get_guild_shard_id
+
+
+logger = logging.getLogger(__name__)
+
+# Maximum size of a single message in bytes
+_MESSAGE_LIMIT = 4 * 1024 * 1024
+
+
+class ClusterRequestError(Exception):
+    """Request couldn't be delivered, timed out or the handler of the other worker has raised an exception."""
+
+
+async def _write_message(writer: asyncio.StreamWriter, message: dict):
+    writer.write(json.dumps(message).encode() + b"\n")
+    await writer.drain()
+
+
+async def _read_message(reader: asyncio.StreamReader) -> Optional[dict]:
+    """
+    :return: dict message or None if connection was closed
+    """
+    line = await reader.readline()
+    if not line:
+        return None
+    return json.loads(line)
+
+
+class _Connection:
+    """Connection with requests that were sent over it and are waiting for a response."""
+    def __init__(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self.reader = reader
+        self.writer = writer
+        self._request_ids = itertools.count()
+        # request id: future that gets the response message
+        self._pending: Dict[int, asyncio.Future] = {}
+
+    async def send_request(self, message: dict, timeout: float) -> dict:
+        """
+        Sends request (message without id) and waits for the response.
+        :return: dict response message
+        :raise: ClusterRequestError if the connection is closed or there is no response in timeout seconds
+        """
+        request_id = next(self._request_ids)
+        future = asyncio.get_event_loop().create_future()
+        self._pending[request_id] = future
+        try:
+            await _write_message(self.writer, {**message, "id": request_id})
+            return await asyncio.wait_for(future, timeout)
+        except asyncio.TimeoutError:
+            raise ClusterRequestError(f"No response to '{message['op']}' in {timeout}s.")
+        except ConnectionError as e:
+            raise ClusterRequestError(f"Connection lost: {e}")
+        finally:
+            self._pending.pop(request_id, None)
+
+    def resolve(self, response: dict):
+        future = self._pending.get(response["id"])
+        if future is not None and not future.done():
+            future.set_result(response)
+
+    def close(self):
+        for future in self._pending.values():
+            if not future.done():
+                future.set_exception(ClusterRequestError("Connection lost."))
+        self._pending.clear()
+        self.writer.close()
+
+
+class ClusterCoordinator:
+    """
+    Accepts worker connections and routes requests between workers.
+    Runs in the cluster.py main process.
+    """
+    # Seconds to wait for the worker handling a request
+    REQUEST_TIMEOUT = 30
+
+    def __init__(self, shard_count: int, secret: str):
+        """
+        :param shard_count: total number of shards, used to find the worker owning a guild
+        :param secret: workers have to send it when connecting so other local processes can't connect
+        """
+        self.shard_count = shard_count
+        self._secret = secret
+        # shard id: connection of the worker running it
+        self._workers: Dict[int, _Connection] = {}
+        self._server: Optional[asyncio.AbstractServer] = None
+        self.port: Optional[int] = None
+
+    async def start(self, host: str = "127.0.0.1", port: int = 0):
+        """Starts listening, port 0 picks a free port which is then available as self.port."""
+        self._server = await asyncio.start_server(self._handle_worker, host, port, limit=_MESSAGE_LIMIT)
+        self.port = self._server.sockets[0].getsockname()[1]
+
+    async def close(self):
+        for connection in set(self._workers.values()):
+            connection.close()
+        self._workers.clear()
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+
+    def get_connected_shard_ids(self) -> List[int]:
+        return sorted(self._workers)
+
+    async def _handle_worker(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            hello = await asyncio.wait_for(_read_message(reader), ClusterCoordinator.REQUEST_TIMEOUT)
+        except (asyncio.TimeoutError, ValueError, ConnectionError):
+            hello = None
+        if (not isinstance(hello, dict) or hello.get("op") != "hello" or
+                not hmac.compare_digest(str(hello.get("secret", "")), self._secret)):
+            logger.warning("Rejected cluster connection with invalid hello message.")
+            writer.close()
+            return
+
+        connection = _Connection(reader, writer)
+        shard_ids = hello["shard_ids"]
+        for shard_id in shard_ids:
+            self._workers[shard_id] = connection
+        logger.info(f"Worker with shards {shard_ids} connected to the coordinator.")
+        try:
+            await _write_message(writer, {"op": "welcome"})
+            while True:
+                message = await _read_message(reader)
+                if message is None:
+                    break
+                if "op" in message:
+                    asyncio.ensure_future(self._route(connection, message))
+                else:
+                    connection.resolve(message)
+        except (ConnectionError, ValueError) as e:
+            logger.warning(f"Worker with shards {shard_ids} connection error: {e}")
+        finally:
+            for shard_id in shard_ids:
+                if self._workers.get(shard_id) is connection:
+                    del self._workers[shard_id]
+            connection.close()
+            logger.info(f"Worker with shards {shard_ids} disconnected from the coordinator.")
+
+    async def _route(self, origin: _Connection, message: dict):
+        request = {"op": message["op"], "payload": message.get("payload", {})}
+        guild_id = message.get("guild_id")
+        if guild_id is None:
+            responses = await asyncio.gather(*(self._forward(connection, request)
+                                               for connection in set(self._workers.values())))
+            response = {
+                "result": [response["result"] for response in responses if "error" not in response],
+                "errors": [response["error"] for response in responses if "error" in response]
+            }
+        else:
+            shard_id = get_guild_shard_id(guild_id, self.shard_count)
+            connection = self._workers.get(shard_id)
+            if connection is None:
+                response = {"error": f"Worker running shard {shard_id} is not connected."}
+            else:
+                response = await self._forward(connection, request)
+
+        try:
+            await _write_message(origin.writer, {**response, "id": message["id"]})
+        except ConnectionError:
+            # Worker that sent the request has disconnected in the meantime
+            pass
+
+    @classmethod
+    async def _forward(cls, connection: _Connection, request: dict) -> dict:
+        try:
+            response = await connection.send_request(request, ClusterCoordinator.REQUEST_TIMEOUT)
+        except ClusterRequestError as e:
+            return {"error": str(e)}
+        response.pop("id", None)
+        return response
+
+
+class ClusterClient:
+    """
+    Connection of a worker to the coordinator, used to send requests to other workers and to handle theirs.
+    """
+    # Seconds to wait for a response, a bit longer than the coordinator waits for the worker handling it
+    REQUEST_TIMEOUT = ClusterCoordinator.REQUEST_TIMEOUT + 5
+
+    def __init__(self, host: str, port: int, secret: str, shard_ids: Iterable[int]):
+        self.host = host
+        self.port = port
+        self._secret = secret
+        self.shard_ids = list(shard_ids)
+        self._handlers: Dict[str, Callable[..., Awaitable[Any]]] = {}
+        self._connection: Optional[_Connection] = None
+        self._listen_task: Optional[asyncio.Task] = None
+
+    @property
+    def is_connected(self) -> bool:
+        return self._connection is not None
+
+    def register(self, op: str, handler: Callable[..., Awaitable[Any]]):
+        """
+        :param op: name of the request
+        :param handler: coroutine function called with request payload as keyword arguments,
+                        replaces the previous handler of op (for example when a cog is reloaded)
+        """
+        self._handlers[op] = handler
+
+    async def connect(self):
+        """
+        :raise: ConnectionError if coordinator isn't reachable or has rejected the connection
+        """
+        reader, writer = await asyncio.open_connection(self.host, self.port, limit=_MESSAGE_LIMIT)
+        await _write_message(writer, {"op": "hello", "secret": self._secret, "shard_ids": self.shard_ids})
+        welcome = await _read_message(reader)
+        if welcome is None or welcome.get("op") != "welcome":
+            writer.close()
+            raise ConnectionRefusedError("Cluster coordinator has rejected the connection.")
+        self._connection = _Connection(reader, writer)
+        self._listen_task = asyncio.ensure_future(self._listen(self._connection))
+
+    async def close(self):
+        if self._listen_task is not None:
+            self._listen_task.cancel()
+        if self._connection is not None:
+            self._connection.close()
+            self._connection = None
+
+    async def request(self, op: str, guild_id: int, payload: Dict[str, Any]) -> Any:
+        """
+        Sends request to the worker that owns the guild.
+        :return: whatever the handler of the other worker has returned
+        :raise: ClusterRequestError
+        """
+        response = await self._send({"op": op, "guild_id": guild_id, "payload": payload})
+        if "error" in response:
+            raise ClusterRequestError(response["error"])
+        return response["result"]
+
+    async def gather(self, op: str, payload: Dict[str, Any]) -> List[Any]:
+        """
+        Sends request to all workers, including this one.
+        :return: list of results of workers that have handled it, failures are only logged
+        :raise: ClusterRequestError if request couldn't be sent
+        """
+        response = await self._send({"op": op, "guild_id": None, "payload": payload})
+        for error in response.get("errors", ()):
+            logger.warning(f"Cluster request '{op}' failed on one of the workers: {error}")
+        return response["result"]
+
+    async def _send(self, message: dict) -> dict:
+        if self._connection is None:
+            raise ClusterRequestError("Not connected to the cluster coordinator.")
+        return await self._connection.send_request(message, ClusterClient.REQUEST_TIMEOUT)
+
+    async def _listen(self, connection: _Connection):
+        try:
+            while True:
+                message = await _read_message(connection.reader)
+                if message is None:
+                    break
+                if "op" in message:
+                    asyncio.ensure_future(self._handle_request(connection, message))
+                else:
+                    connection.resolve(message)
+        except (ConnectionError, ValueError) as e:
+            logger.critical(f"Cluster coordinator connection error: {e}")
+        finally:
+            if self._connection is connection:
+                self._connection = None
+                logger.critical("Lost connection to the cluster coordinator, requests to other workers will fail.")
+            connection.close()
+
+    async def _handle_request(self, connection: _Connection, message: dict):
+        handler = self._handlers.get(message["op"])
+        if handler is None:
+            response = {"error": f"Unknown request '{message['op']}'."}
+        else:
+            try:
+                response = {"result": await handler(**message["payload"])}
+            except Exception as e:
+                logger.exception(f"Cluster request '{message['op']}' has failed.")
+                response = {"error": f"{type(e).__name__}: {e}"}
+        try:
+            await _write_message(connection.writer, {**response, "id": message["id"]})
+        except ConnectionError:
+            pass
@@ -1,8 +1,11 @@
 import re
+import math
+import calendar
 import datetime
+import functools
+from typing import Tuple
 
 from discord.ext import commands
-from dateutil.relativedelta import relativedelta
 
 """
 Note that converters are specific to discord py library
@@ -26,39 +29,128 @@ def positive_integer(integer):
         return integer
 
 
+# Single token of a duration string, tokens are matched one after another from the start of the string.
+# Either a number with unit (units can be written together like 1y2m or separated by space)
+# or ISO-8601 duration (e.g. P1Y2M10DT2H30M, PT36H, P2W).
+_DURATION_TOKEN = re.compile(r"""
+    \s*
+    (?:
+        (?P<iso>P
+            (?:(?P<iso_years>[0-9]{1,6})Y)?
+            (?:(?P<iso_months>[0-9]{1,6})M)?
+            (?:(?P<iso_weeks>[0-9]{1,6})W)?
+            (?:(?P<iso_days>[0-9]{1,6})D)?
+            (?:T
+                (?:(?P<iso_hours>[0-9]{1,6})H)?
+                (?:(?P<iso_minutes>[0-9]{1,6})M)?
+            )?
+        )
+        |
+        (?P<amount>[0-9]{1,6})\s*
+        (?P<unit>years?|y|minutes?|mins?|months?|mo|m|weeks?|w|days?|d|hours?|h)
+    )
+    (?![a-z])                                                   # unit can't be followed by other letters
+    \s*
+""", re.VERBOSE | re.IGNORECASE)
+# Unit -> (months, minutes) that one of it is worth
+_DURATION_UNITS = {
+    "y": (12, 0), "year": (12, 0), "years": (12, 0),
+    "m": (1, 0), "mo": (1, 0), "month": (1, 0), "months": (1, 0),
+    "w": (0, 7 * 24 * 60), "week": (0, 7 * 24 * 60), "weeks": (0, 7 * 24 * 60),
+    "d": (0, 24 * 60), "day": (0, 24 * 60), "days": (0, 24 * 60),
+    "h": (0, 60), "hour": (0, 60), "hours": (0, 60),
+    "min": (0, 1), "mins": (0, 1), "minute": (0, 1), "minutes": (0, 1),
+}
+_ISO_GROUPS = {
+    "iso_years": _DURATION_UNITS["y"], "iso_months": _DURATION_UNITS["m"], "iso_weeks": _DURATION_UNITS["w"],
+    "iso_days": _DURATION_UNITS["d"], "iso_hours": _DURATION_UNITS["h"], "iso_minutes": _DURATION_UNITS["min"]
+}
+
+
+@functools.lru_cache(maxsize=1024)
+def _parse_duration(str_input: str) -> Tuple[Tuple[int, ...], int]:
+    """
+    Parses duration string in a single pass over it.
+    Results are cached since the same few durations are used over and over.
+    :return: tuple(months of each word that has years/months, minutes summed from all tokens)
+             Words are separated by whitespace, months are kept per word since each word is
+             counted from the current date (so 1m 1m is 2 times the current month length).
+    :raise: commands.BadArgument if string is not a valid duration
+    """
+    word_months = []
+    minutes = 0
+    position = 0
+    while position < len(str_input):
+        match = _DURATION_TOKEN.match(str_input, position)
+        if match is None:
+            raise commands.BadArgument("Invalid time provided.")
+        if position == 0 or str_input[position - 1].isspace():
+            word_months.append(0)
+        position = match.end()
+
+        if match.group("iso") is None:
+            unit_months, unit_minutes = _DURATION_UNITS[match.group("unit").lower()]
+            amounts = ((int(match.group("amount")), unit_months, unit_minutes),)
+        else:
+            amounts = tuple((int(match.group(group)), unit_months, unit_minutes)
+                            for group, (unit_months, unit_minutes) in _ISO_GROUPS.items()
+                            if match.group(group) is not None)
+            if not amounts:
+                raise commands.BadArgument("Invalid time provided.")
+        for amount, unit_months, unit_minutes in amounts:
+            word_months[-1] += amount * unit_months
+            minutes += amount * unit_minutes
+
+    if position == 0:
+        raise commands.BadArgument("Invalid time provided.")
+    return tuple(months for months in word_months if months), minutes
+
+
 def time_string_to_hours(str_input: str) -> int:
     """
-    :param str_input: string where each word is in one of supported formats (years, months, weeks, days, hours).
+    :param str_input: string of duration tokens (years, months, weeks, days, hours, minutes) or ISO-8601 duration.
     Example inputs: 5y 3months 7h
                     3m 7weeks
                     5hours 3years
                     4w
-    Each word has to contain integer + type format
-    Formats are (separated by comma):years,y,months,m,weeks,w,days,d,hours,h
+                    1y2m
+                    90min
+                    P1M2DT12H
+    Each token has to contain integer + type format, tokens can be separated by space or written together.
+    Formats are (separated by comma):years,y,months,m,mo,weeks,w,days,d,hours,h,minutes,min
 
-    :return: int representing hours that are converted from param str_input formats
+    :return: int representing hours that are converted from param str_input formats, minutes are rounded up
     Example input/output:   5y 3months 7h   /   46063
                             3m 7weeks       /   3384
                             1w              /   168
 
+    Years and months of each word are counted from the current date, so 1m 1m is not always the same as 2m.
+    Parsing is cached, only years and months are calculated on each call since their length in days
+    depends on the current date.
     """
-    compiled = re.compile("""(?:(?P<years>[0-9])(?:years?|y))?          # e.g. 2years or 2y
-                             (?:(?P<months>[0-9]{1,2})(?:months?|m))?   # e.g. 2months or 2m
-                             (?:(?P<weeks>[0-9]{1,4})(?:weeks?|w))?     # e.g. 10weeks or 10w
-                             (?:(?P<days>[0-9]{1,5})(?:days?|d))?       # e.g. 14days or 10d
-                             (?:(?P<hours>[0-9]{1,5})(?:hours?|h))?     # e.g. 12hours or 12h
-                          """, re.VERBOSE)
-    hours = 0
-    for word in str_input.split():
-        match = compiled.fullmatch(word)
-        if match is None or not match.group(0):
-            raise commands.BadArgument("Invalid time provided.")
+    word_months, total_minutes = _parse_duration(str_input)
+    for months in word_months:
+        total_minutes += _calendar_months_to_days(months) * 24 * 60
+    return math.ceil(total_minutes / 60)
+
+
+def _calendar_months_to_days(months: int) -> int:
+    """
+    :return: number of days from today to the same day of the month param months later, if that month
+             is shorter the last day of it is used instead (e.g. 31st January + 1 month is 28th/29th February)
+    """
+    today = datetime.datetime.utcnow().date()
+    year, month_index = divmod(today.month - 1 + months, 12)
+    year += today.year
+    if year > datetime.MAXYEAR:
+        raise commands.BadArgument("Invalid time provided, duration is too long.")
+    month = month_index + 1
+    day = min(today.day, calendar.monthrange(year, month)[1])
+    return (datetime.date(year, month, day) - today).days
 
-        time_data = {k: int(v) for k, v in match.groupdict(default=0).items()}
-        now = datetime.datetime.utcnow()
-        td = (relativedelta(**time_data) + now) - now
-        hours += td.days * 24 + td.seconds // 3600
-    return hours
+
+# 12 months, also used as the limit for imported license durations
+MAX_LICENSE_DURATION_HOURS = 8784
 
 
 def license_duration(input_duration: str) -> int:
@@ -66,11 +158,13 @@ def license_duration(input_duration: str) -> int:
     :param input_duration: str consisting of a positive integer or date duration format.
     :return: int representing license duration hours.
              Maximum allowed integer is 8784 representing 12 months.
+             Durations with minutes are rounded up to whole hours, years and months of each word
+             are counted from the current date (see time_string_to_hours).
     :raise: commands.BadArgument or discord.ext.commands.BadArgument (don't manually catch them, use error handler
             instead, since this is a converter)
 
     """
-    max_hours = 8784
+    max_hours = MAX_LICENSE_DURATION_HOURS
     try:
         duration = positive_integer(input_duration)
     except ValueError:
@@ -78,5 +172,8 @@ def license_duration(input_duration: str) -> int:
 
     if duration > max_hours:
         raise commands.BadArgument(f"Duration can't be longer than {max_hours}h, currently it is {duration}h.")
+    elif duration < 1:
+        raise commands.BadArgument("Duration has to be at least 1 hour.")
     else:
         return duration
+
@@ -0,0 +1,148 @@
+import heapq
+import asyncio
+from typing import Dict, List, Set, Tuple, Optional, Iterable
+
+from helpers.licence_helper import get_current_time
+
+
+class ExpirationScheduler:
+    """
+    In-memory index of licensed member expirations ordered by expiration date (min-heap).
+    Expiration dates are unix timestamps, same as in the database.
+
+    Loaded once at startup from table LICENSED_MEMBERS and kept in sync by DatabaseHandler whenever
+    a licensed member is added or deleted. This way the license check loop can sleep until the next
+    expiration and only touch the entries that are actually due instead of scanning the whole table.
+
+    Removal is lazy, removed entries stay in the heap and are discarded once they reach the top.
+
+    Since every licensed member is in it, it's also used as an index of licensed (member, role) pairs.
+    """
+    # Upper limit of a single sleep, so we don't oversleep if the system clock changes.
+    MAX_SLEEP_SECONDS = 3600
+
+    def __init__(self):
+        # Heap entries are in format (expiration_date, member_id, licensed_role_id)
+        self._heap = []
+        # (member_id, licensed_role_id) -> (guild_id, expiration_date)
+        # Source of truth for the heap, heap entry that doesn't match this is stale.
+        self._entries: Dict[Tuple[int, int], Tuple[int, int]] = {}
+        self._wakeup = asyncio.Event()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, member_role: Tuple[int, int]) -> bool:
+        """
+        :param member_role: tuple(member_id, licensed_role_id)
+        :return: True if member has a license for the role that is scheduled to expire
+        """
+        return member_role in self._entries
+
+    def get_guild_members(self) -> Dict[int, Set[int]]:
+        """
+        :return: dict guild_id -> set of ids of members that have at least one scheduled license in that guild
+        """
+        guild_members = {}
+        for (member_id, _), (guild_id, _) in self._entries.items():
+            guild_members.setdefault(guild_id, set()).add(member_id)
+        return guild_members
+
+    def load(self, rows: Iterable[Tuple[int, int, int, int]]):
+        """
+        Replaces all scheduled entries.
+        :param rows: iterable of tuples in format (member_id, guild_id, expiration_date, licensed_role_id)
+        """
+        self._entries = {(member_id, role_id): (guild_id, expiration_date)
+                         for member_id, guild_id, expiration_date, role_id in rows}
+        self._rebuild_heap()
+        self._wakeup.set()
+
+    def schedule(self, member_id: int, guild_id: int, expiration_date: int, licensed_role_id: int):
+        """
+        Adds (or replaces) member license expiration.
+        Wakes up the waiter if this expiration is earlier than the one it is currently sleeping for.
+        """
+        next_expiration = self.next_expiration_date()
+        self._entries[(member_id, licensed_role_id)] = (guild_id, expiration_date)
+        heapq.heappush(self._heap, (expiration_date, member_id, licensed_role_id))
+        if next_expiration is None or expiration_date < next_expiration:
+            self._wakeup.set()
+
+    def unschedule(self, member_id: int, licensed_role_id: int):
+        self._entries.pop((member_id, licensed_role_id), None)
+        self._compact()
+
+    def unschedule_guild(self, guild_id: int):
+        self._remove_where(lambda key, value: value[0] == guild_id)
+
+    def unschedule_roles(self, licensed_role_ids: Set[int]):
+        self._remove_where(lambda key, value: key[1] in licensed_role_ids)
+
+    def next_expiration_date(self) -> Optional[int]:
+        """
+        :return: earliest expiration date that is scheduled or None if nothing is scheduled
+        """
+        self._discard_stale()
+        return self._heap[0][0] if self._heap else None
+
+    def pop_due(self, now: int) -> List[Tuple[int, int, int, int]]:
+        """
+        Removes and returns all entries that have expired by param now.
+        :param now: int unix timestamp to compare expiration dates against
+        :return: list of tuples in format (member_id, guild_id, expiration_date, licensed_role_id)
+                 ordered by expiration date.
+        """
+        due = []
+        while True:
+            self._discard_stale()
+            if not self._heap or self._heap[0][0] > now:
+                break
+            expiration_date, member_id, role_id = heapq.heappop(self._heap)
+            guild_id, _ = self._entries.pop((member_id, role_id))
+            due.append((member_id, guild_id, expiration_date, role_id))
+        return due
+
+    async def wait_until_due(self):
+        """
+        Sleeps until the earliest scheduled expiration is due.
+        Re-evaluates each time an earlier expiration gets scheduled.
+        """
+        while True:
+            self._wakeup.clear()
+            next_expiration = self.next_expiration_date()
+            if next_expiration is None:
+                delay = ExpirationScheduler.MAX_SLEEP_SECONDS
+            else:
+                delay = next_expiration - get_current_time().timestamp()
+                if delay <= 0:
+                    return
+
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=min(delay, ExpirationScheduler.MAX_SLEEP_SECONDS))
+            except asyncio.TimeoutError:
+                pass
+
+    def _discard_stale(self):
+        while self._heap:
+            expiration_date, member_id, role_id = self._heap[0]
+            entry = self._entries.get((member_id, role_id))
+            if entry is not None and entry[1] == expiration_date:
+                return
+            heapq.heappop(self._heap)
+
+    def _remove_where(self, predicate):
+        for key in [key for key, value in self._entries.items() if predicate(key, value)]:
+            del self._entries[key]
+        self._compact()
+
+    def _compact(self):
+        # Stale entries are normally discarded when they reach the top of the heap, but if a lot of
+        # entries are removed at once (guild/role deletion) they would just take up memory.
+        if len(self._heap) > 2 * len(self._entries) + 1024:
+            self._rebuild_heap()
+
+    def _rebuild_heap(self):
+        self._heap = [(expiration_date, member_id, role_id)
+                      for (member_id, role_id), (_, expiration_date) in self._entries.items()]
+        heapq.heapify(self._heap)
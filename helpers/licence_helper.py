@@ -1,41 +1,86 @@
-import random
 import string
-from datetime import datetime, timedelta
+import hashlib
+import secrets
+from typing import List
+from datetime import datetime, timedelta, timezone
 
 
-def generate_multiple(amount: int) -> list:
-    licenses = []
-    for _ in range(amount):
-        licenses.append(generate_single())
-    return licenses
+LICENSE_LENGTH = 30
+_LICENSE_ALPHABET = (string.ascii_letters + string.digits).encode()
+# Random bytes are mapped to alphabet characters with modulo, bytes that are equal or above this
+# are discarded so every character has the same probability.
+_UNBIASED_BYTE_LIMIT = 256 - 256 % len(_LICENSE_ALPHABET)
+_BYTE_TO_CHARACTER = bytes(_LICENSE_ALPHABET[byte % len(_LICENSE_ALPHABET)] for byte in range(256))
+_DISCARDED_BYTES = bytes(range(_UNBIASED_BYTE_LIMIT, 256))
+
+
+def generate_multiple(amount: int) -> List[str]:
+    """
+    Generates unique licenses using cryptographically secure random bytes.
+    Bytes for all licenses are drawn at once and converted to characters in a single pass,
+    instead of choosing each character separately.
+    :param amount: number of licenses to generate
+    :return: list of unique licenses
+    """
+    # dict instead of set so duplicates are removed while keeping the order
+    licenses = {}
+    while len(licenses) < amount:
+        missing = amount - len(licenses)
+        # Some bytes get discarded so a bit more is drawn than needed
+        random_bytes = secrets.token_bytes(missing * LICENSE_LENGTH * 256 // _UNBIASED_BYTE_LIMIT + LICENSE_LENGTH)
+        characters = random_bytes.translate(_BYTE_TO_CHARACTER, _DISCARDED_BYTES).decode()
+        for i in range(0, len(characters) - LICENSE_LENGTH + 1, LICENSE_LENGTH):
+            licenses[characters[i:i + LICENSE_LENGTH]] = None
+    return list(licenses)[:amount]
 
 
 def generate_single() -> str:
-    return "".join(random.choices(string.ascii_letters + string.digits, k=30))
+    return generate_multiple(1)[0]
+
+
+class LicenseHasher:
+    """
+    Keyed hash of licenses, used when licenses are stored hashed instead of in plaintext.
+
+    Only the hash and a short prefix (so licenses can still be told apart when listed) are stored,
+    that way licenses can't be redeemed by someone who got the database file.
+    Hash is keyed with a server secret so licenses can't be brute forced from the hashes either.
+    """
+    DIGEST_SIZE = 16
+    PREFIX_LENGTH = 6
+
+    def __init__(self, secret: str):
+        if not secret:
+            raise ValueError("License hash secret can't be empty.")
+        # Key has to be at most 64 bytes, secret from config can be of any length
+        self._key = hashlib.sha256(secret.encode()).digest()
+
+    def hash(self, license: str) -> bytes:
+        return hashlib.blake2b(license.encode(), key=self._key, digest_size=LicenseHasher.DIGEST_SIZE).digest()
+
+    @staticmethod
+    def display_prefix(license: str) -> str:
+        return license[:LicenseHasher.PREFIX_LENGTH]
 
 
 def construct_expiration_date(license_duration_hours: int) -> datetime:
     """
-     Return format:
-    Y-M-D H:M:S.mS
     :param license_duration_hours: int hours to be added to current date
-    :return: datetime current time incremented by param license_duration_hours
+    :return: timezone aware (UTC) datetime current time incremented by param license_duration_hours
 
     """
     expiration_date = get_current_time() + timedelta(hours=license_duration_hours)
     return expiration_date
 
 
-def get_remaining_time(expiration_date: str) -> str:
+def get_remaining_time(expiration_date: int) -> str:
     """
-    :param expiration_date: string in format Y-M-D H:M:S.mS
+    :param expiration_date: int unix timestamp (seconds) as saved in the database
     :return: timedelta difference between expiration_date and current time
 
     """
-    # Convert string to datetime
-    expiration_datetime = datetime.strptime(expiration_date, "%Y-%m-%d %H:%M:%S.%f")
     # timedelta object
-    difference = expiration_datetime - get_current_time()
+    difference = timestamp_to_datetime(expiration_date) - get_current_time()
     # difference has ms in it so we remove it here for nicer display
     difference = str(difference).split(".")[0]
     return difference
@@ -44,9 +89,30 @@ def get_remaining_time(expiration_date: str) -> str:
 def get_current_time() -> datetime:
     """
     Helper function that needs to be called every time we need current time.
-    Makes it easy to change timezone.
-    Currently change it inside of this function only, note that if you have
-    saved licenses changing this will break them (either they will expire prematurely by few hours or they could
-    possibly never expire!)
+    Always timezone aware and in UTC, dates are saved in the database as unix timestamps
+    so the timezone of the machine hosting the bot doesn't matter.
+    """
+    return datetime.now(timezone.utc)
+
+
+def get_current_timestamp() -> int:
+    """
+    :return: int current unix timestamp (seconds), format in which dates are saved in the database
+    """
+    return datetime_to_timestamp(get_current_time())
+
+
+def datetime_to_timestamp(date: datetime) -> int:
+    """
+    :param date: timezone aware datetime (naive datetimes are assumed to be in local time)
+    :return: int unix timestamp (seconds)
+    """
+    return int(date.timestamp())
+
+
+def timestamp_to_datetime(timestamp: int) -> datetime:
+    """
+    :param timestamp: int unix timestamp (seconds)
+    :return: timezone aware (UTC) datetime
     """
-    return datetime.now()
+    return datetime.fromtimestamp(timestamp, timezone.utc)
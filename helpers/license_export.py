@@ -0,0 +1,129 @@
+import io
+import csv
+import json
+from typing import List, Tuple, Iterable, Optional, IO
+
+from helpers.converters import MAX_LICENSE_DURATION_HOURS
+
+
+"""
+Export and import of stored licenses, used to move licenses to and from external storefronts.
+
+Both formats have the same fields for each license:
+license, role_id, duration_hours
+
+CSV has a header row, JSONL has one JSON object per line.
+When importing, role_id and duration_hours are optional, default values are used for licenses without them.
+"""
+
+
+EXPORT_FORMATS = ("csv", "jsonl")
+EXPORT_FIELDS = ("license", "role_id", "duration_hours")
+# Licenses are stored as TEXT primary key so we don't want anything too long or with whitespace
+MAX_IMPORTED_LICENSE_LENGTH = 100
+# Largest integer SQLite can store, Discord IDs are way below it
+_MAX_ID = 2 ** 63 - 1
+
+
+def write_licenses(file: IO[bytes], export_format: str, rows: Iterable[Tuple[str, int, int]], *, header: bool):
+    """
+    Appends licenses to the binary file.
+    :param file: binary file to write to
+    :param export_format: one of EXPORT_FORMATS
+    :param rows: iterable of tuples (license, role_id, duration_hours)
+    :param header: if True CSV header is written before the rows, not used for JSONL
+    """
+    text = io.StringIO()
+    if export_format == "csv":
+        writer = csv.writer(text)
+        if header:
+            writer.writerow(EXPORT_FIELDS)
+        writer.writerows(rows)
+    else:
+        for row in rows:
+            text.write(json.dumps(dict(zip(EXPORT_FIELDS, row))))
+            text.write("\n")
+    file.write(text.getvalue().encode())
+
+
+def read_licenses(text: str, import_format: str) -> Tuple[List[Tuple[str, Optional[int], Optional[int]]], List[str]]:
+    """
+    Parses licenses written by write_licenses or by an external storefront in the same format.
+    CSV header is optional, without it columns are expected in the EXPORT_FIELDS order.
+    :param text: file content
+    :param import_format: one of EXPORT_FORMATS
+    :return: tuple(list of tuples (license, role_id or None, duration_hours or None), list of str errors)
+             Duplicate licenses are only returned once.
+    """
+    if import_format == "csv":
+        records = _read_csv_records(text)
+    else:
+        records = _read_jsonl_records(text)
+
+    licenses = {}
+    errors = []
+    for line_number, record in records:
+        if isinstance(record, str):
+            errors.append(f"Line {line_number}: {record}")
+            continue
+        try:
+            license = str(record.get("license") or "").strip()
+            role_id = _optional_int(record.get("role_id"))
+            duration_hours = _optional_int(record.get("duration_hours"))
+        except ValueError as e:
+            errors.append(f"Line {line_number}: {e}")
+            continue
+
+        if not license or len(license) > MAX_IMPORTED_LICENSE_LENGTH or any(char.isspace() for char in license):
+            errors.append(f"Line {line_number}: invalid license {license[:MAX_IMPORTED_LICENSE_LENGTH]}")
+        elif duration_hours is not None and duration_hours < 1:
+            errors.append(f"Line {line_number}: duration has to be larger than zero.")
+        elif duration_hours is not None and duration_hours > MAX_LICENSE_DURATION_HOURS:
+            errors.append(f"Line {line_number}: duration can't be longer than {MAX_LICENSE_DURATION_HOURS}h.")
+        elif role_id is not None and not 0 < role_id <= _MAX_ID:
+            errors.append(f"Line {line_number}: invalid role id {role_id}.")
+        elif license in licenses:
+            errors.append(f"Line {line_number}: license {license} is already in line above.")
+        else:
+            licenses[license] = (license, role_id, duration_hours)
+    return list(licenses.values()), errors
+
+
+def _read_csv_records(text: str):
+    rows = csv.reader(io.StringIO(text))
+    for line_number, row in enumerate(rows, start=1):
+        if not row or not any(row):
+            continue
+        if line_number == 1 and row[0].strip().lower() == EXPORT_FIELDS[0]:
+            fields = [field.strip().lower() for field in row]
+            # Rest of the file is read with field names from the header
+            for data_line_number, data_row in enumerate(rows, start=2):
+                if data_row and any(data_row):
+                    yield data_line_number, dict(zip(fields, data_row))
+            return
+        yield line_number, dict(zip(EXPORT_FIELDS, row))
+
+
+def _read_jsonl_records(text: str):
+    for line_number, line in enumerate(text.splitlines(), start=1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            record = json.loads(line)
+        except ValueError:
+            yield line_number, "invalid JSON."
+            continue
+        if not isinstance(record, dict):
+            yield line_number, "expected JSON object."
+            continue
+        yield line_number, record
+
+
+def _optional_int(value) -> Optional[int]:
+    if value is None or (isinstance(value, str) and not value.strip()):
+        return None
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        raise ValueError(f"{value} is not a number.")
@@ -0,0 +1,212 @@
+import time
+import asyncio
+import logging
+from typing import Dict, Tuple, Optional, Iterable
+
+import discord
+
+
+logger = logging.getLogger(__name__)
+
+
+class MemberLookupCache:
+    """
+    Short lived cache for members that are not in the gateway member cache.
+
+    Gateway cache is always checked first, this cache only holds results of API lookups so the
+    same member isn't fetched again and again. Members that were not found (left the guild) are
+    cached too (negative caching) so they don't cause a fetch each time either, their entry has to be
+    removed with forget when they join the guild again.
+
+    Members of many licenses that are due at once can be loaded with prefetch, which requests them
+    from the gateway in batches instead of doing one fetch_member HTTP call per member. Lookups of members
+    that are in a batch that is currently being requested wait for it instead of fetching them again.
+    """
+    # Maximum number of user ids per query_members request, Discord limit
+    QUERY_BATCH_SIZE = 100
+    # Cache size at which expired entries are removed
+    MAX_ENTRIES = 10000
+
+    def __init__(self, ttl: float = 60, negative_ttl: float = 300):
+        """
+        :param ttl: seconds to cache found members for
+        :param negative_ttl: seconds to cache members that were not found for
+        """
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        # (guild_id, member_id): (monotonic expiration time, member or None if not found)
+        self._entries: Dict[Tuple[int, int], Tuple[float, Optional[discord.Member]]] = {}
+        # (guild_id, member_id): future that is done once the gateway request the member is in is done
+        self._in_flight: Dict[Tuple[int, int], asyncio.Future] = {}
+        self.hits = 0
+        self.misses = 0
+        # Process RSS growth measured while caching members with cache_members, used to estimate memory per member
+        self._measured_members = 0
+        self._measured_bytes = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    async def get_member(self, guild: discord.Guild, member_id: int,
+                         use_negative_cache: bool = True) -> Optional[discord.Member]:
+        """
+        :param use_negative_cache: if False member that was cached as not found is fetched again,
+                                   used for lookups initiated by the member themself
+        :return: member or None if member is not in the guild
+        :raise: HTTPException if fetching the member failed for reason other than member not being found
+        """
+        member = guild.get_member(member_id)
+        if member is not None:
+            return member
+
+        in_flight = self._in_flight.get((guild.id, member_id))
+        if in_flight is not None:
+            # Shielded so cancelling this lookup doesn't cancel the future other lookups wait for
+            await asyncio.shield(in_flight)
+            member = guild.get_member(member_id)
+            if member is not None:
+                return member
+
+        found, member = self._get_cached(guild.id, member_id)
+        if found and (member is not None or use_negative_cache):
+            self.hits += 1
+            return member
+
+        self.misses += 1
+        try:
+            member = await guild.fetch_member(member_id)
+        except discord.NotFound:
+            member = None
+        self._cache(guild.id, member_id, member)
+        return member
+
+    async def prefetch(self, guild: discord.Guild, member_ids: Iterable[int]):
+        """
+        Loads members that are neither in gateway cache nor in this cache with batched gateway requests.
+        Members that are loaded are also added to the gateway cache.
+        :param guild: guild the members are from
+        :param member_ids: ids of members to load
+        """
+        missing = {
+            member_id for member_id in member_ids
+            if guild.get_member(member_id) is None and not self._get_cached(guild.id, member_id)[0]
+        }
+        await self._query_members(guild, missing)
+
+    async def cache_members(self, guild: discord.Guild, member_ids: Iterable[int]) -> int:
+        """
+        Adds members to the gateway cache regardless of the member cache flags.
+        Used when the gateway doesn't cache members by itself so only the members we need are kept in memory.
+        :param guild: guild the members are from
+        :param member_ids: ids of members to cache
+        :return: number of members that were loaded
+        """
+        missing = {member_id for member_id in member_ids if guild.get_member(member_id) is None}
+        return await self._query_members(guild, missing)
+
+    def forget(self, guild_id: int, member_id: int):
+        """Removes cache entry of the member, for example when member that was cached as not found joins."""
+        self._entries.pop((guild_id, member_id), None)
+
+    def uncache_member(self, guild: discord.Guild, member_id: int):
+        """
+        Removes member from the gateway cache and from this cache.
+        Used when the gateway doesn't cache members by itself and member is no longer needed.
+        """
+        self.forget(guild.id, member_id)
+        member = guild.get_member(member_id)
+        if member is not None:
+            # discord.py has no public way to remove a member from the cache, users are weak references
+            # so the user is freed too once nothing else references it.
+            guild._remove_member(member)
+
+    def record_memory_usage(self, member_count: int, rss_growth: int):
+        """
+        :param member_count: number of members that were cached with cache_members
+        :param rss_growth: int bytes the process RSS has grown by while caching them
+        """
+        if member_count > 0:
+            self._measured_members += member_count
+            self._measured_bytes += rss_growth
+
+    def get_bytes_per_member(self) -> Optional[float]:
+        """
+        :return: float average measured bytes per cached member or None if nothing was measured yet
+                 (or members were too few for RSS to grow)
+        """
+        if self._measured_members == 0 or self._measured_bytes <= 0:
+            return None
+        return self._measured_bytes / self._measured_members
+
+    def get_stats(self) -> Tuple[int, int, int]:
+        """
+        :return: tuple(int number of cached members, int hits, int misses)
+        """
+        return len(self._entries), self.hits, self.misses
+
+    async def _query_members(self, guild: discord.Guild, member_ids: Iterable[int]) -> int:
+        """
+        Requests members from the gateway in batches, found members are added to the gateway cache.
+        :return: number of members that were found
+        """
+        member_ids = list(member_ids)
+        found_count = 0
+        for i in range(0, len(member_ids), MemberLookupCache.QUERY_BATCH_SIZE):
+            batch = member_ids[i:i + MemberLookupCache.QUERY_BATCH_SIZE]
+            in_flight = self._start_in_flight(guild.id, batch)
+            try:
+                members = await guild.query_members(user_ids=batch, limit=len(batch), cache=True)
+            except (asyncio.TimeoutError, RuntimeError) as e:
+                # Remaining members will be looked up one by one with get_member
+                logger.warning(f"Can't query {len(batch)} members of guild {guild.id}: {e}")
+                break
+            else:
+                found_ids = set()
+                for member in members:
+                    found_ids.add(member.id)
+                    self._cache(guild.id, member.id, member)
+                for member_id in batch:
+                    if member_id not in found_ids:
+                        self._cache(guild.id, member_id, None)
+                found_count += len(found_ids)
+            finally:
+                self._finish_in_flight(guild.id, in_flight)
+        return found_count
+
+    def _start_in_flight(self, guild_id: int, member_ids: Iterable[int]) -> Dict[int, asyncio.Future]:
+        loop = asyncio.get_event_loop()
+        in_flight = {}
+        for member_id in member_ids:
+            future = loop.create_future()
+            in_flight[member_id] = future
+            self._in_flight[(guild_id, member_id)] = future
+        return in_flight
+
+    def _finish_in_flight(self, guild_id: int, in_flight: Dict[int, asyncio.Future]):
+        for member_id, future in in_flight.items():
+            if self._in_flight.get((guild_id, member_id)) is future:
+                del self._in_flight[(guild_id, member_id)]
+            if not future.done():
+                future.set_result(None)
+
+    def _get_cached(self, guild_id: int, member_id: int) -> Tuple[bool, Optional[discord.Member]]:
+        """
+        :return: tuple(bool True if there is a valid cache entry, cached member or None)
+        """
+        entry = self._entries.get((guild_id, member_id))
+        if entry is None:
+            return False, None
+        expires_at, member = entry
+        if expires_at < time.monotonic():
+            del self._entries[(guild_id, member_id)]
+            return False, None
+        return True, member
+
+    def _cache(self, guild_id: int, member_id: int, member: Optional[discord.Member]):
+        now = time.monotonic()
+        if len(self._entries) >= MemberLookupCache.MAX_ENTRIES:
+            self._entries = {key: entry for key, entry in self._entries.items() if entry[0] >= now}
+            if len(self._entries) >= MemberLookupCache.MAX_ENTRIES:
+                self._entries.clear()
+        ttl = self.ttl if member is not None else self.negative_ttl
+        self._entries[(guild_id, member_id)] = (now + ttl, member)
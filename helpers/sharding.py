@@ -0,0 +1,48 @@
+from typing import Optional, Iterable, Tuple
+
+
+def get_guild_shard_id(guild_id: int, shard_count: int) -> int:
+    """Same formula Discord uses to decide which shard a guild is on."""
+    return (guild_id >> 22) % shard_count
+
+
+class ShardPartition:
+    """
+    Shards that are handled by this process.
+
+    If the process runs all shards (or sharding isn't configured) nothing is partitioned and every
+    guild is owned. Otherwise only guilds on shards from shard_ids are owned and data of other guilds
+    (licenses to expire, prefixes...) is left to processes running those shards.
+    """
+    def __init__(self, shard_count: Optional[int] = None, shard_ids: Optional[Iterable[int]] = None):
+        """
+        :param shard_count: total number of shards across all processes, None if decided by Discord
+        :param shard_ids: shards ran by this process, None for all of them
+        """
+        self.shard_count = shard_count
+        self.shard_ids = tuple(sorted(set(shard_ids))) if shard_ids is not None else None
+        if self.shard_ids is not None and shard_count is None:
+            raise ValueError("Shard count has to be set when shard ids are set.")
+
+    def __repr__(self):
+        return f"ShardPartition(shard_count={self.shard_count}, shard_ids={self.shard_ids})"
+
+    @property
+    def is_partitioned(self) -> bool:
+        return self.shard_ids is not None and len(self.shard_ids) < self.shard_count
+
+    def owns_guild(self, guild_id: int) -> bool:
+        if not self.is_partitioned:
+            return True
+        return get_guild_shard_id(guild_id, self.shard_count) in self.shard_ids
+
+    def get_sql_condition(self, column: str = "GUILD_ID") -> Tuple[str, tuple]:
+        """
+        :param column: guild id column to filter on
+        :return: tuple(str SQL condition, tuple of it's parameters) that matches only owned guilds.
+                 Condition is "1" if nothing is partitioned so it can always be used in WHERE.
+        """
+        if not self.is_partitioned:
+            return "1", ()
+        placeholders = ",".join("?" * len(self.shard_ids))
+        return f"(({column} >> 22) % ?) IN ({placeholders})", (self.shard_count, *self.shard_ids)
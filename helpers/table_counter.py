@@ -0,0 +1,49 @@
+from collections import Counter
+from typing import Iterable, Tuple, Callable, Optional
+
+
+class TableCounter:
+    """
+    Number of rows in a database table, in total and per guild.
+
+    Kept in memory and updated incrementally by DatabaseHandler so statistics don't need
+    COUNT(*) queries. Since increments are done only after the write is committed it can
+    briefly drift, so it should be periodically reconciled against the table with reset().
+    """
+
+    def __init__(self, owns_guild: Optional[Callable[[int], bool]] = None):
+        """
+        :param owns_guild: if passed only guilds for which it returns True are counted, rows of other guilds
+                           are counted by processes running their shards
+        """
+        self._owns_guild = owns_guild
+        self._per_guild = Counter()
+        self.total = 0
+
+    def get(self, guild_id: int) -> int:
+        return self._per_guild.get(guild_id, 0)
+
+    def add(self, guild_id: int, amount: int = 1):
+        """
+        :param guild_id: guild to add rows to
+        :param amount: number of rows added, negative if they were removed
+        """
+        if self._owns_guild is not None and not self._owns_guild(guild_id):
+            return
+        old_count = self.get(guild_id)
+        new_count = max(old_count + amount, 0)
+        if new_count:
+            self._per_guild[guild_id] = new_count
+        else:
+            self._per_guild.pop(guild_id, None)
+        self.total += new_count - old_count
+
+    def set(self, guild_id: int, count: int):
+        self.add(guild_id, count - self.get(guild_id))
+
+    def reset(self, rows: Iterable[Tuple[int, int]]):
+        """
+        :param rows: iterable of tuples (guild_id, row count) as returned by COUNT(*) ... GROUP BY GUILD_ID
+        """
+        self._per_guild = Counter({guild_id: count for guild_id, count in rows if count})
+        self.total = sum(self._per_guild.values())
@@ -0,0 +1,174 @@
+import time
+import asyncio
+import logging
+from collections import deque, Counter, defaultdict
+from typing import Callable, Awaitable, Hashable, Dict
+
+
+logger = logging.getLogger(__name__)
+
+
+class WorkQueue:
+    """
+    Queue of jobs that are processed concurrently by a fixed number of worker tasks.
+
+    Jobs can be grouped (for example by guild id) and only group_concurrency jobs from the same group
+    are processed at once, that way a lot of jobs from one guild don't all hit the same Discord rate
+    limit route at the same time while jobs from other guilds still get processed.
+
+    If handler raises an exception the job is retried with exponential backoff, after max_retries
+    failed retries on_failure is called with the job and the last exception.
+
+    Jobs have to be hashable, the same job can't be queued again while it's still pending.
+    """
+    # Window in seconds for measuring throughput
+    THROUGHPUT_WINDOW = 60
+
+    def __init__(self, name: str, handler: Callable[[Hashable], Awaitable], *, workers: int = 10,
+                 group_key: Callable[[Hashable], Hashable] = None, group_concurrency: int = None,
+                 max_retries: int = 3, retry_delay: float = 5.0, max_size: int = 0,
+                 on_failure: Callable[[Hashable, Exception], Awaitable] = None):
+        """
+        :param name: used for logging
+        :param handler: coroutine function that processes a single job
+        :param workers: number of jobs that are processed at the same time
+        :param group_key: function that returns the group of a job, if None all jobs are in the same group
+        :param group_concurrency: maximum number of jobs from the same group processed at the same time,
+                                  if None then it's limited only by number of workers
+        :param max_retries: number of times a failed job is retried
+        :param retry_delay: seconds to wait before the first retry, doubled on each next retry
+        :param max_size: maximum number of pending jobs, new jobs are rejected when it's reached. 0 for unlimited.
+        :param on_failure: coroutine function called when a job has failed after all of it's retries
+        """
+        self.name = name
+        self._handler = handler
+        self.workers = workers
+        self._group_key = group_key if group_key is not None else (lambda job: None)
+        self.group_concurrency = group_concurrency if group_concurrency is not None else workers
+        self.max_retries = max_retries
+        self.retry_delay = retry_delay
+        self.max_size = max_size
+        self._on_failure = on_failure
+
+        self._queue = asyncio.Queue()
+        # Every job that was put and is not yet finished, waiting, in progress or waiting for retry
+        self._pending = set()
+        self._attempts: Dict[Hashable, int] = {}
+        self._active_per_group = Counter()
+        # Jobs that were taken from the queue while their group was at the concurrency limit
+        self._waiting_per_group = defaultdict(deque)
+        self._worker_tasks = []
+        # Monotonic times of successfully processed jobs in the last THROUGHPUT_WINDOW seconds
+        self._completed_times = deque()
+
+        self.processed = 0
+        self.retried = 0
+        self.failed = 0
+        self.rejected = 0
+
+    def __len__(self):
+        return len(self._pending)
+
+    def start(self):
+        if not self._worker_tasks:
+            loop = asyncio.get_event_loop()
+            self._worker_tasks = [loop.create_task(self._worker()) for _ in range(self.workers)]
+
+    def stop(self):
+        for task in self._worker_tasks:
+            task.cancel()
+        self._worker_tasks = []
+
+    def put(self, job: Hashable) -> bool:
+        """
+        :param job: job to process
+        :return: True if job was queued, False if it's already pending or the queue is full
+        """
+        if job in self._pending:
+            return False
+        if self.max_size and len(self._pending) >= self.max_size:
+            self.rejected += 1
+            return False
+        self._pending.add(job)
+        self._queue.put_nowait(job)
+        return True
+
+    def jobs_per_minute(self) -> float:
+        """
+        :return: number of successfully processed jobs per minute, measured over the last THROUGHPUT_WINDOW seconds
+        """
+        self._discard_old_completed_times()
+        return len(self._completed_times) * 60 / WorkQueue.THROUGHPUT_WINDOW
+
+    def get_stats(self) -> Dict[str, float]:
+        return {
+            "pending": len(self._pending),
+            "queued": self._queue.qsize(),
+            "in progress": sum(self._active_per_group.values()),
+            "processed": self.processed,
+            "retried": self.retried,
+            "failed": self.failed,
+            "rejected": self.rejected,
+            "per minute": self.jobs_per_minute(),
+        }
+
+    async def _worker(self):
+        while True:
+            job = await self._queue.get()
+            group = self._group_key(job)
+            if self._active_per_group[group] >= self.group_concurrency:
+                # Worker that is currently processing this group will pick it up when it's done
+                self._waiting_per_group[group].append(job)
+                continue
+
+            self._active_per_group[group] += 1
+            try:
+                while job is not None:
+                    await self._process(job)
+                    waiting = self._waiting_per_group.get(group)
+                    job = waiting.popleft() if waiting else None
+            finally:
+                self._active_per_group[group] -= 1
+                if not self._active_per_group[group]:
+                    del self._active_per_group[group]
+                if group in self._waiting_per_group and not self._waiting_per_group[group]:
+                    del self._waiting_per_group[group]
+
+    async def _process(self, job: Hashable):
+        attempt = self._attempts.get(job, 0)
+        try:
+            await self._handler(job)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            if attempt < self.max_retries:
+                self.retried += 1
+                self._attempts[job] = attempt + 1
+                delay = self.retry_delay * 2 ** attempt
+                logger.warning(f"{self.name} job {job} failed, retrying in {delay}s: {e}")
+                asyncio.get_event_loop().call_later(delay, self._queue.put_nowait, job)
+                return
+
+            self.failed += 1
+            self._finish(job)
+            logger.warning(f"{self.name} job {job} failed after {attempt} retries: {e}")
+            if self._on_failure is not None:
+                try:
+                    await self._on_failure(job, e)
+                except Exception as failure_exception:
+                    logger.critical(f"{self.name} failure handler for job {job} failed: {failure_exception}")
+            return
+
+        self.processed += 1
+        self._completed_times.append(time.monotonic())
+        self._discard_old_completed_times()
+        self._finish(job)
+
+    def _finish(self, job: Hashable):
+        self._pending.discard(job)
+        self._attempts.pop(job, None)
+
+    def _discard_old_completed_times(self):
+        window_start = time.monotonic() - WorkQueue.THROUGHPUT_WINDOW
+        while self._completed_times and self._completed_times[0] < window_start:
+            self._completed_times.popleft()
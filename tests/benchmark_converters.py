@@ -0,0 +1,80 @@
+"""
+Compares duration parsing of time_string_to_hours with the parser it has replaced, which compiled the
+pattern on each call and converted each word with relativedelta.
+
+Not a test, run it from the repository root with:
+    python -m tests.benchmark_converters [number of calls per duration]
+
+Old parser needs python-dateutil which is no longer a requirement, if it is not installed years and months
+are converted with the same calendar calculation the current parser uses so only parsing is compared.
+"""
+import re
+import sys
+import datetime
+import timeit
+
+from discord.ext import commands
+
+from helpers.converters import time_string_to_hours, _parse_duration, _calendar_months_to_days
+
+try:
+    from dateutil.relativedelta import relativedelta
+except ImportError:
+    relativedelta = None
+
+
+DURATIONS = ("1m", "1w", "12h", "5y 3months 7h", "3m 7weeks", "2w 3d 12h")
+DEFAULT_NUMBER = 20000
+
+
+def old_time_string_to_hours(str_input: str) -> int:
+    """Parser before parsing was cached, pattern compiled on each call and each word parsed separately."""
+    compiled = re.compile("""(?:(?P<years>[0-9])(?:years?|y))?          # e.g. 2years or 2y
+                             (?:(?P<months>[0-9]{1,2})(?:months?|m))?   # e.g. 2months or 2m
+                             (?:(?P<weeks>[0-9]{1,4})(?:weeks?|w))?     # e.g. 10weeks or 10w
+                             (?:(?P<days>[0-9]{1,5})(?:days?|d))?       # e.g. 14days or 10d
+                             (?:(?P<hours>[0-9]{1,5})(?:hours?|h))?     # e.g. 12hours or 12h
+                          """, re.VERBOSE)
+    hours = 0
+    for word in str_input.split():
+        match = compiled.fullmatch(word)
+        if match is None or not match.group(0):
+            raise commands.BadArgument("Invalid time provided.")
+
+        time_data = {k: int(v) for k, v in match.groupdict(default=0).items()}
+        if relativedelta is not None:
+            now = datetime.datetime.utcnow()
+            td = (relativedelta(**time_data) + now) - now
+            hours += td.days * 24 + td.seconds // 3600
+        else:
+            days = _calendar_months_to_days(time_data["years"] * 12 + time_data["months"])
+            hours += (days + time_data["weeks"] * 7 + time_data["days"]) * 24 + time_data["hours"]
+    return hours
+
+
+def uncached_time_string_to_hours(str_input: str) -> int:
+    """Current parser without the parse cache, shows what the precompiled single pass parser alone gains."""
+    _parse_duration.cache_clear()
+    return time_string_to_hours(str_input)
+
+
+def benchmark(number: int):
+    parsers = (
+        ("old", old_time_string_to_hours),
+        ("uncached", uncached_time_string_to_hours),
+        ("cached", time_string_to_hours),
+    )
+    print(f"Microseconds per call, {number} calls per duration"
+          f"{'' if relativedelta is not None else ' (old parser without dateutil)'}")
+    print(f"{'duration':<16}" + "".join(f"{name:>12}" for name, _ in parsers))
+    for duration in DURATIONS:
+        for _name, parser in parsers:
+            if parser(duration) != old_time_string_to_hours(duration):
+                raise AssertionError(f"Parsers disagree on {duration!r}.")
+        times = [timeit.timeit(lambda: parser(duration), number=number) / number * 10 ** 6
+                 for _name, parser in parsers]
+        print(f"{duration:<16}" + "".join(f"{time:>12.2f}" for time in times))
+
+
+if __name__ == "__main__":
+    benchmark(int(sys.argv[1]) if len(sys.argv) > 1 else DEFAULT_NUMBER)
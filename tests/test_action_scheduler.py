@@ -0,0 +1,178 @@
+import time
+import asyncio
+import unittest
+
+from discord import HTTPException
+
+from helpers.action_scheduler import (
+    ActionScheduler, PRIORITY_REDEEM, PRIORITY_NOTIFICATION, member_roles_route, channel_messages_route
+)
+
+
+class FakeRateLimited(Exception):
+    """Fake 429 Too Many Requests response."""
+    def __init__(self, retry_after: float):
+        super().__init__(f"429, retry after {retry_after}s")
+        self.retry_after = retry_after
+
+
+def fake_retry_after(exception: Exception):
+    return exception.retry_after if isinstance(exception, FakeRateLimited) else None
+
+
+class FakeResponse:
+    """Fake aiohttp response that discord.HTTPException is created with."""
+    def __init__(self, status: int, reason: str, headers: dict):
+        self.status = status
+        self.reason = reason
+        self.headers = headers
+
+
+class FakeHTTPClient:
+    """
+    Records requests and responds with a fake 429 to the first rate_limited_requests requests.
+    """
+    def __init__(self, rate_limited_requests: int = 0, retry_after: float = 0.05):
+        self.rate_limited_requests = rate_limited_requests
+        self.retry_after = retry_after
+        # List of tuples (request name, monotonic time)
+        self.requests = []
+
+    async def request(self, name: str):
+        self.requests.append((name, time.monotonic()))
+        if self.rate_limited_requests > 0:
+            self.rate_limited_requests -= 1
+            raise FakeRateLimited(self.retry_after)
+        return name
+
+    @property
+    def completed(self):
+        return [name for name, _ in self.requests]
+
+
+def run(coroutine):
+    return asyncio.get_event_loop().run_until_complete(coroutine)
+
+
+class ActionSchedulerTest(unittest.TestCase):
+    def make_scheduler(self, route_limits=None) -> ActionScheduler:
+        return ActionScheduler(route_limits=route_limits, retry_after=fake_retry_after)
+
+    def test_rate_limited_action_is_retried_after_retry_after(self):
+        scheduler = self.make_scheduler()
+        client = FakeHTTPClient(rate_limited_requests=2, retry_after=0.05)
+
+        result = run(scheduler.run(member_roles_route(1), PRIORITY_REDEEM, lambda: client.request("add role")))
+
+        self.assertEqual(result, "add role")
+        self.assertEqual(len(client.requests), 3)
+        self.assertEqual(scheduler.rate_limited, 2)
+        # Each retry waits for the route to be unpaused
+        self.assertGreaterEqual(client.requests[1][1] - client.requests[0][1], 0.045)
+        self.assertGreaterEqual(client.requests[2][1] - client.requests[1][1], 0.045)
+
+    def test_discord_rate_limit_response_is_retried_after_retry_after_header(self):
+        # Default retry_after so the exception goes through discord_retry_after
+        scheduler = ActionScheduler()
+        request_times = []
+
+        async def rate_limited_once():
+            request_times.append(time.monotonic())
+            if len(request_times) == 1:
+                response = FakeResponse(429, "Too Many Requests", {"Retry-After": "0.1"})
+                raise HTTPException(response, {"message": "You are being rate limited.", "code": 0})
+            return "add role"
+
+        result = run(scheduler.run(member_roles_route(1), PRIORITY_REDEEM, rate_limited_once))
+
+        self.assertEqual(result, "add role")
+        self.assertEqual(len(request_times), 2)
+        self.assertEqual(scheduler.rate_limited, 1)
+        self.assertGreaterEqual(request_times[1] - request_times[0], 0.095)
+
+    def test_discord_error_response_is_not_retried(self):
+        scheduler = ActionScheduler()
+        calls = []
+
+        async def missing_permissions():
+            calls.append(1)
+            raise HTTPException(FakeResponse(403, "Forbidden", {}), {"message": "Missing Permissions", "code": 50013})
+
+        with self.assertRaises(HTTPException):
+            run(scheduler.run(member_roles_route(1), PRIORITY_REDEEM, missing_permissions))
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(scheduler.rate_limited, 0)
+
+    def test_action_fails_after_max_rate_limit_retries(self):
+        scheduler = self.make_scheduler()
+        client = FakeHTTPClient(rate_limited_requests=ActionScheduler.MAX_RATE_LIMIT_RETRIES + 1, retry_after=0.001)
+
+        with self.assertRaises(FakeRateLimited):
+            run(scheduler.run(member_roles_route(1), PRIORITY_REDEEM, lambda: client.request("add role")))
+        self.assertEqual(len(client.requests), ActionScheduler.MAX_RATE_LIMIT_RETRIES + 1)
+
+    def test_other_errors_are_not_retried(self):
+        scheduler = self.make_scheduler()
+        calls = []
+
+        async def failing_action():
+            calls.append(1)
+            raise ValueError("not a rate limit")
+
+        with self.assertRaises(ValueError):
+            run(scheduler.run(member_roles_route(1), PRIORITY_REDEEM, failing_action))
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(scheduler.rate_limited, 0)
+
+    def test_route_is_paced_by_token_bucket(self):
+        # 2 actions per 0.1s, first 2 go through at once and each next one waits for a new token
+        scheduler = self.make_scheduler({"messages": (2, 0.1)})
+        client = FakeHTTPClient()
+
+        async def send_all():
+            route = channel_messages_route(1)
+            return await asyncio.gather(*(scheduler.run(route, PRIORITY_NOTIFICATION,
+                                                        lambda i=i: client.request(i)) for i in range(5)))
+
+        start = time.monotonic()
+        self.assertEqual(run(send_all()), [0, 1, 2, 3, 4])
+        self.assertGreaterEqual(time.monotonic() - start, 0.14)
+
+    def test_higher_priority_action_skips_waiting_actions(self):
+        scheduler = self.make_scheduler({"member roles": (1, 0.05)})
+        client = FakeHTTPClient()
+
+        async def queue_actions():
+            route = member_roles_route(1)
+            notifications = [asyncio.ensure_future(scheduler.run(route, PRIORITY_NOTIFICATION,
+                                                                 lambda i=i: client.request(f"notification {i}")))
+                             for i in range(3)]
+            # Let the first notification take the only token
+            await asyncio.sleep(0.01)
+            redeem = scheduler.run(route, PRIORITY_REDEEM, lambda: client.request("redeem"))
+            await asyncio.gather(redeem, *notifications)
+
+        run(queue_actions())
+        self.assertEqual(client.completed, ["notification 0", "redeem", "notification 1", "notification 2"])
+
+    def test_rate_limit_only_pauses_its_own_route(self):
+        scheduler = self.make_scheduler()
+        limited_client = FakeHTTPClient(rate_limited_requests=1, retry_after=0.2)
+        client = FakeHTTPClient()
+
+        async def send_both():
+            limited = asyncio.ensure_future(scheduler.run(channel_messages_route(1), PRIORITY_NOTIFICATION,
+                                                          lambda: limited_client.request("channel 1")))
+            await asyncio.sleep(0.01)
+            start = time.monotonic()
+            await scheduler.run(channel_messages_route(2), PRIORITY_NOTIFICATION, lambda: client.request("channel 2"))
+            other_route_time = time.monotonic() - start
+            await limited
+            return other_route_time
+
+        self.assertLess(run(send_both()), 0.1)
+        self.assertEqual(limited_client.completed, ["channel 1", "channel 1"])
+
+
+if __name__ == "__main__":
+    unittest.main()
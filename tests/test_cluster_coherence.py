@@ -0,0 +1,112 @@
+import os
+import shutil
+import asyncio
+import tempfile
+import unittest
+from datetime import datetime, timedelta
+
+from database_handler import DatabaseHandler
+from helpers.sharding import ShardPartition
+
+
+"""
+Two database handlers on the same database file, each owning one of two shards, same as two cluster workers.
+
+In memory data (row counters, license filter, prefix cache, expiration scheduler) of a worker only
+follows writes made by that worker, which is why every write of guild data has to be made by the worker
+owning the guild. These tests check that and document what happens when a write is made by another worker.
+"""
+
+
+SHARD_COUNT = 2
+FIRST_GUILD = (1000 * SHARD_COUNT) << 22
+SECOND_GUILD = (1000 * SHARD_COUNT + 1) << 22
+
+
+def run(coroutine):
+    return asyncio.get_event_loop().run_until_complete(coroutine)
+
+
+class ClusterCoherenceTest(unittest.TestCase):
+    def setUp(self):
+        self._old_directory = os.getcwd()
+        self._directory = tempfile.mkdtemp()
+        os.chdir(self._directory)
+        self.first_worker = self.create_worker_database(0)
+        self.second_worker = self.create_worker_database(1)
+        run(self.first_worker.setup_new_guild(FIRST_GUILD, "!"))
+        run(self.second_worker.setup_new_guild(SECOND_GUILD, "?"))
+
+    def tearDown(self):
+        run(self.first_worker.close())
+        run(self.second_worker.close())
+        os.chdir(self._old_directory)
+        shutil.rmtree(self._directory, ignore_errors=True)
+
+    @classmethod
+    def create_worker_database(cls, shard_id: int) -> DatabaseHandler:
+        return run(DatabaseHandler.create_instance("cluster", reader_pool_size=1,
+                                                   shard_partition=ShardPartition(SHARD_COUNT, [shard_id])))
+
+    def test_counters_only_count_owned_guilds(self):
+        run(self.first_worker.generate_guild_licenses(3, FIRST_GUILD, 1, 10))
+        run(self.second_worker.generate_guild_licenses(5, SECOND_GUILD, 2, 10))
+        run(self.first_worker.reconcile_counters())
+        run(self.second_worker.reconcile_counters())
+
+        self.assertEqual(run(self.first_worker.get_stored_license_total_count()), 3)
+        self.assertEqual(run(self.second_worker.get_stored_license_total_count()), 5)
+
+    def test_owner_writes_are_seen_by_owner_caches(self):
+        licenses = run(self.first_worker.generate_guild_licenses(2, FIRST_GUILD, 1, 10))
+        run(self.first_worker.change_guild_prefix(FIRST_GUILD, "$"))
+
+        self.assertEqual(run(self.first_worker.get_guild_license_total_count(FIRST_GUILD)), 2)
+        self.assertTrue(run(self.first_worker.is_valid_license(licenses[0], FIRST_GUILD)))
+        self.assertEqual(run(self.first_worker.get_guild_prefix(FIRST_GUILD)), "$")
+
+    def test_other_worker_does_not_count_or_schedule_guilds_it_does_not_own(self):
+        expiration_date = datetime.now() + timedelta(hours=1)
+        run(self.second_worker.import_guild_licenses(FIRST_GUILD, [("IMPORTEDBYOTHER", 1, 10)]))
+        run(self.second_worker.add_new_licensed_member(123, FIRST_GUILD, expiration_date, 1))
+
+        self.assertEqual(run(self.second_worker.get_stored_license_total_count()), 0)
+        self.assertEqual(run(self.second_worker.get_licensed_roles_total_count()), 0)
+        # Otherwise it would try to expire it without having the guild
+        self.assertNotIn((123, 1), self.second_worker.expiration_scheduler)
+
+    def test_license_from_other_worker_is_rejected_until_filter_rebuild(self):
+        # Limit: license of our guild stored by another worker is not in our license filter
+        run(self.second_worker.import_guild_licenses(FIRST_GUILD, [("IMPORTEDBYOTHER", 1, 10)]))
+
+        self.assertFalse(run(self.first_worker.is_valid_license("IMPORTEDBYOTHER", FIRST_GUILD)))
+        self.assertEqual(run(self.first_worker.get_guild_license_total_count(FIRST_GUILD)), 0)
+
+        # Hourly reconcile fixes it
+        run(self.first_worker.rebuild_license_filter())
+        run(self.first_worker.reconcile_counters())
+        self.assertTrue(run(self.first_worker.is_valid_license("IMPORTEDBYOTHER", FIRST_GUILD)))
+        self.assertEqual(run(self.first_worker.get_guild_license_total_count(FIRST_GUILD)), 1)
+
+    def test_prefix_change_from_other_worker_is_seen_only_after_restart(self):
+        # Limit: prefix cache is never reconciled
+        run(self.second_worker.change_guild_prefix(FIRST_GUILD, "$"))
+        self.assertEqual(run(self.first_worker.get_guild_prefix(FIRST_GUILD)), "!")
+
+        run(self.first_worker.close())
+        self.first_worker = self.create_worker_database(0)
+        self.assertEqual(run(self.first_worker.get_guild_prefix(FIRST_GUILD)), "$")
+
+    def test_licensed_member_from_other_worker_is_scheduled_only_after_restart(self):
+        # Limit: expiration scheduler is only loaded at startup
+        expiration_date = datetime.now() + timedelta(hours=1)
+        run(self.second_worker.add_new_licensed_member(123, FIRST_GUILD, expiration_date, 1))
+        self.assertNotIn((123, 1), self.first_worker.expiration_scheduler)
+
+        run(self.first_worker.close())
+        self.first_worker = self.create_worker_database(0)
+        self.assertIn((123, 1), self.first_worker.expiration_scheduler)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,106 @@
+import asyncio
+import unittest
+
+from helpers.cluster_ipc import ClusterCoordinator, ClusterClient, ClusterRequestError
+
+
+SHARD_COUNT = 2
+SECRET = "secret"
+
+
+def guild_on_shard(shard_id: int) -> int:
+    """:return: guild id that Discord puts on shard_id"""
+    return (1000 * SHARD_COUNT + shard_id) << 22
+
+
+def run(coroutine):
+    return asyncio.get_event_loop().run_until_complete(coroutine)
+
+
+class ClusterIPCTest(unittest.TestCase):
+    def setUp(self):
+        self.coordinator = ClusterCoordinator(SHARD_COUNT, SECRET)
+        run(self.coordinator.start())
+        self.clients = []
+
+    def tearDown(self):
+        for client in self.clients:
+            run(client.close())
+        run(self.coordinator.close())
+
+    def connect_worker(self, shard_ids, secret=SECRET) -> ClusterClient:
+        client = ClusterClient("127.0.0.1", self.coordinator.port, secret, shard_ids)
+        run(client.connect())
+        self.clients.append(client)
+        return client
+
+    def test_request_is_handled_by_worker_owning_the_guild(self):
+        first_worker = self.connect_worker([0])
+        second_worker = self.connect_worker([1])
+
+        async def whoami(guild_id):
+            return {"worker": 1, "guild_id": guild_id}
+
+        async def not_called(guild_id):
+            raise AssertionError("Request routed to the wrong worker.")
+
+        first_worker.register("whoami", not_called)
+        second_worker.register("whoami", whoami)
+        guild_id = guild_on_shard(1)
+
+        result = run(first_worker.request("whoami", guild_id, {"guild_id": guild_id}))
+        self.assertEqual(result, {"worker": 1, "guild_id": guild_id})
+
+    def test_handler_exception_is_raised_in_requesting_worker(self):
+        first_worker = self.connect_worker([0])
+        second_worker = self.connect_worker([1])
+
+        async def failing():
+            raise ValueError("no permissions")
+
+        second_worker.register("fail", failing)
+        with self.assertRaisesRegex(ClusterRequestError, "no permissions"):
+            run(first_worker.request("fail", guild_on_shard(1), {}))
+
+    def test_request_to_disconnected_worker_fails(self):
+        first_worker = self.connect_worker([0])
+
+        with self.assertRaisesRegex(ClusterRequestError, "not connected"):
+            run(first_worker.request("whoami", guild_on_shard(1), {}))
+
+    def test_gather_collects_results_from_all_workers(self):
+        first_worker = self.connect_worker([0])
+        second_worker = self.connect_worker([1])
+
+        async def totals_first():
+            return [1, 10]
+
+        async def totals_second():
+            return [2, 20]
+
+        first_worker.register("totals", totals_first)
+        second_worker.register("totals", totals_second)
+
+        self.assertEqual(sorted(run(second_worker.gather("totals", {}))), [[1, 10], [2, 20]])
+
+    def test_gather_skips_failed_workers(self):
+        first_worker = self.connect_worker([0])
+        self.connect_worker([1])
+
+        async def totals():
+            return [1, 10]
+
+        # Second worker has no handler registered
+        first_worker.register("totals", totals)
+
+        self.assertEqual(run(first_worker.gather("totals", {})), [[1, 10]])
+
+    def test_connection_with_wrong_secret_is_rejected(self):
+        client = ClusterClient("127.0.0.1", self.coordinator.port, "wrong", [0])
+        with self.assertRaises(ConnectionError):
+            run(client.connect())
+        self.assertEqual(self.coordinator.get_connected_shard_ids(), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
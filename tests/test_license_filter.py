@@ -0,0 +1,78 @@
+import os
+import shutil
+import asyncio
+import tempfile
+import unittest
+
+from database_handler import DatabaseHandler
+
+
+GUILD_ID = 1
+
+
+def run(coroutine):
+    return asyncio.get_event_loop().run_until_complete(coroutine)
+
+
+class LicenseFilterRebuildTest(unittest.TestCase):
+    def setUp(self):
+        self._old_directory = os.getcwd()
+        self._directory = tempfile.mkdtemp()
+        os.chdir(self._directory)
+        self.database = run(DatabaseHandler.create_instance("filter", reader_pool_size=1))
+        run(self.database.setup_new_guild(GUILD_ID, "!"))
+
+    def tearDown(self):
+        run(self.database.close())
+        os.chdir(self._old_directory)
+        shutil.rmtree(self._directory, ignore_errors=True)
+
+    def delay_commit_with_rebuild(self):
+        """
+        Makes the next commit start a filter rebuild and wait a bit before committing, so the rebuild
+        runs while the transaction has already added it's licenses to the filter but hasn't committed them.
+        :return: list that gets the rebuild task
+        """
+        connection = self.database.connection
+        commit = connection.commit
+        rebuilds = []
+
+        async def delayed_commit():
+            connection.commit = commit
+            rebuilds.append(asyncio.ensure_future(self.database.rebuild_license_filter()))
+            await asyncio.sleep(0.2)
+            await commit()
+
+        connection.commit = delayed_commit
+        return rebuilds
+
+    def test_rebuild_during_uncommitted_generate_keeps_generated_licenses(self):
+        rebuilds = self.delay_commit_with_rebuild()
+
+        licenses = run(self.database.generate_guild_licenses(20, GUILD_ID, 5, 10))
+        run(rebuilds[0])
+
+        for license in licenses:
+            self.assertTrue(run(self.database.is_valid_license(license, GUILD_ID)))
+
+    def test_rebuild_during_uncommitted_import_keeps_imported_licenses(self):
+        rebuilds = self.delay_commit_with_rebuild()
+
+        run(self.database.import_guild_licenses(GUILD_ID, [("IMPORTED1", 5, 10), ("IMPORTED2", 5, 10)]))
+        run(rebuilds[0])
+
+        self.assertTrue(run(self.database.is_valid_license("IMPORTED1", GUILD_ID)))
+        self.assertTrue(run(self.database.is_valid_license("IMPORTED2", GUILD_ID)))
+
+    def test_rebuild_removes_deleted_licenses(self):
+        licenses = run(self.database.generate_guild_licenses(2, GUILD_ID, 5, 10))
+        run(self.database.delete_license(licenses[0], GUILD_ID))
+
+        run(self.database.rebuild_license_filter())
+
+        self.assertNotIn(licenses[0], self.database.license_filter)
+        self.assertIn(licenses[1], self.database.license_filter)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,100 @@
+import asyncio
+import unittest
+
+from helpers.member_cache import MemberLookupCache
+
+
+GUILD_ID = 1
+
+
+def run(coroutine):
+    return asyncio.get_event_loop().run_until_complete(coroutine)
+
+
+class FakeMember:
+    def __init__(self, member_id: int):
+        self.id = member_id
+
+
+class FakeGuild:
+    """Guild without gateway cache whose member requests take a while and are counted."""
+    def __init__(self, member_ids, query_delay: float = 0.1):
+        self.id = GUILD_ID
+        self.member_ids = set(member_ids)
+        self.query_delay = query_delay
+        self.queried = []
+        self.fetched = []
+
+    def get_member(self, member_id):
+        return None
+
+    async def query_members(self, user_ids, limit, cache):
+        self.queried.append(list(user_ids))
+        await asyncio.sleep(self.query_delay)
+        return [FakeMember(member_id) for member_id in user_ids if member_id in self.member_ids]
+
+    async def fetch_member(self, member_id):
+        self.fetched.append(member_id)
+        return FakeMember(member_id)
+
+
+class MemberLookupCacheTest(unittest.TestCase):
+    def test_lookup_waits_for_prefetch_in_progress(self):
+        cache = MemberLookupCache()
+        guild = FakeGuild([1, 2])
+
+        async def prefetch_and_lookup():
+            prefetch = asyncio.ensure_future(cache.prefetch(guild, [1, 2, 3]))
+            await asyncio.sleep(0)
+            members = await asyncio.gather(*(cache.get_member(guild, member_id) for member_id in (1, 2, 3)))
+            await prefetch
+            return members
+
+        first, second, missing = run(prefetch_and_lookup())
+
+        self.assertEqual((first.id, second.id, missing), (1, 2, None))
+        self.assertEqual(len(guild.queried), 1)
+        self.assertEqual(guild.fetched, [])
+
+    def test_lookup_of_member_not_being_prefetched_doesnt_wait(self):
+        cache = MemberLookupCache()
+        guild = FakeGuild([1, 2], query_delay=10)
+
+        async def prefetch_and_lookup():
+            prefetch = asyncio.ensure_future(cache.prefetch(guild, [1]))
+            await asyncio.sleep(0)
+            member = await asyncio.wait_for(cache.get_member(guild, 2), 1)
+            prefetch.cancel()
+            await asyncio.wait([prefetch])
+            return member
+
+        self.assertEqual(run(prefetch_and_lookup()).id, 2)
+        self.assertEqual(guild.fetched, [2])
+        self.assertEqual(cache._in_flight, {})
+
+    def test_forget_removes_negative_entry(self):
+        cache = MemberLookupCache()
+        guild = FakeGuild([])
+        run(cache.prefetch(guild, [1]))
+        self.assertIsNone(run(cache.get_member(guild, 1)))
+
+        # Member joins
+        guild.member_ids.add(1)
+        cache.forget(GUILD_ID, 1)
+
+        self.assertEqual(run(cache.get_member(guild, 1)).id, 1)
+        self.assertEqual(guild.fetched, [1])
+
+    def test_lookup_without_negative_cache_fetches_again(self):
+        cache = MemberLookupCache()
+        guild = FakeGuild([])
+        run(cache.prefetch(guild, [1]))
+        guild.member_ids.add(1)
+
+        self.assertIsNone(run(cache.get_member(guild, 1)))
+        self.assertEqual(run(cache.get_member(guild, 1, use_negative_cache=False)).id, 1)
+        self.assertEqual(guild.fetched, [1])
+
+
+if __name__ == "__main__":
+    unittest.main()